@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+HealthGuard 在线备份
+用 SQLite 在线备份接口逐库（目录库、各分片库、归档库）按页分步复制，步间休眠让出 I/O，服务运行期间也能
+得到一致的副本，不会像直接复制文件那样拷到写了一半的页。WAL 模式下复制前在源连接上开启读事务固定快照，
+期间的写入既不受阻塞也不会让复制从头重来。每个快照是 BACKUP_DIR 下以时间命名的目录，完成后写入
+manifest.json，按 KEEP 保留最近的快照。
+
+用法:
+    python backup.py                      # 立即生成一个快照
+    python backup.py --list               # 列出已有快照
+    python backup.py --verify [快照名]    # 校验快照（默认最新）中每个库的完整性
+    python backup.py --restore 快照名     # 停止服务后执行：先备份当前库，再恢复为指定快照
+"""
+
+import argparse
+import glob
+import json
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+import database
+
+BACKUP_DIR = 'backups'  # 相对 DB_FILE 所在目录
+STEP_PAGES = 128        # 每步复制的页数
+STEP_PAUSE = 0.02       # 两步之间休眠的秒数
+KEEP = 7                # 保留的快照个数
+MANIFEST = 'manifest.json'
+
+
+class _Restarted(Exception):
+    """源库被其他连接修改，SQLite 将从头重新复制"""
+
+
+def backup_root():
+    return os.path.join(os.path.dirname(database.DB_FILE) or '.', BACKUP_DIR)
+
+
+def sources():
+    """需要备份的库文件 [(快照内的相对路径, 源路径)]"""
+    files = [(os.path.basename(path), path) for path in database.database_paths()]
+    archive_dir = os.path.join(os.path.dirname(database.DB_FILE) or '.', database.ARCHIVE_DIR)
+    for path in sorted(glob.glob(os.path.join(archive_dir, '*.db'))):
+        files.append((os.path.join(database.ARCHIVE_DIR, os.path.basename(path)), path))
+    return files
+
+
+def copy_database(src_path, dst_path, pages=STEP_PAGES, pause=STEP_PAUSE):
+    """把 src_path 在线复制到 dst_path，返回 {pages, restarts, seconds}
+
+    非 WAL 模式无法在不阻塞写入的前提下固定快照：源库每被其他连接修改一次复制就从头开始，
+    此时每次重来步长翻倍，保证写入频繁时也能完成（代价是最后几步持有读锁的时间更长）。
+    """
+    started = time.perf_counter()
+    tmp = dst_path + '.part'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    src = sqlite3.connect(src_path, isolation_level=None)
+    dst = sqlite3.connect(tmp)
+    result = {"pages": 0, "restarts": 0}
+    try:
+        if src.execute("PRAGMA journal_mode").fetchone()[0] == 'wal':
+            src.execute("BEGIN")
+            src.execute("SELECT count(*) FROM sqlite_master")  # 取得读快照
+        step = pages
+        while True:
+            last = []
+
+            def progress(status, remaining, total):
+                result["pages"] = total
+                if last and remaining > last[0]:
+                    raise _Restarted()
+                last[:] = [remaining]
+                time.sleep(pause)
+
+            try:
+                src.backup(dst, pages=step, progress=progress)
+                break
+            except _Restarted:
+                result["restarts"] += 1
+                step *= 2
+        dst.execute("PRAGMA journal_mode = DELETE")  # 快照是单个自包含文件，只读打开时不需要 -wal/-shm
+    finally:
+        if src.in_transaction:
+            src.execute("COMMIT")
+        src.close()
+        dst.close()
+    os.replace(tmp, dst_path)
+    result["seconds"] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def snapshot(pages=STEP_PAGES, pause=STEP_PAUSE, keep=KEEP):
+    """生成一个快照并清理超出 keep 的旧快照，返回快照名
+
+    各库依次复制，每个库内部是一致的；目录库与分片库之间相差复制所用的时间。
+    """
+    name = datetime.now().strftime('%Y%m%d-%H%M%S')
+    if os.path.exists(os.path.join(backup_root(), name)):
+        name += f"-{len(glob.glob(os.path.join(backup_root(), name + '*')))}"
+    target = os.path.join(backup_root(), name)
+    partial = target + '.partial'  # 复制完成前的目录名，中断后留下的不算快照，下次清理
+    files = {}
+    for rel, path in sources():
+        dst = os.path.join(partial, rel)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        files[rel] = copy_database(path, dst, pages, pause)
+    with open(os.path.join(partial, MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump({"created": datetime.now().strftime('%Y-%m-%d %H:%M:%S'), "shards": database.SHARDS,
+                   "files": files}, f, ensure_ascii=False, indent=2)
+    os.replace(partial, target)
+    prune(keep)
+    return name
+
+
+def list_snapshots():
+    """已完成的快照名，从旧到新"""
+    return sorted(os.path.basename(os.path.dirname(path))
+                  for path in glob.glob(os.path.join(backup_root(), '*', MANIFEST)))
+
+
+def prune(keep=KEEP):
+    """只保留最近 keep 个快照，并删除中断遗留的未完成快照"""
+    for name in list_snapshots()[:-keep or None]:
+        shutil.rmtree(os.path.join(backup_root(), name))
+    for path in glob.glob(os.path.join(backup_root(), '*.partial')):
+        shutil.rmtree(path)
+
+
+def load_manifest(name):
+    with open(os.path.join(backup_root(), name, MANIFEST), encoding='utf-8') as f:
+        return json.load(f)
+
+
+def verify(name=None):
+    """校验快照：清单中的每个库都存在、页数与备份时一致且 integrity_check 通过；返回 (是否通过, [问题])"""
+    name = name or (list_snapshots() or [None])[-1]
+    if name is None:
+        return False, ["没有可用的快照"]
+    problems = []
+    for rel, info in load_manifest(name)["files"].items():
+        path = os.path.join(backup_root(), name, rel)
+        if not os.path.exists(path):
+            problems.append(f"{rel}: 文件缺失")
+            continue
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            pages = conn.execute("PRAGMA page_count").fetchone()[0]
+            check = [row[0] for row in conn.execute("PRAGMA integrity_check").fetchall()]
+        except sqlite3.DatabaseError as e:
+            problems.append(f"{rel}: {e}")
+            continue
+        finally:
+            conn.close()
+        if pages != info["pages"]:
+            problems.append(f"{rel}: 页数 {pages} 与备份时的 {info['pages']} 不一致")
+        if check != ['ok']:
+            problems.append(f"{rel}: " + '; '.join(check[:5]))
+    return not problems, problems
+
+
+def restore(name):
+    """把当前库恢复为快照（须先停止服务）：校验快照，备份当前库，再逐库写回，返回恢复前的快照名
+
+    写回也走备份接口，库文件的 WAL 由 SQLite 一并处理；快照之后新建的归档库移除。
+    """
+    ok, problems = verify(name)
+    if not ok:
+        raise RuntimeError(f"快照 {name} 校验未通过: {problems}")
+    manifest = load_manifest(name)
+    if manifest["shards"] != database.SHARDS:
+        raise RuntimeError(f"快照按 {manifest['shards']} 个分片备份，当前 SHARDS = {database.SHARDS}")
+    before = snapshot(keep=len(list_snapshots()) + 1)
+    root = os.path.dirname(database.DB_FILE) or '.'
+    for rel, path in sources():
+        if rel not in manifest["files"] and rel.startswith(database.ARCHIVE_DIR + os.sep):
+            os.remove(path)
+    for rel in manifest["files"]:
+        dst_path = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(dst_path) or '.', exist_ok=True)
+        src = sqlite3.connect(f"file:{os.path.join(backup_root(), name, rel)}?mode=ro", uri=True)
+        dst = sqlite3.connect(dst_path)
+        try:
+            src.backup(dst)
+        finally:
+            src.close()
+            dst.close()
+    return before
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HealthGuard 在线备份")
+    parser.add_argument("--list", action="store_true", help="列出已有快照")
+    parser.add_argument("--verify", nargs="?", const="", metavar="快照", help="校验快照（默认最新）")
+    parser.add_argument("--restore", metavar="快照", help="恢复为指定快照（须先停止服务）")
+    args = parser.parse_args()
+
+    if args.list:
+        for name in list_snapshots():
+            manifest = load_manifest(name)
+            size = sum(os.path.getsize(os.path.join(backup_root(), name, rel)) for rel in manifest["files"])
+            print(f"{name}  {len(manifest['files'])} 个库  {size / 1024 / 1024:.1f} MB")
+    elif args.verify is not None:
+        ok, problems = verify(args.verify or None)
+        print("✅ 快照完整" if ok else "❌ 快照有问题")
+        for problem in problems:
+            print(f"   {problem}")
+    elif args.restore:
+        before = restore(args.restore)
+        print(f"✅ 已恢复为 {args.restore}（恢复前的数据已备份为 {before}）")
+    else:
+        started = time.perf_counter()
+        name = snapshot()
+        print(f"✅ 快照 {name} 完成，用时 {time.perf_counter() - started:.1f} 秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+数据库查询层微基准：比较 SELECT * + dict(row) 与列投影 + 元组/namedtuple 的行物化速度
+
+用法:
+    python bench_db.py --rows 200000
+"""
+
+import os
+import time
+import random
+import argparse
+import tempfile
+import database
+import migrations
+
+DASHBOARD_COLUMNS = ('record_date', 'weight', 'steps', 'systolic_bp')
+
+
+def seed(rows):
+    """在临时数据库中为单个用户生成 rows 条健康记录"""
+    database.DB_FILE = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    database.init_db()
+    migrations.migrate()
+    conn = database.get_connection(1)
+    batch = [(1, f"2020-01-{i % 28 + 1:02d}", 60 + random.random() * 20, 120, 80, random.randint(0, 20000),
+              70, 5.4, 36.6, 7.5, 1800, "今天感觉不错，按时服药，晚饭后散步三十分钟。")
+             for i in range(rows)]
+    database.insert_health_records(conn, batch)
+    conn.commit()
+    conn.close()
+
+
+def legacy_select(user_id):
+    """改造前的实现：每次新建连接，SELECT * 后逐行 dict()"""
+    conn = database.get_connection(user_id)
+    rows = conn.execute("SELECT * FROM health_data WHERE user_id = ? ORDER BY record_date ASC",
+                        (user_id,)).fetchall()
+    conn.close()
+    return [dict(row) for row in rows]
+
+
+def measure(label, func, rows, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    assert len(result) == rows
+    print(f"{label:<36} {rows / best:>12,.0f} 行/秒   ({best * 1000:.1f} ms)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="查询层行物化基准")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    seed(args.rows)
+    print(f"数据量: {args.rows} 行\n")
+    measure("SELECT * + dict(row)（旧实现）", lambda: legacy_select(1), args.rows, args.repeat)
+    measure("全部列 -> dict", lambda: database.get_user_records(1), args.rows, args.repeat)
+    measure("4 列投影 -> dict",
+            lambda: database.get_user_records(1, DASHBOARD_COLUMNS), args.rows, args.repeat)
+    measure("4 列投影 -> namedtuple",
+            lambda: database.get_user_records(1, DASHBOARD_COLUMNS, 'namedtuple'), args.rows, args.repeat)
+    measure("4 列投影 -> tuple",
+            lambda: database.get_user_records(1, DASHBOARD_COLUMNS, 'tuple'), args.rows, args.repeat)
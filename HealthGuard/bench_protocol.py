@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+协议层基准：比较大列表响应（如一年以上的 get_records）在各序列化/线路编码方案下的编码/解码耗时与体积
+
+用法:
+    python bench_protocol.py --rows 5000
+"""
+
+import json
+import time
+import random
+import argparse
+import protocol
+
+
+def make_records(rows):
+    """构造与 get_user_records 返回结构一致的记录列表"""
+    return [{
+        "id": i, "user_id": 1, "record_date": f"2024-{i // 28 % 12 + 1:02d}-{i % 28 + 1:02d}",
+        "weight": round(60 + random.random() * 20, 1), "systolic_bp": random.randint(100, 140),
+        "diastolic_bp": random.randint(60, 90), "steps": random.randint(0, 20000),
+        "heart_rate": random.randint(55, 100), "blood_sugar": 5.4, "temperature": 36.6,
+        "sleep_hours": 7.5, "water_intake": 1800, "notes": "感觉良好" if i % 3 else None,
+    } for i in range(rows)]
+
+
+def measure(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def report(label, encode, decode, repeat):
+    enc_time, data = measure(encode, repeat)
+    dec_time, _ = measure(lambda: decode(data), repeat)
+    size = len(data[1]) if isinstance(data, tuple) else len(data)
+    print(f"{label:<28} {size:>10,} 字节   编码 {enc_time * 1000:7.2f} ms   解码 {dec_time * 1000:7.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="协议层序列化基准")
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    response = {"status": "success", "data": make_records(args.rows)}
+    print(f"响应: {args.rows} 条记录\n")
+
+    report("json.dumps().encode()（旧）", lambda: json.dumps(response).encode('utf-8'),
+           lambda d: json.loads(d.decode('utf-8')), args.repeat)
+    stdlib = protocol.get_serializer('json')
+    report("JsonSerializer", lambda: stdlib.dumps(response), stdlib.loads, args.repeat)
+    if protocol.orjson is not None:
+        fast = protocol.get_serializer('orjson')
+        report("OrjsonSerializer", lambda: fast.dumps(response), fast.loads, args.repeat)
+    else:
+        print("（未安装 orjson，跳过）")
+
+    columnar = protocol.Connection(None, protocol.get_serializer())
+    columnar.upgrade('columnar')
+    report("columnar（二进制列式）", lambda: columnar.encode(response)[1],
+           lambda d: columnar.decode(protocol.FLAG_COLUMNAR, d), args.repeat)
+
+    # 在各编码之上叠加压缩，统计压缩比与 CPU 耗时
+    print()
+    for codec in ('json', 'columnar'):
+        for name in protocol.compressions():
+            conn = protocol.Connection(None, protocol.get_serializer())
+            conn.upgrade(codec, name)
+            report(f"{codec} + {name}", lambda: conn.encode(response), lambda d: conn.decode(*d), args.repeat)
+            print(f"{'':<28} {conn.compression_summary()}")
@@ -1,7 +1,7 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 import socket
-import json
+import protocol
 import datetime
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 from matplotlib.figure import Figure
@@ -14,6 +14,8 @@ matplotlib.rcParams['axes.unicode_minus'] = False
 # 配置服务器地址
 SERVER_IP = '127.0.0.1'
 SERVER_PORT = 9999
+# 管理员用户列表每页加载的条数（满页时可点"加载更多"继续）
+USER_PAGE_SIZE = 200
 
 # --- 配色方案 (现代化扁平风格 - 健康医疗主题) ---
 COLORS = {
@@ -53,21 +55,91 @@ FONT_small = (FONT_FAMILY, 9)
 class NetworkClient:
     """网络通信模块"""
     def __init__(self):
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.token = None  # 登录后由服务端签发的会话令牌
+        self.serializer = protocol.get_serializer()
         try:
-            self.sock.connect((SERVER_IP, SERVER_PORT))
+            self.connect()
         except ConnectionRefusedError:
             messagebox.showerror("连接失败", f"无法连接到服务器 {SERVER_IP}:{SERVER_PORT}\n请确认服务端已启动。")
             exit()
 
-    def send_request(self, action, payload=None):
+    def connect(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.connect((SERVER_IP, SERVER_PORT))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        protocol.enable_keepalive(self.sock)
+        self.conn = protocol.Connection(self.sock, self.serializer)
+        # 协商二进制列式编码与压缩；旧版服务端不认识 hello 时继续使用 JSON
+        resp = self.send_request("hello", {"codecs": list(protocol.CODECS),
+                                           "compression": list(protocol.compressions())}, retry=False)
+        if resp.get("status") == "success":
+            self.conn.upgrade(resp["data"]["codec"], resp["data"].get("compression"))
+
+    def send_request(self, action, payload=None, retry=True):
         request = {"action": action, "payload": payload or {}}
+        if self.token:
+            request["token"] = self.token
         try:
-            self.sock.send(json.dumps(request).encode('utf-8'))
-            response_data = self.sock.recv(1024*1024).decode('utf-8')
-            return json.loads(response_data)
+            self.conn.send(request)
+            response = self.conn.recv()
+            if response is None:
+                raise ConnectionError("服务器已断开连接")
+        except OSError as e:
+            # 断线后自动重连，并用会话令牌恢复登录状态，无需重新输入密码
+            if retry and self.reconnect():
+                return self.send_request(action, payload, retry=False)
+            return {"status": "error", "message": str(e)}
         except Exception as e:
             return {"status": "error", "message": str(e)}
+
+        if action == "login" and response.get("status") == "success":
+            self.token = response["data"].get("token")
+        elif action == "logout":
+            self.token = None
+        return response
+
+    def pipeline(self, requests):
+        """一次往返发送多个互不依赖的请求，如 [("get_records", {...}), ("get_goals", {...})]"""
+        batch = []
+        for action, payload in requests:
+            request = {"action": action, "payload": payload or {}}
+            if self.token:
+                request["token"] = self.token
+            batch.append(request)
+        if not self.conn.framed:
+            # 旧版服务端不支持流水线，退化为逐个请求
+            return [self.send_request(action, payload) for action, payload in requests]
+        try:
+            return self.conn.pipeline(batch)
+        except Exception as e:
+            return [{"status": "error", "message": str(e)} for _ in requests]
+
+    def ping(self):
+        """应用层心跳：刷新服务端的空闲计时，连接已断开时自动重连"""
+        return self.send_request("ping")
+
+    def poll_events(self):
+        """取出服务端推送的事件（如管理员新发送的通知）"""
+        events = list(self.conn.events)
+        self.conn.events.clear()
+        return events
+
+    def compression_stats(self):
+        """本连接的压缩比与压缩/解压 CPU 耗时"""
+        return dict(self.conn.stats, ratio=self.conn.compression_ratio())
+
+    def reconnect(self):
+        """重新建立连接，若持有令牌则通过 resume_session 恢复会话"""
+        try:
+            self.sock.close()
+            self.connect()
+        except OSError:
+            return False
+        if self.token:
+            resp = self.send_request("resume_session", {"token": self.token}, retry=False)
+            if resp.get("status") != "success":
+                self.token = None
+        return True
     
     def close(self):
         self.sock.close()
@@ -1333,6 +1405,16 @@ class AdminUserPage(tk.Frame):
         RoundedButton(action_bar, text="📢 发送通知", command=self.send_msg_dialog,
                       bg_color=COLORS['success'], width=120, height=36).pack(side=tk.RIGHT, padx=10)
         
+        # 3. 分页栏：显示已加载条数，满页时可继续加载（先于列表 pack，保证总在底部可见）
+        footer = tk.Frame(self, bg=COLORS['main_bg'])
+        footer.pack(side=tk.BOTTOM, fill='x', pady=(10, 0))
+        self.count_label = tk.Label(footer, text="", bg=COLORS['main_bg'], font=FONT_body)
+        self.count_label.pack(side=tk.LEFT)
+        self.more_btn = RoundedButton(footer, text="⬇ 加载更多", command=self.load_more,
+                                      bg_color=COLORS['primary'], width=120, height=36)
+        self.query = None
+        self.loaded = 0
+
         # 2. 用户列表 (表格)
         list_card = tk.Frame(self, bg='white')
         list_card.pack(fill='both', expand=True)
@@ -1361,12 +1443,17 @@ class AdminUserPage(tk.Frame):
         self.load_users()
 
     def load_users(self):
-        # 清空现有数据
+        # 清空现有数据，从第一页重新加载
         self.tree.delete(*self.tree.get_children())
-        
-        # 发送请求
         query = self.search_entry.get().strip() # 使用 RoundedEntry 的 get
-        resp = self.controller.network.send_request("get_all_users", {"query": query if query else None})
+        self.query = query if query else None
+        self.loaded = 0
+        self.load_more()
+
+    def load_more(self):
+        resp = self.controller.network.send_request("get_all_users", {"query": self.query,
+                                                                      "limit": USER_PAGE_SIZE,
+                                                                      "offset": self.loaded})
         
         if resp['status'] == 'success':
             for user in resp['data']:
@@ -1374,6 +1461,19 @@ class AdminUserPage(tk.Frame):
                     user['id'], user['username'], user['gender'], 
                     user['age'], user['created_at']
                 ))
+            self.loaded += len(resp['data'])
+            # 检索结果有总数上限（truncated），到上限后提示细化检索词
+            has_more = resp.get('has_more', len(resp['data']) == USER_PAGE_SIZE)
+            text = f"已显示 {self.loaded} 个用户"
+            if has_more:
+                text += "，还有更多"
+            elif resp.get('truncated'):
+                text += "（检索结果已达上限，请细化检索词）"
+            self.count_label.config(text=text)
+            if has_more:
+                self.more_btn.pack(side=tk.RIGHT)
+            else:
+                self.more_btn.pack_forget()
         else:
             messagebox.showerror("错误", "无法加载用户列表")
 
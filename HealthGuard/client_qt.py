@@ -1,6 +1,6 @@
 import sys
 import os
-import json
+import protocol
 import socket
 import datetime
 import requests
@@ -32,6 +32,8 @@ matplotlib.rcParams['axes.unicode_minus'] = False
 # Configuration
 SERVER_IP = '127.0.0.1'
 SERVER_PORT = 9999
+# 管理员用户列表每页加载的条数（还有更多时可点"加载更多"继续）
+USER_PAGE_SIZE = 200
 
 COLORS = {
     'sidebar_bg': '#001529',
@@ -55,22 +57,92 @@ FONT_FAMILY = "Microsoft YaHei"
 
 class NetworkClient:
     def __init__(self):
-        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.token = None  # 登录后由服务端签发的会话令牌
+        self.serializer = protocol.get_serializer()
         try:
-            self.sock.connect((SERVER_IP, SERVER_PORT))
+            self.connect()
         except ConnectionRefusedError:
             # We can't use QMessageBox here easily without a window, but we'll try
             print(f"无法连接到服务器 {SERVER_IP}:{SERVER_PORT}")
             sys.exit(1)
 
-    def send_request(self, action, payload=None):
+    def connect(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.connect((SERVER_IP, SERVER_PORT))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        protocol.enable_keepalive(self.sock)
+        self.conn = protocol.Connection(self.sock, self.serializer)
+        # 协商二进制列式编码与压缩；旧版服务端不认识 hello 时继续使用 JSON
+        resp = self.send_request("hello", {"codecs": list(protocol.CODECS),
+                                           "compression": list(protocol.compressions())}, retry=False)
+        if resp.get("status") == "success":
+            self.conn.upgrade(resp["data"]["codec"], resp["data"].get("compression"))
+
+    def send_request(self, action, payload=None, retry=True):
         request = {"action": action, "payload": payload or {}}
+        if self.token:
+            request["token"] = self.token
         try:
-            self.sock.send(json.dumps(request).encode('utf-8'))
-            response_data = self.sock.recv(1024*1024).decode('utf-8')
-            return json.loads(response_data)
+            self.conn.send(request)
+            response = self.conn.recv()
+            if response is None:
+                raise ConnectionError("服务器已断开连接")
+        except OSError as e:
+            # 断线后自动重连，并用会话令牌恢复登录状态，无需重新输入密码
+            if retry and self.reconnect():
+                return self.send_request(action, payload, retry=False)
+            return {"status": "error", "message": str(e)}
         except Exception as e:
             return {"status": "error", "message": str(e)}
+
+        if action == "login" and response.get("status") == "success":
+            self.token = response["data"].get("token")
+        elif action == "logout":
+            self.token = None
+        return response
+
+    def pipeline(self, requests):
+        """一次往返发送多个互不依赖的请求，如 [("get_records", {...}), ("get_goals", {...})]"""
+        batch = []
+        for action, payload in requests:
+            request = {"action": action, "payload": payload or {}}
+            if self.token:
+                request["token"] = self.token
+            batch.append(request)
+        if not self.conn.framed:
+            # 旧版服务端不支持流水线，退化为逐个请求
+            return [self.send_request(action, payload) for action, payload in requests]
+        try:
+            return self.conn.pipeline(batch)
+        except Exception as e:
+            return [{"status": "error", "message": str(e)} for _ in requests]
+
+    def ping(self):
+        """应用层心跳：刷新服务端的空闲计时，连接已断开时自动重连"""
+        return self.send_request("ping")
+
+    def poll_events(self):
+        """取出服务端推送的事件（如管理员新发送的通知）"""
+        events = list(self.conn.events)
+        self.conn.events.clear()
+        return events
+
+    def compression_stats(self):
+        """本连接的压缩比与压缩/解压 CPU 耗时"""
+        return dict(self.conn.stats, ratio=self.conn.compression_ratio())
+
+    def reconnect(self):
+        """重新建立连接，若持有令牌则通过 resume_session 恢复会话"""
+        try:
+            self.sock.close()
+            self.connect()
+        except OSError:
+            return False
+        if self.token:
+            resp = self.send_request("resume_session", {"token": self.token}, retry=False)
+            if resp.get("status") != "success":
+                self.token = None
+        return True
     
     def close(self):
         self.sock.close()
@@ -933,7 +1005,12 @@ class UserChartsPage(QWidget):
         banner_widget.deleteLater()
 
     def load_data(self):
-        resp = self.app_manager.network.send_request("get_records", {"user_id": self.app_manager.current_user['id']})
+        # 仪表盘只需要这几列，不拉取 notes 等大字段
+        resp = self.app_manager.network.send_request("get_records", {
+            "user_id": self.app_manager.current_user['id'],
+            "columns": ["record_date", "weight", "steps", "systolic_bp", "diastolic_bp",
+                        "sleep_hours", "water_intake"]
+        })
         if resp["status"] == "success":
             records = resp["data"]
             # Sort by date
@@ -1776,6 +1853,13 @@ class AdminUserPage(QWidget):
         search_btn = RoundedButton("🔍 查询", bg_color=COLORS['primary'], width=100)
         search_btn.clicked.connect(self.load_users)
         header_layout.addWidget(search_btn)
+
+        # 边输入边检索：停止输入 300ms 后再请求，避免每次按键都发请求
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(300)
+        self.search_timer.timeout.connect(self.load_users)
+        self.search_input.textChanged.connect(self.search_timer.start)
         
         header_layout.addStretch()
         
@@ -1802,15 +1886,34 @@ class AdminUserPage(QWidget):
         # self.table.setStyleSheet("border: none;")
         # self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
         list_layout.addWidget(self.table)
+
+        # 3. 分页：显示已加载条数，还有更多时可继续加载
+        footer = QHBoxLayout()
+        self.count_label = QLabel("")
+        footer.addWidget(self.count_label)
+        footer.addStretch()
+        self.more_btn = RoundedButton("⬇ 加载更多", bg_color=COLORS['primary'], width=120)
+        self.more_btn.clicked.connect(self.load_more)
+        self.more_btn.hide()
+        footer.addWidget(self.more_btn)
+        list_layout.addLayout(footer)
+        self.query = None
         
         self.load_users()
 
     def load_users(self):
+        """从第一页重新加载"""
         query = self.search_input.text().strip()
-        resp = self.app_manager.network.send_request("get_all_users", {"query": query if query else None})
+        self.query = query if query else None
+        self.table.setRowCount(0)
+        self.load_more()
+
+    def load_more(self):
+        resp = self.app_manager.network.send_request("get_all_users", {"query": self.query,
+                                                                       "limit": USER_PAGE_SIZE,
+                                                                       "offset": self.table.rowCount()})
         
         if resp['status'] == 'success':
-            self.table.setRowCount(0)
             for user in resp['data']:
                 row = self.table.rowCount()
                 self.table.insertRow(row)
@@ -1821,6 +1924,15 @@ class AdminUserPage(QWidget):
                 self.table.setItem(row, 4, QTableWidgetItem(str(user['created_at'])))
                 # Store ID in hidden data of first column item
                 self.table.item(row, 0).setData(Qt.UserRole, user['id'])
+            # 检索结果有总数上限（truncated），到上限后提示细化检索词
+            has_more = resp.get('has_more', len(resp['data']) == USER_PAGE_SIZE)
+            text = f"已显示 {self.table.rowCount()} 个用户"
+            if has_more:
+                text += "，还有更多"
+            elif resp.get('truncated'):
+                text += "（检索结果已达上限，请细化检索词）"
+            self.count_label.setText(text)
+            self.more_btn.setVisible(has_more)
         else:
             QMessageBox.warning(self, "错误", "无法加载用户列表")
 
@@ -0,0 +1,81 @@
+import itertools
+import socket
+import threading
+import time
+
+
+class ConnectionRegistry:
+    """在线连接登记表：记录每个连接的来源、登录用户与最后活跃时间，支持列出与强制断开"""
+
+    def __init__(self):
+        self._conns = {}  # 连接编号 -> 连接信息
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def register(self, sock, addr):
+        info = {"id": next(self._ids), "addr": f"{addr[0]}:{addr[1]}", "sock": sock,
+                "user_id": None, "username": None, "requests": 0, "inflight": 0,
+                "connected_at": time.time(), "last_active": time.monotonic()}
+        with self._lock:
+            self._conns[info["id"]] = info
+        return info
+
+    def unregister(self, info):
+        with self._lock:
+            self._conns.pop(info["id"], None)
+
+    @staticmethod
+    def touch(info):
+        info["last_active"] = time.monotonic()
+        info["requests"] += 1
+
+    def begin(self, info):
+        """请求进入执行队列"""
+        with self._lock:
+            info["inflight"] += 1
+
+    def finish(self, info):
+        """请求已回复：空闲时间从此刻重新计算"""
+        with self._lock:
+            info["inflight"] -= 1
+            info["last_active"] = time.monotonic()
+
+    def idle_seconds(self, info):
+        """距最近一次收到请求或回复完成的秒数，仍有请求在执行时为 0"""
+        return 0.0 if info["inflight"] else time.monotonic() - info["last_active"]
+
+    @staticmethod
+    def identify(info, user):
+        info["user_id"] = user.get("id")
+        info["username"] = user.get("username")
+
+    def count(self):
+        return len(self._conns)
+
+    def list(self):
+        """当前连接列表（不含套接字），按空闲时间从长到短排列"""
+        now = time.monotonic()
+        with self._lock:
+            items = list(self._conns.values())
+        rows = [{"id": c["id"], "addr": c["addr"], "user_id": c["user_id"], "username": c["username"],
+                 "requests": c["requests"], "connected_at": round(c["connected_at"]),
+                 "idle_seconds": round(now - c["last_active"], 1)} for c in items]
+        return sorted(rows, key=lambda r: r["idle_seconds"], reverse=True)
+
+    def evict(self, conn_id=None, user_id=None, idle=None):
+        """断开指定编号、指定用户或空闲超过 idle 秒的连接，返回断开数量
+
+        只关闭套接字的读写方向，由处理该连接的线程感知后自行清理。
+        """
+        now = time.monotonic()
+        with self._lock:
+            targets = [c for c in self._conns.values()
+                       if (conn_id is not None and c["id"] == conn_id)
+                       or (user_id is not None and c["user_id"] == user_id)
+                       or (idle is not None and not c["inflight"] and now - c["last_active"] > idle)]
+        for c in targets:
+            try:
+                c["sock"].shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        return len(targets)
@@ -1,20 +1,429 @@
 import sqlite3
-import hashlib
 import os
+import queue
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from operator import itemgetter
+from time import perf_counter, sleep
+import passwords
+import slowlog
+from resultcache import ResultCache
 
 DB_FILE = 'health_system.db'
+# 分片数：大于 1 时各用户的数据按 user_id 哈希分布到 SHARDS 个分片库（与 DB_FILE 同目录的 <名>.shard<k>.db），
+# DB_FILE 作为目录库保存 users 表与分片登记；各分片有独立的写锁，不同用户的写入互不阻塞。
+# 分片数在首次建库时登记，之后不能修改（已有数据不会自动搬迁）
+SHARDS = 1
+# 跨分片查询（管理员统计、夜间对账、归档）并行执行的线程数
+FANOUT_WORKERS = 8
+# 日志模式（init_db 时设置，持久保存在库文件中）：WAL 下读不阻塞写，在线备份可固定读快照分步复制；None 表示不修改
+JOURNAL_MODE = 'wal'
+# 管理员统计、用户列表等分析查询走 mode=ro 只读连接池：每个库最多这么多条同时执行，多出的排队，避免全表扫描挤占用户写入
+ANALYTICS_CONNECTIONS = 2
+# 分析查询超时（秒，含排队时间）：超时后由进度回调中断语句并抛出 QueryTimeout，None 表示不限
+ANALYTICS_TIMEOUT = 10
+# 分析查询每执行多少条虚拟机指令检查一次超时
+ANALYTICS_CHECK_OPS = 10000
+# 档案、目标、提醒、用药查询结果的进程内缓存条数（所有用户共享的 LRU），0 表示关闭
+RESULT_CACHE_SIZE = 10000
+# 缓存结果的最长保留秒数：导入工具、恢复备份等服务进程之外的写入不会通知缓存，最多这么久后读到新数据；None 表示不过期
+RESULT_CACHE_TTL = 60
+# 慢查询阈值（毫秒）：超过该耗时的语句连同执行计划写入 slowlog.LOG_FILE，None 表示关闭
+SLOW_QUERY_MS = None
 
-def get_connection():
-    """获取数据库连接"""
-    conn = sqlite3.connect(DB_FILE)
+# --- 计时：按线程累计 SQL 执行耗时，服务端据此区分数据库耗时与其余处理耗时 ---
+_timing = threading.local()
+
+def db_seconds():
+    """当前线程累计的数据库耗时（秒），取两次调用的差值即为其间的数据库耗时"""
+    return getattr(_timing, 'seconds', 0.0)
+
+def _timed(method):
+    def wrapper(self, *args, **kwargs):
+        start = perf_counter()
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            _timing.seconds = getattr(_timing, 'seconds', 0.0) + perf_counter() - start
+    wrapper.__name__ = method.__name__
+    return wrapper
+
+class TimedCursor(sqlite3.Cursor):
+    """记录执行与取数耗时的游标（SQLite 在取数时才逐行执行，两者都要计入）
+
+    开启慢查询日志后还会累计每条语句自身的耗时：查询在取数后（直接迭代游标时在取完最后一行后）、
+    写入在执行后判断是否超过阈值。
+    """
+    _sql = None
+
+    def _track(self, start, finished):
+        elapsed = perf_counter() - start
+        _timing.seconds = getattr(_timing, 'seconds', 0.0) + elapsed
+        if SLOW_QUERY_MS is None or self._sql is None:
+            return
+        self._spent += elapsed
+        if finished and self._spent * 1000 >= SLOW_QUERY_MS:
+            sql, self._sql = self._sql, None  # 每条语句只记录一次
+            slowlog.record(self.connection, sql, self._params, self._spent)
+
+    def execute(self, sql, params=()):
+        self._sql, self._params, self._spent = sql, params, 0.0
+        start = perf_counter()
+        try:
+            return super().execute(sql, params)
+        finally:
+            self._track(start, self.description is None)
+
+    def executemany(self, sql, params):
+        self._sql, self._params, self._spent = sql, None, 0.0
+        start = perf_counter()
+        try:
+            return super().executemany(sql, params)
+        finally:
+            self._track(start, True)
+
+    def fetchone(self):
+        start = perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            self._track(start, True)
+
+    def fetchmany(self, *args, **kwargs):
+        start = perf_counter()
+        try:
+            return super().fetchmany(*args, **kwargs)
+        finally:
+            self._track(start, True)
+
+    def fetchall(self):
+        start = perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._track(start, True)
+
+    def __next__(self):
+        start = perf_counter()
+        exhausted = False
+        try:
+            return super().__next__()
+        except StopIteration:
+            exhausted = True
+            raise
+        finally:
+            self._track(start, exhausted)
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, params):
+        return self.cursor().executemany(sql, params)
+
+    _changes = ()
+
+    def changed(self, user_id, kind):
+        """登记本事务改动了哪个用户的哪类缓存结果（kind 为 None 表示全部），提交成功后才失效"""
+        if not self._changes:
+            self._changes = []
+        self._changes.append((user_id, kind))
+
+    @_timed
+    def commit(self):
+        super().commit()
+        if self._changes:
+            changes, self._changes = self._changes, ()
+            results.invalidate(changes)
+
+    def rollback(self):
+        self._changes = ()
+        super().rollback()
+
+def connect(path):
+    conn = sqlite3.connect(path, factory=TimedConnection)
     conn.row_factory = sqlite3.Row  # 允许通过列名访问
+    conn.execute("PRAGMA foreign_keys = ON")  # 外键约束与级联删除按连接开启
     return conn
 
+def get_connection(user_id=None):
+    """获取数据库连接：传入 user_id 时连接该用户所在的分片库，否则连接目录库（users 表）"""
+    return connect(DB_FILE if user_id is None else shard_path(shard_of(user_id)))
+
+# --- 分片：用户数据按 user_id 路由到分片库，未分片（SHARDS = 1）时分片 0 即 DB_FILE ---
+
+def shard_of(user_id):
+    return int(user_id) % SHARDS
+
+def shard_path(shard):
+    if SHARDS == 1:
+        return DB_FILE
+    base, ext = os.path.splitext(DB_FILE)
+    return f"{base}.shard{shard}{ext or '.db'}"
+
+def shard_connection(shard):
+    return connect(shard_path(shard))
+
+def database_paths():
+    """需要建表与迁移的全部库文件，目录库在前"""
+    return list(dict.fromkeys([DB_FILE] + [shard_path(s) for s in range(SHARDS)]))
+
+_fanout = None
+_fanout_lock = threading.Lock()
+
+def for_each_shard(func):
+    """在每个分片上执行 func(shard)，多个分片时并行，按分片顺序返回结果"""
+    global _fanout
+    if SHARDS == 1:
+        return [func(0)]
+    with _fanout_lock:
+        if _fanout is None:
+            _fanout = ThreadPoolExecutor(FANOUT_WORKERS, thread_name_prefix='shard-fanout')
+    return list(_fanout.map(func, range(SHARDS)))
+
+# 通过 user_id 外键关联到 users 的子表（删除用户时级联删除）
+CHILD_TABLES = ('health_data', 'medications', 'health_goals', 'reminders', 'diet_records', 'notifications')
+# 分批清除用户数据：每个事务最多删除的行数，以及两批之间让出写锁的秒数
+PURGE_CHUNK = 2000
+PURGE_PAUSE = 0.05
+
+# 冷热分层：早于 ARCHIVE_AFTER_DAYS 天的健康记录由归档任务移入按年份划分的归档库
+# （DB_FILE 所在目录下的 ARCHIVE_DIR/health_data_<年份>.db，分片模式下为 health_data_shard<k>_<年份>.db），
+# 热库只保留近期数据
+ARCHIVE_AFTER_DAYS = 365
+ARCHIVE_DIR = 'archive'
+ARCHIVE_BATCH = 5000
+
+# 管理员用户检索所覆盖的列（trigram 全文索引）
+USER_SEARCH_FIELDS = ('username', 'allergies', 'chronic_diseases')
+
+# 历史检索的文本来源：表 -> (日期列, 文本表达式)，{r} 为触发器中的 new/old
+HISTORY_SOURCES = {
+    'health_data': ('record_date', "coalesce({r}.notes, '')"),
+    'diet_records': ('record_date', "coalesce({r}.food_description, '')"),
+    'medications': ('start_date', "trim(coalesce({r}.medicine_name, '') || ' ' || coalesce({r}.notes, ''))"),
+}
+
+# --- 查询层：按调用形态缓存语句文本，支持列投影与轻量行对象 ---
+
+# 各表可投影的列（password 不在可查询范围内）
+TABLE_COLUMNS = {
+    'users': ('id', 'username', 'role', 'age', 'gender', 'height', 'blood_type',
+              'emergency_contact', 'allergies', 'chronic_diseases', 'created_at'),
+    'health_data': ('id', 'user_id', 'record_date', 'weight', 'systolic_bp', 'diastolic_bp', 'steps',
+                    'heart_rate', 'blood_sugar', 'temperature', 'sleep_hours', 'water_intake', 'notes'),
+    'medications': ('id', 'user_id', 'medicine_name', 'dosage', 'frequency', 'start_date', 'end_date', 'notes'),
+    'health_goals': ('id', 'user_id', 'goal_type', 'target_value', 'current_value',
+                     'start_date', 'end_date', 'status'),
+    'reminders': ('id', 'user_id', 'reminder_type', 'title', 'reminder_time', 'repeat_type', 'is_active'),
+    'diet_records': ('id', 'user_id', 'record_date', 'meal_type', 'food_description', 'calories'),
+    'notifications': ('id', 'user_id', 'message', 'is_read', 'created_at'),
+}
+
+_local = threading.local()
+
+def _reader(shard=None):
+    """线程内复用的只读查询连接（每个库一条），使 sqlite3 自带的预编译语句缓存真正生效；shard 为空时读目录库"""
+    readers = getattr(_local, 'readers', None)
+    if readers is None or _local.db_file != (DB_FILE, SHARDS):
+        readers = _local.readers = {}
+        _local.db_file = (DB_FILE, SHARDS)
+    path = DB_FILE if shard is None else shard_path(shard)
+    conn = readers.get(path)
+    if conn is None:
+        conn = readers[path] = sqlite3.connect(path, cached_statements=256, factory=TimedConnection)
+    return conn
+
+class QueryTimeout(Exception):
+    """分析查询超过 ANALYTICS_TIMEOUT 被中断"""
+
+class ReplicaPool:
+    """单个库的只读连接池：URI mode=ro 打开，连接本身无法写入；WAL 下读取不阻塞写入
+
+    连接在线程间借还（取数须在借用期间完成）。借用时设置进度回调，超过截止时间即中断正在执行的语句。
+    """
+
+    def __init__(self, path, size):
+        self.path = path
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        deadline = None if timeout is None else perf_counter() + timeout
+        if not self._slots.acquire(timeout=timeout):
+            raise QueryTimeout(f"分析查询排队超过 {timeout} 秒")
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, factory=TimedConnection,
+                                       cached_statements=256, check_same_thread=False)
+            if deadline is not None:
+                conn.set_progress_handler(lambda: perf_counter() > deadline, ANALYTICS_CHECK_OPS)
+            try:
+                yield conn
+            except sqlite3.OperationalError as e:
+                if deadline is not None and perf_counter() > deadline:
+                    raise QueryTimeout(f"分析查询超过 {timeout} 秒被中断") from e
+                raise
+            finally:
+                conn.set_progress_handler(None, 0)
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+_replicas = {}
+_replicas_lock = threading.Lock()
+
+def replica(shard=None):
+    """借用只读连接（上下文管理器），用于管理员与统计类查询；shard 为空时读目录库"""
+    path = DB_FILE if shard is None else shard_path(shard)
+    key = (path, ANALYTICS_CONNECTIONS)
+    with _replicas_lock:
+        pool = _replicas.get(key)
+        if pool is None:
+            pool = _replicas[key] = ReplicaPool(path, ANALYTICS_CONNECTIONS)
+    return pool.connection(ANALYTICS_TIMEOUT)
+
+def project(table, columns=None):
+    """校验并规范化投影列，未指定时返回该表全部可查询列"""
+    allowed = TABLE_COLUMNS[table]
+    if not columns:
+        return allowed
+    # 请求中的 columns 须为列名列表；字符串会被逐字符拆开，其他类型无法作为缓存键
+    if not isinstance(columns, (list, tuple)) or not all(isinstance(c, str) for c in columns):
+        raise ValueError("columns 须为列名列表")
+    columns = tuple(columns)
+    unknown = [c for c in columns if c not in allowed]
+    if unknown:
+        raise ValueError(f"未知的列: {', '.join(unknown)}")
+    return columns
+
+@lru_cache(maxsize=256)
+def _select_sql(table, columns, where, order_by=None, limit=None):
+    sql = f"SELECT {', '.join(columns)} FROM {table} WHERE {where}"
+    if order_by:
+        sql += f" ORDER BY {order_by}"
+    if limit:
+        sql += f" LIMIT {int(limit)}"
+    return sql
+
+@lru_cache(maxsize=256)
+def row_type(table, columns):
+    """每种 (表, 列) 组合对应一个 namedtuple 类型"""
+    return namedtuple(f"{table}_row", columns)
+
+def select(table, where, params, columns=None, order_by=None, limit=None, shape='dict', user_id=None):
+    """按形态查询: shape 为 'dict'（兼容旧接口）、'tuple' 或 'namedtuple'；user_id 指定时读该用户所在的分片"""
+    columns = project(table, columns)
+    sql = _select_sql(table, columns, where, order_by, limit)
+    reader = _reader(None if user_id is None else shard_of(user_id))
+    return _shape(table, columns, reader.execute(sql, params).fetchall(), shape)
+
+def _shape(table, columns, rows, shape):
+    if shape == 'tuple':
+        return rows
+    if shape == 'namedtuple':
+        make = row_type(table, columns)._make
+        return [make(row) for row in rows]
+    return [dict(zip(columns, row)) for row in rows]
+
+# --- 结果缓存：档案、目标、提醒、用药按用户缓存，写入提交后按 (user_id, 种类) 精确失效 ---
+results = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+
+def _cached(kind, user_id, args, load):
+    """经结果缓存读取，args 为规范化后的查询参数；切换数据库或修改缓存大小后整体清空"""
+    if results.source != (DB_FILE, SHARDS, RESULT_CACHE_SIZE):
+        results.clear()
+        results.max_entries = RESULT_CACHE_SIZE
+        results.source = (DB_FILE, SHARDS, RESULT_CACHE_SIZE)
+    results.ttl = RESULT_CACHE_TTL
+    return results.get(user_id, kind, args, load)
+
 def init_db():
-    """初始化数据库表"""
+    """初始化数据库表：目录库与各分片库建相同的表，分片库的 users 只有外键与级联删除所需的占位行
+
+    只按最新结构创建缺少的表；已有表的结构变更、索引与数据回填由 migrations.py 的版本化迁移完成。
+    """
     conn = get_connection()
-    cursor = conn.cursor()
-    
+    try:
+        _set_journal_mode(conn)
+        _create_tables(conn.cursor())
+        conn.commit()
+        first = _register_shards(conn)
+    finally:
+        conn.close()
+    for path in database_paths()[1:]:
+        conn = connect(path)
+        try:
+            _set_journal_mode(conn)
+            _create_tables(conn.cursor(), with_admin=False)
+            conn.commit()
+        finally:
+            conn.close()
+    if first and SHARDS > 1:
+        conn = get_connection()
+        try:
+            _add_shard_users(conn.execute("SELECT id, username, role FROM users").fetchall())
+        finally:
+            conn.close()
+
+def _set_journal_mode(conn):
+    if JOURNAL_MODE:
+        conn.execute(f"PRAGMA journal_mode = {JOURNAL_MODE}")
+
+def _register_shards(conn):
+    """在目录库登记分片，首次登记时返回 True；已登记的分片数与 SHARDS 不一致时拒绝启动"""
+    conn.execute("CREATE TABLE IF NOT EXISTS shards (shard INTEGER PRIMARY KEY, path TEXT NOT NULL)")
+    registered = conn.execute("SELECT count(*) FROM shards").fetchone()[0]
+    if registered:
+        if registered != SHARDS:
+            raise RuntimeError(f"数据库已按 {registered} 个分片建立，与 SHARDS = {SHARDS} 不一致")
+        return False
+    if SHARDS > 1:
+        for table in CHILD_TABLES:
+            if conn.execute(f"SELECT 1 FROM {table} LIMIT 1").fetchone():
+                raise RuntimeError(f"{DB_FILE} 中已有未分片的数据（{table}），不能直接改为 {SHARDS} 个分片")
+    conn.executemany("INSERT INTO shards (shard, path) VALUES (?, ?)",
+                     [(s, os.path.basename(shard_path(s))) for s in range(SHARDS)])
+    conn.commit()
+    return True
+
+def _add_shard_users(users):
+    """在各用户所在分片写入占位行 (id, username, role)，子表的外键与级联删除依赖它"""
+    if SHARDS == 1:
+        return
+    by_shard = {}
+    for user_id, username, role in users:
+        by_shard.setdefault(shard_of(user_id), []).append((user_id, username, role))
+    for shard, rows in by_shard.items():
+        conn = shard_connection(shard)
+        try:
+            conn.executemany("INSERT OR IGNORE INTO users (id, username, password, role) VALUES (?, ?, '', ?)", rows)
+            conn.commit()
+        finally:
+            conn.close()
+
+def _delete_directory_user(user_id):
+    """分片模式下从目录库删除用户（分片中的占位行与数据已先行删除）"""
+    if SHARDS == 1:
+        return
+    conn = get_connection()
+    try:
+        conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+def _create_tables(cursor, with_admin=True):
     # 用户表
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS users (
@@ -49,7 +458,7 @@ def init_db():
         sleep_hours REAL,
         water_intake INTEGER,
         notes TEXT,
-        FOREIGN KEY (user_id) REFERENCES users (id)
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
     )
     ''')
     
@@ -64,7 +473,7 @@ def init_db():
         start_date TEXT,
         end_date TEXT,
         notes TEXT,
-        FOREIGN KEY (user_id) REFERENCES users (id)
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
     )
     ''')
     
@@ -79,7 +488,8 @@ def init_db():
         start_date TEXT,
         end_date TEXT,
         status TEXT DEFAULT 'active',
-        FOREIGN KEY (user_id) REFERENCES users (id)
+        progress_date TEXT,       -- 已计入 current_value 的最新记录日期，由新增记录自动推进
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
     )
     ''')
     
@@ -93,7 +503,8 @@ def init_db():
         reminder_time TEXT,
         repeat_type TEXT,
         is_active INTEGER DEFAULT 1,
-        FOREIGN KEY (user_id) REFERENCES users (id)
+        next_fire_at TEXT,        -- 下一次触发时间（本地时间），由调度器推进
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
     )
     ''')
     
@@ -106,7 +517,7 @@ def init_db():
         meal_type TEXT,
         food_description TEXT,
         calories INTEGER,
-        FOREIGN KEY (user_id) REFERENCES users (id)
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
     )
     ''')
     
@@ -118,32 +529,119 @@ def init_db():
         message TEXT NOT NULL,    -- 消息内容
         is_read INTEGER DEFAULT 0,-- 0:未读, 1:已读
         created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (user_id) REFERENCES users (id)
+        FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+    )
+    ''')
+    
+    # 归档库目录：每个年份一个文件，记录行数与体重合计供统计使用
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS archive_segments (
+        year INTEGER PRIMARY KEY,
+        path TEXT NOT NULL,
+        rows INTEGER DEFAULT 0,
+        weight_sum REAL DEFAULT 0,
+        weight_count INTEGER DEFAULT 0
     )
     ''')
     
+    # --- 管理员用户检索的全文索引 ---
+    _create_user_search(cursor)
+    _create_history_search(cursor)
+
+    if not with_admin:
+        return
     # 初始化一个默认管理员账号 (admin/123456)
-    try:
-        admin_pwd = hashlib.sha256("123456".encode()).hexdigest()
+    # 先检查是否存在，避免每次启动都做一次 KDF 运算
+    cursor.execute("SELECT 1 FROM users WHERE username = 'admin'")
+    if not cursor.fetchone():
+        admin_pwd = passwords.hash_password("123456")
         cursor.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)", 
                        ("admin", admin_pwd, "admin"))
         print("默认管理员账号已创建: admin / 123456")
-    except sqlite3.IntegrityError:
-        pass # 管理员已存在
 
-    conn.commit()
-    conn.close()
+def _create_user_search(cursor):
+    """users 的 trigram 全文索引：外部内容表不重复存储数据，由触发器随 users 增删改同步
+
+    已有用户由迁移 v4 导入索引；SQLite 未编译 FTS5 时跳过，检索退化为 LIKE。
+    """
+    fields = ', '.join(USER_SEARCH_FIELDS)
+    new_fields = ', '.join('new.' + f for f in USER_SEARCH_FIELDS)
+    old_fields = ', '.join('old.' + f for f in USER_SEARCH_FIELDS)
+    try:
+        cursor.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+            {fields}, content='users', content_rowid='id', tokenize='trigram')""")
+    except sqlite3.OperationalError as e:
+        print(f"全文索引不可用，用户检索将使用 LIKE: {e}")
+        return
+    cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+        INSERT INTO users_fts(rowid, {fields}) VALUES (new.id, {new_fields});
+    END""")
+    cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+        INSERT INTO users_fts(users_fts, rowid, {fields}) VALUES ('delete', old.id, {old_fields});
+    END""")
+    # 只在被索引的列变化时更新（登录时的密码升级等不触发）
+    cursor.execute(f"""CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF {fields} ON users BEGIN
+        INSERT INTO users_fts(users_fts, rowid, {fields}) VALUES ('delete', old.id, {old_fields});
+        INSERT INTO users_fts(rowid, {fields}) VALUES (new.id, {new_fields});
+    END""")
+
+def _create_history_search(cursor):
+    """用户历史文本的检索索引
+
+    history_docs 汇集各表的自由文本（由基础表上的触发器增量维护），history_fts 是其 trigram 全文索引；
+    owner 列为 "<用户ID>"，检索时与关键词一并匹配，使查询只落在该用户的文档上。已有记录由迁移 v5 导入。
+    """
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS history_docs (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        owner TEXT NOT NULL,
+        source TEXT NOT NULL,     -- 来源表
+        source_id INTEGER NOT NULL,
+        record_date TEXT,
+        content TEXT NOT NULL,
+        UNIQUE (source, source_id)
+    )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_history_docs_user ON history_docs (user_id, record_date)")
+
+    for table, (date_col, content) in HISTORY_SOURCES.items():
+        new_content = content.format(r='new')
+        insert = (f"INSERT INTO history_docs (user_id, owner, source, source_id, record_date, content) "
+                  f"SELECT new.user_id, '<' || new.user_id || '>', '{table}', new.id, new.{date_col}, {new_content} "
+                  f"WHERE new.user_id IS NOT NULL AND trim({new_content}) != '';")
+        delete = f"DELETE FROM history_docs WHERE source = '{table}' AND source_id = old.id;"
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_history_insert AFTER INSERT ON {table} BEGIN {insert} END")
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_history_update AFTER UPDATE ON {table} BEGIN "
+                       f"{delete} {insert} END")
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_history_delete AFTER DELETE ON {table} BEGIN {delete} END")
+
+    try:
+        cursor.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(
+            owner, content, content='history_docs', content_rowid='id', tokenize='trigram')""")
+    except sqlite3.OperationalError as e:
+        print(f"全文索引不可用，历史检索将逐条匹配: {e}")
+        return
+    cursor.execute("""CREATE TRIGGER IF NOT EXISTS history_fts_insert AFTER INSERT ON history_docs BEGIN
+        INSERT INTO history_fts(rowid, owner, content) VALUES (new.id, new.owner, new.content);
+    END""")
+    cursor.execute("""CREATE TRIGGER IF NOT EXISTS history_fts_delete AFTER DELETE ON history_docs BEGIN
+        INSERT INTO history_fts(history_fts, rowid, owner, content) VALUES ('delete', old.id, old.owner, old.content);
+    END""")
 
 # --- 业务逻辑函数 ---
 
 def register_user(username, password, age, gender):
     """注册普通用户"""
+    pwd_hash = passwords.hash_password(password)  # KDF 在连接打开前完成，缩短持有连接的时间
     conn = get_connection()
     cursor = conn.cursor()
-    pwd_hash = hashlib.sha256(password.encode()).hexdigest()
     try:
         cursor.execute("INSERT INTO users (username, password, role, age, gender) VALUES (?, ?, ?, ?, ?)",
                        (username, pwd_hash, 'user', age, gender))
+        # 先在分片中建好占位行再提交目录库，用户一旦可以登录，其分片就能写入
+        _add_shard_users([(cursor.lastrowid, username, 'user')])
+        conn.changed(cursor.lastrowid, None)  # 清掉注册前按该 id 查询缓存下的空结果
         conn.commit()
         return True, "注册成功"
     except sqlite3.IntegrityError:
@@ -155,67 +653,253 @@ def login_user(username, password):
     """用户登录校验"""
     conn = get_connection()
     cursor = conn.cursor()
-    pwd_hash = hashlib.sha256(password.encode()).hexdigest()
-    
-    cursor.execute("SELECT * FROM users WHERE username = ? AND password = ?", (username, pwd_hash))
+    cursor.execute("SELECT id, username, role, password FROM users WHERE username = ?", (username,))
     user = cursor.fetchone()
     conn.close()
     
-    if user:
-        return True, {"id": user["id"], "username": user["username"], "role": user["role"]}
-    else:
+    if not user:
         return False, "用户名或密码错误"
+    
+    stored = user["password"]
+    if not passwords.credential_cache.check(username, password, stored):
+        ok, needs_upgrade = passwords.verify_password(password, stored)
+        if not ok:
+            return False, "用户名或密码错误"
+        if needs_upgrade:
+            # 旧版 SHA-256 或旧的哈希参数：登录成功时透明升级
+            stored = passwords.hash_password(password)
+            conn = get_connection()
+            conn.execute("UPDATE users SET password = ? WHERE id = ?", (stored, user["id"]))
+            conn.commit()
+            conn.close()
+        passwords.credential_cache.remember(username, password, stored)
+    
+    return True, {"id": user["id"], "username": user["username"], "role": user["role"]}
 
-def add_health_record(user_id, date, weight, sys_bp, dia_bp, steps, heart_rate=None, blood_sugar=None, temperature=None, sleep_hours=None, water_intake=None, notes=None):
-    """添加健康记录（扩展版）"""
-    conn = get_connection()
-    cursor = conn.cursor()
+def write(insert, user_id, *args):
+    """在用户所在分片用独立连接执行一次写入并提交，insert(conn, user_id, *args) 返回提示消息；结果为 (成功, 消息)"""
+    conn = get_connection(user_id)
     try:
-        cursor.execute('''
-            INSERT INTO health_data (user_id, record_date, weight, systolic_bp, diastolic_bp, steps, 
-                                    heart_rate, blood_sugar, temperature, sleep_hours, water_intake, notes)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (user_id, date, weight, sys_bp, dia_bp, steps, heart_rate, blood_sugar, temperature, sleep_hours, water_intake, notes))
+        message = insert(conn, user_id, *args)
         conn.commit()
-        return True, "记录添加成功"
+        return True, message
     except Exception as e:
         return False, str(e)
     finally:
         conn.close()
 
-def get_user_records(user_id):
-    """获取特定用户的所有记录（用于可视化）"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM health_data WHERE user_id = ? ORDER BY record_date ASC", (user_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    # 转换为列表字典返回
-    return [dict(row) for row in rows]
+def insert_health_record(conn, user_id, date, weight, sys_bp, dia_bp, steps, heart_rate=None, blood_sugar=None, temperature=None, sleep_hours=None, water_intake=None, notes=None):
+    """写入一条健康记录并推进相关目标（由调用方控制事务）"""
+    conn.execute('''
+        INSERT INTO health_data (user_id, record_date, weight, systolic_bp, diastolic_bp, steps, 
+                                heart_rate, blood_sugar, temperature, sleep_hours, water_intake, notes)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (user_id, date, weight, sys_bp, dia_bp, steps, heart_rate, blood_sugar, temperature, sleep_hours, water_intake, notes))
+    apply_goal_progress(conn, user_id, 'health_data', date, {
+        'weight': weight, 'systolic_bp': sys_bp, 'diastolic_bp': dia_bp, 'steps': steps,
+        'heart_rate': heart_rate, 'blood_sugar': blood_sugar, 'temperature': temperature,
+        'sleep_hours': sleep_hours, 'water_intake': water_intake})
+    return "记录添加成功"
+
+def add_health_record(user_id, date, weight, sys_bp, dia_bp, steps, heart_rate=None, blood_sugar=None, temperature=None, sleep_hours=None, water_intake=None, notes=None):
+    """添加健康记录（扩展版）"""
+    return write(insert_health_record, user_id, date, weight, sys_bp, dia_bp, steps, heart_rate, blood_sugar,
+                 temperature, sleep_hours, water_intake, notes)
+
+# health_data 中除 id / user_id 外的数据列，批量导入按此顺序组织参数
+HEALTH_RECORD_FIELDS = ('record_date', 'weight', 'systolic_bp', 'diastolic_bp', 'steps', 'heart_rate',
+                        'blood_sugar', 'temperature', 'sleep_hours', 'water_intake', 'notes')
+
+def insert_health_records(conn, rows):
+    """批量写入健康记录（由调用方控制事务），rows 为 (user_id, *HEALTH_RECORD_FIELDS) 元组"""
+    columns = ', '.join(('user_id',) + HEALTH_RECORD_FIELDS)
+    placeholders = ', '.join('?' * (len(HEALTH_RECORD_FIELDS) + 1))
+    conn.executemany(f"INSERT INTO health_data ({columns}) VALUES ({placeholders})", rows)
+
+def get_user_records(user_id, columns=None, shape='dict', start_date=None, end_date=None):
+    """获取特定用户的记录（用于可视化），可只取需要的列、限定日期范围
+
+    范围覆盖到已归档的年份时，依次读取对应的归档库再拼上热库的结果；只查近期时不触碰归档库。
+    """
+    columns = project('health_data', columns)
+    lo, hi = _date_window(start_date, end_date)
+    where, params = "user_id = ? AND record_date >= ? AND record_date <= ?", (user_id, lo, hi)
+    if not start_date and not end_date:
+        where, params = "user_id = ?", (user_id,)
+    sql = _select_sql('health_data', columns, where, "record_date ASC", None)
+    rows = []
+    shard = shard_of(user_id)
+    segments = archive_segments(start_date, end_date, shard)
+    for year, path in segments:
+        rows.extend(_archive_reader(path).execute(sql, params).fetchall())
+    rows.extend(_reader(shard).execute(sql, params).fetchall())
+    if segments and 'record_date' in columns:
+        # 归档后才导入的旧记录仍在热库中，整体按日期排一次（各段已有序，归并代价很小）
+        rows.sort(key=itemgetter(columns.index('record_date')))
+    return _shape('health_data', columns, rows, shape)
 
 def get_all_stats():
-    """管理员功能：获取系统统计数据"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
+    """管理员功能：获取系统统计数据（记录数与平均体重包含归档数据，各分片并行统计后汇总）"""
     stats = {}
     
-    # 用户总数
-    cursor.execute("SELECT COUNT(*) FROM users WHERE role='user'")
-    stats['user_count'] = cursor.fetchone()[0]
+    # 用户总数（目录库）
+    with replica() as conn:
+        stats['user_count'] = conn.execute("SELECT COUNT(*) FROM users WHERE role='user'").fetchone()[0]
     
-    # 平均体重
-    cursor.execute("SELECT AVG(weight) FROM health_data")
-    avg_weight = cursor.fetchone()[0]
-    stats['avg_weight'] = round(avg_weight, 2) if avg_weight else 0
-    
-    # 总记录数
-    cursor.execute("SELECT COUNT(*) FROM health_data")
-    stats['total_records'] = cursor.fetchone()[0]
-    
-    conn.close()
+    # 总记录数与平均体重
+    totals = for_each_shard(_shard_stats)
+    total = sum(t[0] for t in totals)
+    weight_sum = sum(t[1] for t in totals)
+    weight_count = sum(t[2] for t in totals)
+    stats['avg_weight'] = round(weight_sum / weight_count, 2) if weight_count else 0
+    stats['total_records'] = total
     return stats
 
+def _shard_stats(shard):
+    """单个分片的 (记录数, 体重合计, 体重条数)：热库扫描一次，归档部分取归档目录中的合计"""
+    with replica(shard) as conn:
+        return conn.execute("""
+            SELECT COUNT(*) + (SELECT coalesce(sum(rows), 0) FROM archive_segments),
+                   coalesce(SUM(weight), 0) + (SELECT coalesce(sum(weight_sum), 0) FROM archive_segments),
+                   COUNT(weight) + (SELECT coalesce(sum(weight_count), 0) FROM archive_segments)
+            FROM health_data
+        """).fetchone()
+
+# --- 冷热分层：健康记录归档 ---
+def archive_path(year, shard=0):
+    name = f"health_data_{year}.db" if SHARDS == 1 else f"health_data_shard{shard}_{year}.db"
+    return os.path.join(os.path.dirname(DB_FILE) or '.', ARCHIVE_DIR, name)
+
+def archive_segments(start_date=None, end_date=None, shard=0):
+    """分片中与日期范围相交的归档年份 [(年份, 路径)]，按年份升序"""
+    lo = int(start_date[:4]) if start_date else 0
+    hi = int(end_date[:4]) if end_date else 9999
+    return [tuple(row) for row in _reader(shard).execute(
+        "SELECT year, path FROM archive_segments WHERE year >= ? AND year <= ? AND rows > 0 ORDER BY year",
+        (lo, hi)).fetchall()]
+
+def _archive_reader(path):
+    """线程内复用的归档库只读连接"""
+    readers = getattr(_local, 'archives', None)
+    if readers is None or _local.archives_db != DB_FILE:
+        readers = _local.archives = {}
+        _local.archives_db = DB_FILE
+    conn = readers.get(path)
+    if conn is None:
+        conn = readers[path] = sqlite3.connect(f"file:{path}?mode=ro", uri=True, factory=TimedConnection)
+    return conn
+
+def _attach_archive(conn, year, shard):
+    """挂载分片某年份的归档库（必须在事务外），不存在时按热库的列建表与索引"""
+    path = archive_path(year, shard)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn.execute("ATTACH DATABASE ? AS arc", (path,))
+    # 归档库中不含 users 表，只复制列定义，不带外键；热库后来新增的列补到已有的归档库
+    columns = [(name, kind, pk) for _, name, kind, _, _, pk in conn.execute("PRAGMA main.table_info(health_data)")]
+    conn.execute("CREATE TABLE IF NOT EXISTS arc.health_data (%s)" % ', '.join(
+        f"{name} {kind}" + (" PRIMARY KEY" if pk else "") for name, kind, pk in columns))
+    existing = {row[1] for row in conn.execute("PRAGMA arc.table_info(health_data)")}
+    for name, kind, _ in columns:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE arc.health_data ADD COLUMN {name} {kind}")
+    conn.execute("CREATE INDEX IF NOT EXISTS arc.idx_health_data_user ON health_data (user_id, record_date)")
+    return path, [name for name, _, _ in columns]
+
+def archive_health_data(before=None, batch=ARCHIVE_BATCH, pause=PURGE_PAUSE):
+    """把 record_date 早于 before（默认 ARCHIVE_AFTER_DAYS 天前）的健康记录移入按年份的归档库
+
+    按 rowid 顺序单遍扫描热库，每批每个年份先提交归档库中的副本、再在热库的一个事务中删除原行，批间让出写锁。
+    记录的历史检索文档保留在热库中，归档后仍可检索。各分片并行归档，返回移动的行数。
+    """
+    cutoff = before or (date.today() - timedelta(days=ARCHIVE_AFTER_DAYS)).isoformat()
+    return sum(for_each_shard(lambda shard: _archive_shard(shard, cutoff, batch, pause)))
+
+def _archive_shard(shard, cutoff, batch, pause):
+    conn = shard_connection(shard)
+    moved = 0
+    last_id = 0
+    try:
+        while True:
+            rows = conn.execute("SELECT id, record_date FROM health_data WHERE id > ? AND record_date < ? "
+                                "ORDER BY id LIMIT ?", (last_id, cutoff, batch)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            years = {}
+            for record_id, record_date in rows:
+                years.setdefault(int(record_date[:4]), []).append(record_id)
+            for year, ids in sorted(years.items()):
+                moved += _archive_year(conn, year, ids, shard)
+            sleep(pause)
+    finally:
+        conn.close()
+    return moved
+
+def _archive_year(conn, year, ids, shard):
+    path, columns = _attach_archive(conn, year, shard)
+    try:
+        # 本批 id 放入临时表再按子查询选取，一批可超过 SQLite 单条语句的参数上限（旧版本为 999）
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS archive_ids (id INTEGER PRIMARY KEY)")
+        conn.execute("DELETE FROM temp.archive_ids")
+        conn.executemany("INSERT INTO temp.archive_ids (id) VALUES (?)", ((i,) for i in ids))
+        picked = "SELECT id FROM temp.archive_ids"
+        cols = ', '.join(columns)
+        # WAL 模式下跨库事务只保证各库文件各自原子，不保证两库一起提交，因此分两步：
+        # 先提交归档库中的副本，再在热库的一个事务中删除原行并累加归档目录。两步之间中断时两边各有一份，
+        # 统计只计热库与归档目录，结果不变；下次归档以 INSERT OR REPLACE 覆盖副本后再删除，重复执行无副作用。
+        conn.execute(f"INSERT OR REPLACE INTO arc.health_data ({cols}) SELECT {cols} FROM main.health_data "
+                     f"WHERE id IN ({picked})")
+        conn.commit()
+        totals = conn.execute(f"SELECT count(*), coalesce(sum(weight), 0), count(weight) FROM main.health_data "
+                              f"WHERE id IN ({picked})").fetchone()
+        # 删除会触发历史文档的同步删除，先取出、删除后按原 id 放回
+        docs = conn.execute(f"SELECT * FROM history_docs WHERE source = 'health_data' AND source_id IN ({picked})"
+                            ).fetchall()
+        conn.execute(f"DELETE FROM main.health_data WHERE id IN ({picked})")
+        if docs:
+            conn.executemany(f"INSERT INTO history_docs VALUES ({','.join('?' * len(docs[0]))})", map(tuple, docs))
+        conn.execute("INSERT INTO archive_segments (year, path) VALUES (?, ?) ON CONFLICT (year) DO NOTHING",
+                     (year, path))
+        conn.execute("UPDATE archive_segments SET rows = rows + ?, weight_sum = weight_sum + ?, "
+                     "weight_count = weight_count + ? WHERE year = ?", tuple(totals) + (year,))
+        conn.commit()
+        return totals[0]
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.execute("DETACH DATABASE arc")
+
+def _purge_archives(conn, user_id, chunk=None, pause=0):
+    """删除用户在各归档库中的记录并更新归档目录；chunk 为空时一次删完"""
+    deleted = 0
+    for year, path in conn.execute("SELECT year, path FROM archive_segments").fetchall():
+        archive = sqlite3.connect(path, factory=TimedConnection)
+        try:
+            while True:
+                # 分块按 id 上界划分，不把整块 id 展开成 IN (?, ...) 参数
+                where, params = "user_id = ?", (user_id,)
+                if chunk:
+                    bound = archive.execute("SELECT max(id) FROM (SELECT id FROM health_data WHERE user_id = ? "
+                                            "ORDER BY id LIMIT ?)", (user_id, chunk)).fetchone()[0]
+                    where, params = "user_id = ? AND id <= ?", (user_id, bound)
+                totals = archive.execute(f"SELECT count(*), coalesce(sum(weight), 0), count(weight) FROM health_data "
+                                         f"WHERE {where}", params).fetchone()
+                if not totals[0]:
+                    break
+                archive.execute(f"DELETE FROM health_data WHERE {where}", params)
+                archive.commit()
+                conn.execute("UPDATE archive_segments SET rows = rows - ?, weight_sum = weight_sum - ?, "
+                             "weight_count = weight_count - ? WHERE year = ?", tuple(totals) + (year,))
+                conn.commit()
+                deleted += totals[0]
+                if not chunk:
+                    break
+                sleep(pause)
+        finally:
+            archive.close()
+    return deleted
+
 # --- 用户档案管理 ---
 def update_user_profile(user_id, **kwargs):
     """更新用户健康档案"""
@@ -239,6 +923,7 @@ def update_user_profile(user_id, **kwargs):
     
     try:
         cursor.execute(sql, values)
+        conn.changed(user_id, 'profile')
         conn.commit()
         return True, "档案更新成功"
     except Exception as e:
@@ -246,25 +931,24 @@ def update_user_profile(user_id, **kwargs):
     finally:
         conn.close()
 
-def get_user_profile(user_id):
-    """获取用户完整档案"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
-    user = cursor.fetchone()
-    conn.close()
-    return dict(user) if user else None
+def get_user_profile(user_id, columns=None):
+    """获取用户完整档案（不含密码）；结果经缓存共享，调用方不要修改"""
+    def load():
+        rows = select('users', "id = ?", (user_id,), columns)
+        return rows[0] if rows else None
+    return _cached('profile', user_id, (project('users', columns),), load)
 
 # --- 用药管理 ---
 def add_medication(user_id, medicine_name, dosage, frequency, start_date, end_date=None, notes=None):
     """添加用药记录"""
-    conn = get_connection()
+    conn = get_connection(user_id)
     cursor = conn.cursor()
     try:
         cursor.execute('''
             INSERT INTO medications (user_id, medicine_name, dosage, frequency, start_date, end_date, notes)
             VALUES (?, ?, ?, ?, ?, ?, ?)
         ''', (user_id, medicine_name, dosage, frequency, start_date, end_date, notes))
+        conn.changed(user_id, 'medications')
         conn.commit()
         return True, "用药记录添加成功"
     except Exception as e:
@@ -272,21 +956,27 @@ def add_medication(user_id, medicine_name, dosage, frequency, start_date, end_da
     finally:
         conn.close()
 
-def get_user_medications(user_id):
-    """获取用户所有用药记录"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM medications WHERE user_id = ? ORDER BY start_date DESC", (user_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+def get_user_medications(user_id, columns=None, shape='dict'):
+    """获取用户所有用药记录（经结果缓存）"""
+    return _cached('medications', user_id, (project('medications', columns), shape), lambda: select(
+        'medications', "user_id = ?", (user_id,), columns, "start_date DESC", shape=shape, user_id=user_id))
 
-def delete_medication(med_id):
-    """删除用药记录"""
-    conn = get_connection()
+def _owned(record_id, user_id):
+    """按记录 id 定位的条件；传入 user_id 时只匹配该用户的记录（普通用户不能改动他人的记录）"""
+    if user_id is None:
+        return "id = ?", (record_id,)
+    return "id = ? AND user_id = ?", (record_id, user_id)
+
+def delete_medication(med_id, user_id=None):
+    """删除用药记录；传入 user_id 时只删除该用户自己的记录（分片模式下须传入，用于定位分片）"""
+    where, params = _owned(med_id, user_id)
+    conn = get_connection(user_id)
     cursor = conn.cursor()
     try:
-        cursor.execute("DELETE FROM medications WHERE id = ?", (med_id,))
+        for (owner,) in cursor.execute(f"SELECT user_id FROM medications WHERE {where}", params).fetchall():
+            conn.changed(owner, 'medications')
+        if cursor.execute(f"DELETE FROM medications WHERE {where}", params).rowcount == 0:
+            return False, "用药记录不存在"
         conn.commit()
         return True, "删除成功"
     except Exception as e:
@@ -297,13 +987,16 @@ def delete_medication(med_id):
 # --- 健康目标管理 ---
 def add_health_goal(user_id, goal_type, target_value, current_value, start_date, end_date):
     """添加健康目标"""
-    conn = get_connection()
+    conn = get_connection(user_id)
     cursor = conn.cursor()
     try:
         cursor.execute('''
             INSERT INTO health_goals (user_id, goal_type, target_value, current_value, start_date, end_date)
             VALUES (?, ?, ?, ?, ?, ?)
         ''', (user_id, goal_type, target_value, current_value, start_date, end_date))
+        # 目标期内已有记录时以记录为准，否则保留手填的当前值
+        reconcile_goals(conn, goal_ids=[cursor.lastrowid])
+        conn.changed(user_id, 'goals')
         conn.commit()
         return True, "目标创建成功"
     except Exception as e:
@@ -311,21 +1004,23 @@ def add_health_goal(user_id, goal_type, target_value, current_value, start_date,
     finally:
         conn.close()
 
-def get_user_goals(user_id):
-    """获取用户所有目标"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM health_goals WHERE user_id = ? AND status = 'active' ORDER BY start_date DESC", (user_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+def get_user_goals(user_id, columns=None, shape='dict'):
+    """获取用户所有目标（经结果缓存）"""
+    return _cached('goals', user_id, (project('health_goals', columns), shape), lambda: select(
+        'health_goals', "user_id = ? AND status = 'active'", (user_id,), columns,
+        "start_date DESC", shape=shape, user_id=user_id))
 
-def update_goal_progress(goal_id, current_value):
-    """更新目标进度"""
-    conn = get_connection()
+def update_goal_progress(goal_id, current_value, user_id=None):
+    """更新目标进度；传入 user_id 时只更新该用户自己的目标（分片模式下须传入）"""
+    where, params = _owned(goal_id, user_id)
+    conn = get_connection(user_id)
     cursor = conn.cursor()
     try:
-        cursor.execute("UPDATE health_goals SET current_value = ? WHERE id = ?", (current_value, goal_id))
+        for (owner,) in cursor.execute(f"SELECT user_id FROM health_goals WHERE {where}", params).fetchall():
+            conn.changed(owner, 'goals')
+        if cursor.execute(f"UPDATE health_goals SET current_value = ? WHERE {where}",
+                          (current_value,) + params).rowcount == 0:
+            return False, "目标不存在"
         conn.commit()
         return True, "进度更新成功"
     except Exception as e:
@@ -333,16 +1028,186 @@ def update_goal_progress(goal_id, current_value):
     finally:
         conn.close()
 
+# 目标类型（自由文本）关键字 -> (来源表, 指标列, 计算方式)，按顺序取第一个命中的关键字
+# latest：目标期内最新一次读数（体重、血压等水平类指标）；sum：目标期内累计值（步数、饮水、热量）
+GOAL_METRICS = (
+    (('舒张压',), 'health_data', 'diastolic_bp', 'latest'),
+    (('血压', '收缩压'), 'health_data', 'systolic_bp', 'latest'),
+    (('血糖',), 'health_data', 'blood_sugar', 'latest'),
+    (('心率',), 'health_data', 'heart_rate', 'latest'),
+    (('体温',), 'health_data', 'temperature', 'latest'),
+    (('减肥', '减重', '体重', '瘦'), 'health_data', 'weight', 'latest'),
+    (('步数', '走路', '运动'), 'health_data', 'steps', 'sum'),
+    (('睡眠',), 'health_data', 'sleep_hours', 'latest'),
+    (('饮水', '喝水'), 'health_data', 'water_intake', 'sum'),
+    (('热量', '卡路里', '饮食'), 'diet_records', 'calories', 'sum'),
+)
+# 夜间对账每批处理的目标数（每批一个短事务）
+RECONCILE_BATCH = 1000
+
+@lru_cache(maxsize=1024)
+def goal_metric(goal_type):
+    """目标类型对应的 (表, 列, 计算方式)；无法识别的目标返回 None，只能手动更新进度"""
+    for keywords, table, column, mode in GOAL_METRICS:
+        if any(k in (goal_type or '') for k in keywords):
+            return table, column, mode
+    return None
+
+def _date_window(start_date, end_date):
+    """记录日期范围；结束日取整天（兼容带时间的 record_date），缺省为不限"""
+    return start_date or '', (end_date or '9999-12-31') + '~'
+
+def apply_goal_progress(conn, user_id, table, record_date, values):
+    """新记录写入后在同一事务内推进该用户的进行中目标，values 为 {指标列: 值}
+
+    只读该用户的进行中目标（按索引取，通常只有几条），不重新聚合历史记录：
+    sum 类累加新值，latest 类在记录不早于已计入日期时替换；补录的旧读数不覆盖新读数。
+    """
+    if not record_date:
+        return
+    goals = conn.execute("""
+        SELECT id, goal_type, current_value, start_date, end_date, progress_date
+        FROM health_goals WHERE user_id = ? AND status = 'active'
+    """, (user_id,)).fetchall()
+    updates = []
+    for goal_id, goal_type, current, start, end, progress_date in goals:
+        metric = goal_metric(goal_type)
+        if metric is None or metric[0] != table or values.get(metric[1]) is None:
+            continue
+        lo, hi = _date_window(start, end)
+        if not lo <= record_date <= hi:
+            continue
+        value = values[metric[1]]
+        if metric[2] == 'sum':
+            # progress_date 为空表示尚未计入任何记录，current_value 仍是手填值
+            current = value if progress_date is None else (current or 0) + value
+        elif progress_date is None or record_date >= progress_date:
+            current = value
+        else:
+            continue
+        updates.append((current, max(record_date, progress_date or ''), goal_id))
+    conn.executemany("UPDATE health_goals SET current_value = ?, progress_date = ? WHERE id = ?", updates)
+    if updates:
+        conn.changed(user_id, 'goals')
+
+def _goal_value(conn, user_id, metric, start, end):
+    """按 (user_id, record_date) 索引在目标期内聚合，返回 (值, 最新记录日期)；期内无记录返回 None"""
+    table, column, mode = metric
+    lo, hi = _date_window(start, end)
+    if mode == 'sum':
+        sql = f"""SELECT SUM({column}), MAX(record_date) FROM {table}
+                  WHERE user_id = ? AND record_date >= ? AND record_date <= ? AND {column} IS NOT NULL"""
+    else:
+        sql = f"""SELECT {column}, record_date FROM {table}
+                  WHERE user_id = ? AND record_date >= ? AND record_date <= ? AND {column} IS NOT NULL
+                  ORDER BY record_date DESC, id DESC LIMIT 1"""
+    row = conn.execute(sql, (user_id, lo, hi)).fetchone()
+    return tuple(row) if row and row[1] is not None else None
+
+def reconcile_goals(conn=None, user_ids=None, goal_ids=None):
+    """按记录重新计算进行中目标的进度，修正增量计算的偏差（删除、修改或批量导入的记录）
+
+    不传 conn 时在各分片上并行执行、自行连接并分批提交（夜间对账），否则由调用方控制事务。
+    可按 user_ids 或 goal_ids 限定范围；返回被修正的目标数。
+    """
+    if conn is None:
+        def run(shard):
+            conn = shard_connection(shard)
+            try:
+                return _reconcile_goals(conn, user_ids, goal_ids, True)
+            finally:
+                conn.close()
+        return sum(for_each_shard(run))
+    return _reconcile_goals(conn, user_ids, goal_ids, False)
+
+def _reconcile_goals(conn, user_ids, goal_ids, commit):
+    where, params = "status = 'active'", []
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        where += f" AND user_id IN ({','.join('?' * len(user_ids))})"
+        params += user_ids
+    if goal_ids is not None:
+        goal_ids = list(goal_ids)
+        where += f" AND id IN ({','.join('?' * len(goal_ids))})"
+        params += goal_ids
+    fixed = 0
+    last_id = 0
+    while True:
+        goals = conn.execute(f"""
+            SELECT id, user_id, goal_type, current_value, start_date, end_date, progress_date
+            FROM health_goals WHERE {where} AND id > ? ORDER BY id LIMIT ?
+        """, params + [last_id, RECONCILE_BATCH]).fetchall()
+        if not goals:
+            break
+        last_id = goals[-1][0]
+        updates = []
+        for goal_id, user_id, goal_type, current, start, end, progress_date in goals:
+            metric = goal_metric(goal_type)
+            if metric is None:
+                continue
+            result = _goal_value(conn, user_id, metric, start, end)
+            if result is None:
+                if metric[2] == 'sum' and progress_date is not None:
+                    result = (0, None)  # 已计入的记录被删光
+                else:
+                    continue
+            if result != (current, progress_date):
+                updates.append(result + (goal_id,))
+                conn.changed(user_id, 'goals')
+        conn.executemany("UPDATE health_goals SET current_value = ?, progress_date = ? WHERE id = ?", updates)
+        fixed += len(updates)
+        if commit:
+            conn.commit()
+    return fixed
+
 # --- 提醒管理 ---
+REMINDER_TIME_FORMATS = ('%H:%M', '%Y-%m-%d %H:%M')
+REPEAT_STEPS = {'daily': timedelta(days=1), 'weekly': timedelta(days=7)}
+FIRE_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def next_occurrence(reminder_time, repeat_type, after):
+    """计算晚于 after 的第一次触发时间（字符串）；时间无法解析或一次性提醒已过期时返回 None
+
+    reminder_time 为 "HH:MM"（从今天或明天开始）或 "YYYY-MM-DD HH:MM"（从指定日期开始）。
+    """
+    for fmt in REMINDER_TIME_FORMATS:
+        try:
+            parsed = datetime.strptime((reminder_time or '').strip(), fmt)
+            break
+        except ValueError:
+            continue
+    else:
+        return None
+    if fmt == '%H:%M':
+        at = datetime.combine(after.date(), parsed.time())
+        if at <= after:
+            at += timedelta(days=1)
+        return at.strftime(FIRE_TIME_FORMAT)
+    return advance(parsed, repeat_type, after)
+
+def advance(fired_at, repeat_type, now):
+    """重复提醒跳到晚于 now 的下一次（停机期间错过的不补发）；一次性提醒返回 None"""
+    step = REPEAT_STEPS.get(repeat_type)
+    if fired_at > now:
+        return fired_at.strftime(FIRE_TIME_FORMAT)
+    if step is None:
+        return None
+    skipped = (now - fired_at) // step + 1
+    return (fired_at + step * skipped).strftime(FIRE_TIME_FORMAT)
+
 def add_reminder(user_id, reminder_type, title, reminder_time, repeat_type='once'):
     """添加提醒"""
-    conn = get_connection()
+    next_fire_at = next_occurrence(reminder_time, repeat_type, datetime.now())
+    if next_fire_at is None:
+        return False, "提醒时间格式应为 HH:MM 或 YYYY-MM-DD HH:MM，且不能早于当前时间"
+    conn = get_connection(user_id)
     cursor = conn.cursor()
     try:
         cursor.execute('''
-            INSERT INTO reminders (user_id, reminder_type, title, reminder_time, repeat_type)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, reminder_type, title, reminder_time, repeat_type))
+            INSERT INTO reminders (user_id, reminder_type, title, reminder_time, repeat_type, next_fire_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (user_id, reminder_type, title, reminder_time, repeat_type, next_fire_at))
+        conn.changed(user_id, 'reminders')
         conn.commit()
         return True, "提醒创建成功"
     except Exception as e:
@@ -350,79 +1215,192 @@ def add_reminder(user_id, reminder_type, title, reminder_time, repeat_type='once
     finally:
         conn.close()
 
-def get_user_reminders(user_id):
-    """获取用户所有提醒"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM reminders WHERE user_id = ? AND is_active = 1 ORDER BY reminder_time", (user_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+def get_user_reminders(user_id, columns=None, shape='dict'):
+    """获取用户所有提醒（经结果缓存）"""
+    return _cached('reminders', user_id, (project('reminders', columns), shape), lambda: select(
+        'reminders', "user_id = ? AND is_active = 1", (user_id,), columns,
+        "reminder_time", shape=shape, user_id=user_id))
+
+def due_reminders(conn, until, after=None):
+    """按 (is_active, next_fire_at) 索引做范围查询，取 (after, until] 内待触发的提醒 [(next_fire_at, id)]"""
+    if after is None:
+        sql = "SELECT next_fire_at, id FROM reminders WHERE is_active = 1 AND next_fire_at <= ?"
+        return conn.execute(sql, (until,)).fetchall()
+    sql = "SELECT next_fire_at, id FROM reminders WHERE is_active = 1 AND next_fire_at > ? AND next_fire_at <= ?"
+    return conn.execute(sql, (after, until)).fetchall()
+
+def fire_reminders(conn, due, now):
+    """触发一批到期提醒：写入通知并推进下一次触发时间，同一事务内完成
+
+    due 为 [(next_fire_at, id)]；已删除、停用或时间已变化的条目跳过。
+    返回 (已触发 [(user_id, message)], 新的下一次触发 [(next_fire_at, id)])。
+    """
+    expected = {rid: at for at, rid in due}
+    placeholders = ', '.join('?' * len(expected))
+    # 只按主键取；is_active 放到 Python 里判断，避免规划器改走 (is_active, next_fire_at) 索引扫描全部有效提醒
+    rows = conn.execute(f"SELECT id, user_id, reminder_type, title, repeat_type, next_fire_at, is_active "
+                        f"FROM reminders WHERE id IN ({placeholders})", list(expected)).fetchall()
+    fired, rescheduled, updates = [], [], []
+    for rid, user_id, reminder_type, title, repeat_type, next_fire_at, is_active in rows:
+        if not is_active or next_fire_at != expected[rid]:
+            continue
+        nxt = advance(datetime.strptime(next_fire_at, FIRE_TIME_FORMAT), repeat_type, now)
+        updates.append((nxt, 0 if nxt is None else 1, rid))
+        fired.append((user_id, f"⏰ {reminder_type or ''}提醒：{title or ''}"))
+        if nxt is not None:
+            rescheduled.append((nxt, rid))
+        else:
+            conn.changed(user_id, 'reminders')  # 一次性提醒触发后停用，不再出现在提醒列表中
+    conn.executemany("UPDATE reminders SET next_fire_at = ?, is_active = ? WHERE id = ?", updates)
+    conn.executemany("INSERT INTO notifications (user_id, message) VALUES (?, ?)", fired)
+    conn.commit()
+    return fired, rescheduled
 
 # --- 饮食记录 ---
+def insert_diet_record(conn, user_id, record_date, meal_type, food_description, calories=0):
+    """写入一条饮食记录并推进相关目标（由调用方控制事务）"""
+    conn.execute('''
+        INSERT INTO diet_records (user_id, record_date, meal_type, food_description, calories)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (user_id, record_date, meal_type, food_description, calories))
+    apply_goal_progress(conn, user_id, 'diet_records', record_date, {'calories': calories})
+    return "饮食记录添加成功"
+
 def add_diet_record(user_id, record_date, meal_type, food_description, calories=0):
     """添加饮食记录"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute('''
-            INSERT INTO diet_records (user_id, record_date, meal_type, food_description, calories)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, record_date, meal_type, food_description, calories))
-        conn.commit()
-        return True, "饮食记录添加成功"
-    except Exception as e:
-        return False, str(e)
-    finally:
-        conn.close()
+    return write(insert_diet_record, user_id, record_date, meal_type, food_description, calories)
 
-def get_user_diet_records(user_id, date=None):
+def get_user_diet_records(user_id, date=None, columns=None, shape='dict'):
     """获取用户饮食记录"""
-    conn = get_connection()
-    cursor = conn.cursor()
     if date:
-        cursor.execute("SELECT * FROM diet_records WHERE user_id = ? AND record_date = ? ORDER BY id DESC", (user_id, date))
-    else:
-        cursor.execute("SELECT * FROM diet_records WHERE user_id = ? ORDER BY record_date DESC LIMIT 50", (user_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+        return select('diet_records', "user_id = ? AND record_date = ?", (user_id, date), columns,
+                      "id DESC", shape=shape, user_id=user_id)
+    return select('diet_records', "user_id = ?", (user_id,), columns, "record_date DESC", 50, shape=shape,
+                  user_id=user_id)
 
 # --- 新增：管理员管理接口 ---
 
-def get_all_users(query=None):
-    """管理员：获取所有用户列表（不包含密码）"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    sql = "SELECT id, username, role, age, gender, created_at FROM users WHERE role != 'admin'"
-    params = []
-    
+USER_LIST_COLUMNS = ('id', 'username', 'role', 'age', 'gender', 'created_at')
+# 用户检索：默认每页条数与可翻阅的结果上限
+SEARCH_PAGE_SIZE = 50
+SEARCH_MAX_RESULTS = 500
+
+def get_all_users(query=None, columns=USER_LIST_COLUMNS, shape='dict', limit=None, offset=0):
+    """管理员：获取所有用户列表（不包含密码）；有检索词时见 search_users，指定 limit 时分页"""
     if query:
-        sql += " AND username LIKE ?"
-        params.append(f"%{query}%")
-        
-    sql += " ORDER BY created_at DESC"
-    
-    cursor.execute(sql, params)
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+        return search_users(query, columns, limit or SEARCH_PAGE_SIZE, offset, shape)
+    columns = project('users', columns)
+    with replica() as conn:
+        if limit:
+            rows = conn.execute(_user_search_sql(columns, 'all'), (int(limit), int(offset))).fetchall()
+        else:
+            rows = conn.execute(_select_sql('users', columns, "role != 'admin'", "created_at DESC, id DESC")).fetchall()
+    return _shape('users', columns, rows, shape)
+
+def search_users(query, columns=USER_LIST_COLUMNS, limit=SEARCH_PAGE_SIZE, offset=0, shape='dict'):
+    """管理员检索用户，分页返回，offset + limit 不超过 SEARCH_MAX_RESULTS
+
+    检索词不少于 3 个字符时走 trigram 全文索引，在用户名与过敏史、慢性病中做子串匹配（不区分大小写），
+    按注册先后倒序；更短的检索词（trigram 无法索引）在用户名中做 LIKE 子串匹配，同样按注册先后倒序，
+    扫描在取满 limit 条后停止。
+    """
+    columns = project('users', columns)
+    limit = max(0, min(int(limit), SEARCH_MAX_RESULTS - int(offset)))
+    if not limit:
+        return []
+    params = (limit, int(offset))
+    if len(query) >= 3:
+        sql = _user_search_sql(columns, 'fts')
+        params = ('"' + query.replace('"', '""') + '"',) + params
+    else:
+        sql = _user_search_sql(columns, 'like')
+        params = (f"%{query}%",) + params
+    with replica() as conn:
+        try:
+            rows = conn.execute(sql, params).fetchall()
+        except sqlite3.OperationalError:
+            # 未建立全文索引（SQLite 不支持 FTS5）
+            rows = conn.execute(_user_search_sql(columns, 'like'), (f"%{query}%",) + params[-2:]).fetchall()
+    return _shape('users', columns, rows, shape)
+
+def search_history(user_id, query, start_date=None, end_date=None, sources=None, limit=20, offset=0):
+    """检索用户自己的历史文本（健康记录备注、饮食描述、用药），只查索引表，不扫描基础表
+
+    检索词不少于 3 个字符时走全文索引，按相关度（bm25）排序并返回带标记的摘要；
+    更短的检索词在该用户的文档内逐条匹配，按日期倒序。
+    返回 [{"source", "id", "date", "snippet", "score"}]。
+    """
+    query = query.strip()
+    if not query:
+        return []
+    filters, params = "", []
+    if start_date:
+        filters += " AND d.record_date >= ?"
+        params.append(start_date)
+    if end_date:
+        filters += " AND d.record_date <= ?"
+        params.append(end_date)
+    if sources:
+        sources = [src for src in sources if src in HISTORY_SOURCES]
+        filters += f" AND d.source IN ({', '.join('?' * len(sources))})"
+        params += sources
+    page = (min(int(limit), SEARCH_PAGE_SIZE), int(offset))
+
+    conn = _reader(shard_of(user_id))
+    if len(query) >= 3:
+        phrase = '"' + query.replace('"', '""') + '"'
+        sql = (f"SELECT d.source, d.source_id, d.record_date, "
+               f"snippet(history_fts, 1, '[', ']', '…', 16), bm25(history_fts, 0.0, 1.0) AS score "
+               f"FROM history_fts JOIN history_docs d ON d.id = history_fts.rowid "
+               f"WHERE history_fts MATCH ?{filters} ORDER BY score LIMIT ? OFFSET ?")
+        match = f'owner : "<{int(user_id)}>" AND content : {phrase}'
+        try:
+            rows = conn.execute(sql, [match] + params + list(page)).fetchall()
+            return [{"source": r[0], "id": r[1], "date": r[2], "snippet": r[3], "score": round(-r[4], 3)}
+                    for r in rows]
+        except sqlite3.OperationalError:
+            pass  # 未建立全文索引，按短检索词的方式处理
+    sql = (f"SELECT d.source, d.source_id, d.record_date, d.content FROM history_docs d "
+           f"WHERE d.user_id = ? AND instr(lower(d.content), ?) > 0{filters} "
+           f"ORDER BY d.record_date DESC, d.id DESC LIMIT ? OFFSET ?")
+    rows = conn.execute(sql, [user_id, query.lower()] + params + list(page)).fetchall()
+    return [{"source": r[0], "id": r[1], "date": r[2], "snippet": _snippet(r[3], query), "score": None}
+            for r in rows]
+
+def _snippet(text, query, width=16):
+    """截取匹配位置附近的文本并用 [] 标出匹配部分"""
+    pos = text.lower().find(query.lower())
+    if pos < 0:
+        # 数据库与 Python 的大小写转换规则不同时可能找不到匹配位置，退回截取开头
+        return text[:2 * width] + ('…' if len(text) > 2 * width else '')
+    start, end = max(0, pos - width), min(len(text), pos + len(query) + width)
+    return ('…' if start else '') + text[start:pos] + '[' + text[pos:pos + len(query)] + ']' \
+        + text[pos + len(query):end] + ('…' if end < len(text) else '')
+
+@lru_cache(maxsize=64)
+def _user_search_sql(columns, mode):
+    cols = ', '.join('u.' + c for c in columns)
+    if mode == 'fts':
+        return (f"SELECT {cols} FROM users_fts JOIN users u ON u.id = users_fts.rowid "
+                f"WHERE users_fts MATCH ? AND u.role != 'admin' ORDER BY users_fts.rowid DESC LIMIT ? OFFSET ?")
+    if mode == 'like':
+        return (f"SELECT {cols} FROM users u WHERE u.username LIKE ? AND u.role != 'admin' "
+                f"ORDER BY u.id DESC LIMIT ? OFFSET ?")
+    # 与不分页的用户列表同序（注册时间倒序），由 idx_users_created 索引按序读取
+    return (f"SELECT {cols} FROM users u WHERE u.role != 'admin' "
+            f"ORDER BY u.created_at DESC, u.id DESC LIMIT ? OFFSET ?")
 
 def delete_user(user_id):
-    """管理员：删除用户及其所有关联数据"""
-    conn = get_connection()
-    cursor = conn.cursor()
+    """管理员：删除用户，关联数据由外键级联删除（同一事务）；分片模式下先删分片数据，最后删目录库中的用户"""
+    conn = get_connection(user_id)
     try:
-        # 1. 删除关联表数据
-        tables = ['health_data', 'medications', 'health_goals', 'reminders', 'diet_records', 'notifications']
-        for table in tables:
-            cursor.execute(f"DELETE FROM {table} WHERE user_id = ?", (user_id,))
-            
-        # 2. 删除用户本身
-        cursor.execute("DELETE FROM users WHERE id = ?", (user_id,))
-        
+        conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+        # 已归档的记录不在外键范围内，单独删除（其历史检索文档也随之清理）
+        conn.execute("DELETE FROM history_docs WHERE user_id = ?", (user_id,))
         conn.commit()
+        _purge_archives(conn, user_id)
+        _delete_directory_user(user_id)
+        results.invalidate([(user_id, None)])
         return True, "用户及其数据已彻底删除"
     except Exception as e:
         conn.rollback()
@@ -430,11 +1408,42 @@ def delete_user(user_id):
     finally:
         conn.close()
 
+def purge_user(user_id, chunk=PURGE_CHUNK, pause=PURGE_PAUSE):
+    """管理员：分批删除用户数据，每批一个短事务，批间让出写锁，数据量大的用户也不会长时间阻塞其他写入
+
+    最后删除用户本身，期间新写入的少量记录由级联删除一并清理。
+    """
+    conn = get_connection(user_id)
+    deleted = 0
+    try:
+        deleted += _purge_archives(conn, user_id, chunk, pause)
+        # history_docs 中剩下的是已归档记录的检索文档
+        for table in CHILD_TABLES + ('history_docs',):
+            while True:
+                count = conn.execute(f"DELETE FROM {table} WHERE rowid IN "
+                                     f"(SELECT rowid FROM {table} WHERE user_id = ? LIMIT ?)",
+                                     (user_id, chunk)).rowcount
+                conn.commit()
+                deleted += count
+                if count < chunk:
+                    break
+                sleep(pause)
+        conn.execute("DELETE FROM users WHERE id = ?", (user_id,))
+        conn.commit()
+        _delete_directory_user(user_id)
+        results.invalidate([(user_id, None)])
+        return True, f"用户及其数据已彻底删除（关联记录 {deleted} 条）"
+    except Exception as e:
+        conn.rollback()
+        return False, str(e)
+    finally:
+        conn.close()
+
 # --- 新增：通知管理接口 ---
 
 def send_notification(user_id, message):
     """管理员：发送通知给特定用户"""
-    conn = get_connection()
+    conn = get_connection(user_id)
     cursor = conn.cursor()
     try:
         cursor.execute("INSERT INTO notifications (user_id, message) VALUES (?, ?)", (user_id, message))
@@ -447,25 +1456,17 @@ def send_notification(user_id, message):
 
 def get_user_notifications(user_id, only_unread=True):
     """用户：获取通知"""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    sql = "SELECT * FROM notifications WHERE user_id = ?"
-    if only_unread:
-        sql += " AND is_read = 0"
-    sql += " ORDER BY created_at DESC"
-    
-    cursor.execute(sql, (user_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    return [dict(row) for row in rows]
+    where = "user_id = ? AND is_read = 0" if only_unread else "user_id = ?"
+    return select('notifications', where, (user_id,), order_by="created_at DESC", user_id=user_id)
 
-def mark_notification_read(notif_id):
-    """用户：标记通知为已读"""
-    conn = get_connection()
+def mark_notification_read(notif_id, user_id=None):
+    """用户：标记通知为已读；传入 user_id 时只能标记自己的通知（分片模式下须传入）"""
+    where, params = _owned(notif_id, user_id)
+    conn = get_connection(user_id)
     cursor = conn.cursor()
     try:
-        cursor.execute("UPDATE notifications SET is_read = 1 WHERE id = ?", (notif_id,))
+        if cursor.execute(f"UPDATE notifications SET is_read = 1 WHERE {where}", params).rowcount == 0:
+            return False, "通知不存在"
         conn.commit()
         return True, "操作成功"
     except Exception as e:
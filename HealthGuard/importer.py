@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+HealthGuard 历史健康数据导入工具
+以生成器流水线流式处理 CSV / JSONL 文件：解析 -> 校验 -> 用户映射 -> 分块事务写入，
+支持断点续传（checkpoint）与进度/速率汇报，内存占用与文件大小无关。
+
+用法:
+    python importer.py data.csv                          # 默认从上次的断点继续
+    python importer.py data.jsonl --chunk-size 5000
+    python importer.py data.csv --no-resume              # 忽略断点，从头导入
+"""
+
+import csv
+import json
+import os
+import time
+import argparse
+from datetime import datetime
+import database
+
+DEFAULT_CHUNK_SIZE = 2000
+PROGRESS_EVERY = 50000
+
+# 源文件列名 -> health_data 列名（兼容客户端/接口中使用的简写）
+FIELD_ALIASES = {
+    'date': 'record_date',
+    'sys_bp': 'systolic_bp',
+    'dia_bp': 'diastolic_bp',
+}
+
+INT_FIELDS = {'systolic_bp', 'diastolic_bp', 'steps', 'heart_rate', 'water_intake'}
+REAL_FIELDS = {'weight', 'blood_sugar', 'temperature', 'sleep_hours'}
+
+
+class ImportStats:
+    """导入过程统计"""
+    def __init__(self, skipped=0):
+        self.read = 0
+        self.inserted = 0
+        self.rejected = 0
+        self.skipped = skipped
+        self.errors = []  # 只保留前若干条错误，避免大文件撑爆内存
+        self.started = time.time()
+
+    def reject(self, line_no, reason):
+        self.rejected += 1
+        if len(self.errors) < 20:
+            self.errors.append(f"第 {line_no} 行: {reason}")
+
+    def rows_per_sec(self):
+        elapsed = time.time() - self.started
+        return round(self.inserted / elapsed, 1) if elapsed > 0 else 0.0
+
+    def to_dict(self):
+        return {
+            "read": self.read,
+            "inserted": self.inserted,
+            "rejected": self.rejected,
+            "skipped": self.skipped,
+            "rows_per_sec": self.rows_per_sec(),
+            "errors": self.errors,
+        }
+
+
+def detect_format(path):
+    """根据扩展名判断文件格式"""
+    ext = os.path.splitext(path)[1].lower()
+    return 'jsonl' if ext in ('.jsonl', '.ndjson', '.json') else 'csv'
+
+
+# --- 流水线各阶段（均为生成器） ---
+
+def read_rows(path, fmt=None, skip=0):
+    """逐行读取源文件，产出 (行号, 原始字典或 JSONL 原始行)；skip 为续传时跳过的数据行数
+
+    JSONL 在校验阶段才解析，格式错误的行计入 rejected，不会中断整个导入。
+    """
+    fmt = fmt or detect_format(path)
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        if fmt == 'csv':
+            rows = csv.DictReader(f)
+        else:
+            rows = (line if line.strip() else None for line in f)
+        for line_no, raw in enumerate(rows, 1):
+            if line_no <= skip or raw is None:
+                continue
+            yield line_no, raw
+
+
+def validate_rows(rows, stats):
+    """字段归一化与类型校验，不合格的行计入 rejected 并丢弃"""
+    for line_no, raw in rows:
+        stats.read += 1
+        record = {}
+        if isinstance(raw, str):
+            try:
+                raw = json.loads(raw)
+            except ValueError as e:
+                stats.reject(line_no, f"JSON 格式错误 ({e})")
+                continue
+        try:
+            for key, value in raw.items():
+                if key is None:
+                    continue
+                key = FIELD_ALIASES.get(key.strip(), key.strip())
+                if value == '' or value is None:
+                    continue
+                if key in INT_FIELDS:
+                    value = int(float(value))
+                elif key in REAL_FIELDS:
+                    value = float(value)
+                record[key] = value
+        except (ValueError, TypeError, AttributeError) as e:
+            stats.reject(line_no, f"字段格式错误 ({e})")
+            continue
+
+        if not record.get('record_date'):
+            stats.reject(line_no, "缺少 record_date")
+            continue
+        try:
+            datetime.strptime(str(record['record_date']), '%Y-%m-%d')
+        except ValueError:
+            stats.reject(line_no, f"record_date 不是 YYYY-MM-DD 格式的有效日期 ({record['record_date']})")
+            continue
+        if 'user_id' not in record and 'username' not in record:
+            stats.reject(line_no, "缺少 user_id 或 username")
+            continue
+        yield line_no, record
+
+
+def map_users(rows, conn, stats):
+    """把 username 解析为 user_id，并确认 user_id 存在；结果做进程内缓存"""
+    known = {}
+    for line_no, record in rows:
+        if 'user_id' in record:
+            key = ('id', str(record['user_id']))
+            sql = "SELECT id FROM users WHERE id = ?"
+            param = record['user_id']
+        else:
+            key = ('name', record['username'])
+            sql = "SELECT id FROM users WHERE username = ?"
+            param = record['username']
+
+        if key not in known:
+            row = conn.execute(sql, (param,)).fetchone()
+            known[key] = row[0] if row else None
+        user_id = known[key]
+        if user_id is None:
+            stats.reject(line_no, f"用户不存在 ({param})")
+            continue
+
+        yield line_no, tuple([user_id] + [record.get(f) for f in database.HEALTH_RECORD_FIELDS])
+
+
+def insert_chunks(rows, conns, stats, chunk_size, checkpoint=None, progress=None, progress_every=PROGRESS_EVERY):
+    """按 chunk_size 分块写入，每块在其涉及的每个分片上各一个事务，全部提交后更新断点
+
+    conns 为各分片的连接（按分片序号）。分片模式下一块跨分片提交不是原子的，
+    若在两个分片的提交之间中断，续传时该块已提交部分会重复导入。
+    """
+    chunk = []
+    last_line = stats.skipped
+    next_report = progress_every
+
+    def flush():
+        by_shard = {}
+        for row in chunk:
+            by_shard.setdefault(database.shard_of(row[0]), []).append(row)
+        for shard, shard_rows in sorted(by_shard.items()):
+            conn = conns[shard]
+            database.insert_health_records(conn, shard_rows)
+            # 批量导入不逐行推进目标，按本块涉及的用户在同一事务内重算其进行中目标
+            database.reconcile_goals(conn, user_ids={row[0] for row in shard_rows})
+            conn.commit()
+        stats.inserted += len(chunk)
+        chunk.clear()
+        if checkpoint:
+            save_checkpoint(checkpoint, last_line, stats)
+
+    for line_no, values in rows:
+        chunk.append(values)
+        last_line = line_no
+        if len(chunk) >= chunk_size:
+            flush()
+            if progress and stats.inserted >= next_report:
+                progress(stats)
+                next_report += progress_every
+
+    if chunk:
+        flush()
+    elif checkpoint and last_line > stats.skipped:
+        # 最后一段全部被拒绝时也要推进断点
+        save_checkpoint(checkpoint, last_line, stats)
+
+
+# --- 断点续传 ---
+
+def checkpoint_path(path):
+    return path + '.ckpt'
+
+
+def load_checkpoint(checkpoint):
+    """读取断点，返回已处理完成的数据行数"""
+    if not os.path.exists(checkpoint):
+        return 0
+    with open(checkpoint, 'r', encoding='utf-8') as f:
+        return json.load(f).get('line', 0)
+
+
+def save_checkpoint(checkpoint, line_no, stats):
+    tmp = checkpoint + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({"line": line_no, "inserted": stats.inserted, "rejected": stats.rejected}, f)
+    os.replace(tmp, checkpoint)  # 原子替换，中途崩溃也不会留下半个文件
+
+
+def print_progress(stats):
+    print(f"[IMPORT] 已导入 {stats.inserted} 行, 拒绝 {stats.rejected} 行, {stats.rows_per_sec()} 行/秒")
+
+
+def import_file(path, fmt=None, chunk_size=DEFAULT_CHUNK_SIZE, resume=True, progress=None,
+                progress_every=PROGRESS_EVERY):
+    """导入入口：返回 (是否成功, 统计字典或错误信息)；每导入约 progress_every 行调用一次 progress(stats)"""
+    if not os.path.isfile(path):
+        return False, f"文件不存在: {path}"
+
+    checkpoint = checkpoint_path(path)
+    skip = load_checkpoint(checkpoint) if resume else 0
+    stats = ImportStats(skipped=skip)
+
+    conns = [database.shard_connection(shard) for shard in range(database.SHARDS)]
+    # 用户映射查目录库；未分片时与写入共用一个连接
+    directory = database.get_connection() if database.SHARDS > 1 else conns[0]
+    try:
+        pipeline = read_rows(path, fmt, skip)
+        pipeline = validate_rows(pipeline, stats)
+        pipeline = map_users(pipeline, directory, stats)
+        insert_chunks(pipeline, conns, stats, chunk_size, checkpoint, progress, progress_every)
+    except Exception as e:
+        for conn in conns:
+            conn.rollback()
+        # 已提交的块保留在断点中，下次 resume 从断点继续
+        return False, f"导入中断: {e}（已导入 {stats.inserted} 行，可使用续传继续）"
+    finally:
+        for conn in set(conns + [directory]):
+            conn.close()
+
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return True, stats.to_dict()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="导入历史健康数据 (CSV / JSONL)")
+    parser.add_argument("path", help="源文件路径")
+    parser.add_argument("--format", choices=['csv', 'jsonl'], help="文件格式（默认按扩展名判断）")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="每个事务写入的行数")
+    parser.add_argument("--no-resume", action="store_true", help="忽略已有断点，从头导入")
+    args = parser.parse_args()
+
+    database.init_db()
+    success, result = import_file(args.path, args.format, args.chunk_size,
+                                  resume=not args.no_resume, progress=print_progress)
+    if success:
+        print(f"✅ 导入完成: 导入 {result['inserted']} 行, 拒绝 {result['rejected']} 行, "
+              f"跳过 {result['skipped']} 行, {result['rows_per_sec']} 行/秒")
+        for err in result['errors']:
+            print(f"   {err}")
+    else:
+        print(f"❌ {result}")
@@ -0,0 +1,126 @@
+import threading
+from multiprocessing.connection import wait
+
+
+class WorkerChannel:
+    """工作进程一侧的 IPC 通道：向主进程发布事件，并接收其他工作进程广播的事件"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.handlers = {}  # 事件类型 -> 处理函数
+        self._lock = threading.Lock()
+
+    def on(self, event_type, handler):
+        self.handlers[event_type] = handler
+
+    def publish(self, event):
+        try:
+            with self._lock:
+                self.conn.send(event)
+        except (OSError, ValueError):
+            pass  # 主进程已退出，单机内事件丢失不影响本进程
+
+    def start(self):
+        threading.Thread(target=self._listen, daemon=True, name='ipc').start()
+
+    def _listen(self):
+        while True:
+            try:
+                event = self.conn.recv()
+            except (EOFError, OSError):
+                return
+            handler = self.handlers.get(event.get('type'))
+            if handler:
+                try:
+                    handler(event)
+                except Exception as e:
+                    print(f"[IPC] 处理事件 {event.get('type')} 失败: {e}")
+
+
+class Hub:
+    """主进程一侧的事件中转：把任一工作进程发布的事件转发给其余所有工作进程
+
+    同时维护一份会话副本，新启动（或重启）的工作进程加入时先下发快照。
+    中转线程、调度器与写入线程都会调用 broadcast，同一 Connection 上的并发 send 会使消息交错，
+    每个通道的发送由各自的锁串行化。
+    """
+
+    def __init__(self, sessions):
+        self.sessions = sessions
+        self._conns = {}  # worker_id -> Connection
+        self._send_locks = {}  # Connection -> 发送锁
+        self._lock = threading.Lock()
+        self.handlers = {}  # 主进程自身也需处理的事件类型 -> 处理函数
+
+    def on(self, event_type, handler):
+        self.handlers[event_type] = handler
+
+    def add(self, worker_id, conn):
+        # 快照与登记在同一把锁内完成，保证新进程不会漏掉其间到达的会话事件
+        with self._lock:
+            snapshot = {"type": "session_snapshot", "sessions": self.sessions.snapshot()}
+            self._conns[worker_id] = conn
+            self._send_locks[conn] = threading.Lock()
+            self._send(conn, snapshot)
+
+    def remove(self, worker_id):
+        with self._lock:
+            conn = self._conns.pop(worker_id, None)
+            self._send_locks.pop(conn, None)
+        if conn:
+            conn.close()
+
+    def start(self):
+        threading.Thread(target=self._relay, daemon=True, name='ipc-hub').start()
+
+    def _relay(self):
+        while True:
+            with self._lock:
+                conns = dict(self._conns)
+            if not conns:
+                threading.Event().wait(0.2)
+                continue
+            # 超时返回以便感知新加入/重启的工作进程
+            try:
+                readable = wait(list(conns.values()), timeout=0.5)
+            except (OSError, ValueError):
+                continue  # 等待期间有通道被关闭
+            for ready in readable:
+                try:
+                    event = ready.recv()
+                except (EOFError, OSError):
+                    self._drop(ready)  # 工作进程已退出
+                    continue
+                self.broadcast(event, exclude=ready)
+                handler = self.handlers.get(event.get('type'))
+                if handler:
+                    try:
+                        handler(event)
+                    except Exception as e:
+                        print(f"[IPC] 处理事件 {event.get('type')} 失败: {e}")
+
+    def _drop(self, conn):
+        with self._lock:
+            for worker_id, c in list(self._conns.items()):
+                if c is conn:
+                    del self._conns[worker_id]
+            self._send_locks.pop(conn, None)
+        conn.close()
+
+    def broadcast(self, event, exclude=None):
+        with self._lock:
+            if event.get('type', '').startswith('session_'):
+                self.sessions.apply(event)
+            targets = [c for c in self._conns.values() if c is not exclude]
+        for conn in targets:
+            self._send(conn, event)
+
+    def _send(self, conn, event):
+        lock = self._send_locks.get(conn)
+        if lock is None:
+            return  # 通道已移除
+        try:
+            with lock:
+                conn.send(event)
+        except (OSError, ValueError):
+            pass
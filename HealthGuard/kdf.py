@@ -0,0 +1,16 @@
+"""
+KDF 运算（在 passwords 的进程池子进程中执行）
+本模块只依赖标准库、导入时没有副作用，进程池的 forkserver 只预加载本模块。
+"""
+
+import hashlib
+
+
+def derive(scheme, password, salt, params):
+    """返回十六进制摘要"""
+    if scheme == 'scrypt':
+        n, r, p = params
+        digest = hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=128 * r * n * 2)
+    else:
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, params[0])
+    return digest.hex()
@@ -0,0 +1,127 @@
+import bisect
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 延迟直方图的桶上界（秒），最后隐含 +Inf 桶
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# 最多单独统计的接口数，超出的归入 "other"，防止异常请求撑大指标表
+MAX_ACTIONS = 128
+
+_FIELDS = ("count", "errors", "seconds", "db_seconds", "encode_seconds", "bytes_in", "bytes_out")
+
+
+class Metrics:
+    """按接口累计请求数、错误数、延迟直方图、收发字节数，以及数据库与编码耗时"""
+
+    def __init__(self):
+        self._actions = {}
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def observe(self, action, seconds, error=False, bytes_in=0, bytes_out=0, db_seconds=0.0, encode_seconds=0.0):
+        if not isinstance(action, str):
+            action = "unknown"
+        bucket = bisect.bisect_left(LATENCY_BUCKETS, seconds)
+        with self._lock:
+            entry = self._actions.get(action)
+            if entry is None:
+                if len(self._actions) >= MAX_ACTIONS:
+                    action = "other"
+                entry = self._actions.setdefault(action, dict.fromkeys(_FIELDS, 0))
+                entry.setdefault("buckets", [0] * (len(LATENCY_BUCKETS) + 1))
+            entry["count"] += 1
+            entry["errors"] += bool(error)
+            entry["seconds"] += seconds
+            entry["db_seconds"] += db_seconds
+            entry["encode_seconds"] += encode_seconds
+            entry["bytes_in"] += bytes_in
+            entry["bytes_out"] += bytes_out
+            entry["buckets"][bucket] += 1
+
+    def snapshot(self):
+        """各接口的汇总指标：次数、错误数、平均/分位延迟（毫秒，按直方图估算）、流量与耗时构成"""
+        with self._lock:
+            entries = {a: dict(e, buckets=list(e["buckets"])) for a, e in self._actions.items()}
+        result = {}
+        for action, e in sorted(entries.items()):
+            count = e["count"]
+            result[action] = {
+                "count": count, "errors": e["errors"],
+                "avg_ms": round(e["seconds"] / count * 1000, 3),
+                "p50_ms": _quantile(e["buckets"], count, 0.50),
+                "p95_ms": _quantile(e["buckets"], count, 0.95),
+                "p99_ms": _quantile(e["buckets"], count, 0.99),
+                "db_ms": round(e["db_seconds"] * 1000, 3),
+                "encode_ms": round(e["encode_seconds"] * 1000, 3),
+                "bytes_in": e["bytes_in"], "bytes_out": e["bytes_out"],
+            }
+        return result
+
+    def render(self, extra=None):
+        """Prometheus 文本格式；extra 为附加的 {指标名: 数值}，以 _total 结尾的按计数器导出，其余为仪表"""
+        with self._lock:
+            entries = {a: dict(e, buckets=list(e["buckets"])) for a, e in self._actions.items()}
+        lines = [
+            "# TYPE healthguard_requests_total counter",
+            "# TYPE healthguard_request_errors_total counter",
+            "# TYPE healthguard_request_seconds histogram",
+            "# TYPE healthguard_db_seconds_total counter",
+            "# TYPE healthguard_encode_seconds_total counter",
+            "# TYPE healthguard_bytes_in_total counter",
+            "# TYPE healthguard_bytes_out_total counter",
+        ]
+        for action, e in sorted(entries.items()):
+            label = 'action="%s"' % action.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            lines.append(f'healthguard_requests_total{{{label}}} {e["count"]}')
+            lines.append(f'healthguard_request_errors_total{{{label}}} {e["errors"]}')
+            cumulative = 0
+            for bound, n in zip(LATENCY_BUCKETS + ("+Inf",), e["buckets"]):
+                cumulative += n
+                lines.append(f'healthguard_request_seconds_bucket{{{label},le="{bound}"}} {cumulative}')
+            lines.append(f'healthguard_request_seconds_sum{{{label}}} {e["seconds"]:.6f}')
+            lines.append(f'healthguard_request_seconds_count{{{label}}} {e["count"]}')
+            lines.append(f'healthguard_db_seconds_total{{{label}}} {e["db_seconds"]:.6f}')
+            lines.append(f'healthguard_encode_seconds_total{{{label}}} {e["encode_seconds"]:.6f}')
+            lines.append(f'healthguard_bytes_in_total{{{label}}} {e["bytes_in"]}')
+            lines.append(f'healthguard_bytes_out_total{{{label}}} {e["bytes_out"]}')
+        for name, value in (extra or {}).items():
+            lines.append(f"# TYPE healthguard_{name} {'counter' if name.endswith('_total') else 'gauge'}")
+            lines.append(f"healthguard_{name} {value}")
+        lines.append("# TYPE healthguard_uptime_seconds gauge")
+        lines.append(f"healthguard_uptime_seconds {time.time() - self.started:.0f}")
+        return "\n".join(lines) + "\n"
+
+
+def _quantile(buckets, count, q):
+    """由直方图估算分位数：落在哪个桶就取该桶上界（+Inf 桶取最大有限上界）"""
+    rank = q * count
+    cumulative = 0
+    for bound, n in zip(LATENCY_BUCKETS, buckets):
+        cumulative += n
+        if cumulative >= rank:
+            return bound * 1000
+    return LATENCY_BUCKETS[-1] * 1000
+
+
+def serve_http(render, host, port):
+    """在后台线程提供 GET /metrics 文本接口，render() 返回指标文本"""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # 抓取请求很频繁，不打印访问日志
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    threading.Thread(target=httpd.serve_forever, daemon=True, name='metrics-http').start()
+    return httpd
@@ -0,0 +1,484 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+HealthGuard 数据库结构迁移
+init_db 只负责建表；此后的结构变更以带版本号的迁移登记在 MIGRATIONS 中，已应用的版本记录在
+schema_version 表（目录库与各分片库各自记录，逐个库迁移）。面向大库：表重建按批复制、每批一个短事务，
+标记为 background 的迁移（只影响性能的索引等）在服务开始接受连接后于后台执行；试运行按当前行数抽样测速，
+估算耗时与最长持锁时间。
+
+用法:
+    python migrations.py              # 应用全部待执行的迁移
+    python migrations.py --dry-run    # 列出待执行的迁移及预计耗时
+    python migrations.py --status     # 查看已应用的版本
+"""
+
+import argparse
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+import database
+
+SAMPLE_ROWS = 20000   # 试运行测速的样本行数
+COPY_BATCH = 5000     # 表重建每批复制的行数
+COPY_PAUSE = 0.02     # 两批之间让出写锁的秒数
+
+
+class AddColumn:
+    """新增列：只改表结构定义，耗时与行数无关"""
+
+    def __init__(self, table, column, definition):
+        self.table, self.column, self.definition = table, column, definition
+
+    def describe(self):
+        return f"{self.table} 新增列 {self.column} {self.definition}"
+
+    def estimate(self, conn):
+        return 0.0, 0.0
+
+    def apply(self, conn):
+        if self.column not in _columns(conn, self.table):
+            conn.execute(f"ALTER TABLE {self.table} ADD COLUMN {self.column} {self.definition}")
+            conn.commit()
+
+
+class CreateIndex:
+    """创建索引
+
+    SQLite 在一条语句内建完整个索引：期间读不受影响，写入等待锁释放（sqlite3 默认最多等 5 秒），
+    大表上的索引应放在 background 迁移中，避开启动阶段并可用 --dry-run 先估算持锁时间。
+    """
+
+    def __init__(self, name, table, columns, where=None):
+        self.name, self.table, self.columns, self.where = name, table, columns, where
+
+    def describe(self):
+        return f"{self.table} 创建索引 {self.name} ({self.columns})"
+
+    def sql(self, table=None, name=None):
+        sql = f"CREATE INDEX IF NOT EXISTS {name or self.name} ON {table or self.table} ({self.columns})"
+        return sql + (f" WHERE {self.where}" if self.where else "")
+
+    def estimate(self, conn):
+        # 同一迁移中先新增再建索引的列，试运行时尚不存在，以空值代替
+        existing = _columns(conn, self.table)
+        select = ', '.join(c if c in existing else f"NULL AS {c}" for c in (c.strip() for c in self.columns.split(',')))
+        seconds = _sampled(conn, self.table, f"SELECT {select} FROM {self.table}",
+                           lambda: conn.execute(self.sql("_migration_sample", "temp._migration_sample_idx")))
+        return seconds, seconds
+
+    def apply(self, conn):
+        conn.execute(self.sql())
+        conn.commit()
+
+
+class RebuildTable:
+    """按新的建表语句重建表（改约束、改列类型等 ALTER TABLE 做不到的变更）
+
+    影子表方式：先建新表并在旧表上挂触发器同步期间的增删改，再按 rowid 分批复制（每批一个短事务，
+    触发器写入的新版本优先），最后在一个短事务里删除旧表、改名并恢复原有索引、触发器与自增序列。
+    create_sql 中以 {name} 代表表名；按列名复制两表共有的列。
+    """
+
+    def __init__(self, table, create_sql, batch=COPY_BATCH, pause=COPY_PAUSE):
+        self.table, self.create_sql, self.batch, self.pause = table, create_sql, batch, pause
+
+    def describe(self):
+        return f"{self.table} 分批重建"
+
+    def estimate(self, conn):
+        rows = _row_estimate(conn, self.table)
+        copy = _sampled(conn, self.table, f"SELECT * FROM {self.table}", lambda: None)
+        pauses = -(-rows // self.batch) * self.pause
+        # 切换时重建原有索引，这部分在同一事务内完成，是最长的持锁时间
+        lock = 0.0
+        for name, sql in _dependents(conn, self.table, 'index'):
+            columns = sql[sql.index('(', sql.upper().index(' ON ')) + 1:sql.rindex(')')]
+            lock += CreateIndex(name, self.table, columns).estimate(conn)[0]
+        return copy + pauses + lock, max(lock, copy * min(self.batch, rows) / max(rows, 1))
+
+    def apply(self, conn):
+        table, shadow = self.table, f"{self.table}__rebuild"
+        conn.execute(f"DROP TABLE IF EXISTS {shadow}")  # 上次中断遗留的影子表
+        conn.execute(self.create_sql.format(name=shadow))
+        columns = [c for c in _columns(conn, shadow) if c in _columns(conn, table)]
+        cols = ', '.join(columns)
+        new = ', '.join(f"new.{c}" for c in columns)
+        conn.execute(f"CREATE TRIGGER {shadow}_ins AFTER INSERT ON {table} BEGIN "
+                     f"INSERT OR REPLACE INTO {shadow} ({cols}) VALUES ({new}); END")
+        conn.execute(f"CREATE TRIGGER {shadow}_upd AFTER UPDATE ON {table} BEGIN "
+                     f"DELETE FROM {shadow} WHERE rowid = old.rowid; "
+                     f"INSERT OR REPLACE INTO {shadow} ({cols}) VALUES ({new}); END")
+        conn.execute(f"CREATE TRIGGER {shadow}_del AFTER DELETE ON {table} BEGIN "
+                     f"DELETE FROM {shadow} WHERE rowid = old.rowid; END")
+        conn.commit()
+
+        # 挂上触发器之后的新行由触发器同步，只需复制到当前最大 rowid
+        last = conn.execute(f"SELECT max(rowid) FROM {table}").fetchone()[0] or 0
+        start = 0
+        while start < last:
+            conn.execute(f"INSERT OR IGNORE INTO {shadow} ({cols}) SELECT {cols} FROM {table} "
+                         f"WHERE rowid > ? AND rowid <= ?", (start, start + self.batch))
+            conn.commit()
+            start += self.batch
+            time.sleep(self.pause)
+
+        dependents = [sql for name, sql in _dependents(conn, table) if not name.startswith(shadow)]
+        seq = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table,)).fetchone()
+        conn.execute("PRAGMA foreign_keys = OFF")  # 事务内无法切换，必须在 BEGIN 之前
+        try:
+            conn.execute("BEGIN")
+            conn.execute(f"DROP TABLE {table}")
+            conn.execute(f"ALTER TABLE {shadow} RENAME TO {table}")
+            for sql in dependents:
+                conn.execute(sql)
+            if seq:
+                conn.execute("UPDATE sqlite_sequence SET seq = max(seq, ?) WHERE name = ?", (seq[0], table))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.execute("PRAGMA foreign_keys = ON")
+
+
+class CascadeForeignKeys(RebuildTable):
+    """子表对 users 的外键补上 ON DELETE CASCADE（SQLite 不能修改已有约束，只能重建表）；已带级联的表跳过
+
+    复制期间关闭本连接的外键检查，旧库中的无主记录原样保留，完成后报告其数量。
+    """
+
+    def __init__(self, table, batch=COPY_BATCH, pause=COPY_PAUSE):
+        super().__init__(table, None, batch, pause)
+
+    def describe(self):
+        return f"{self.table} 外键改为级联删除（分批重建）"
+
+    def _current_sql(self, conn):
+        sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (self.table,)).fetchone()[0]
+        return None if 'ON DELETE CASCADE' in sql.upper() else sql
+
+    def estimate(self, conn):
+        return super().estimate(conn) if self._current_sql(conn) else (0.0, 0.0)
+
+    def apply(self, conn):
+        sql = self._current_sql(conn)
+        if not sql:
+            return
+        sql = sql.replace('{', '{{').replace('}', '}}')
+        sql = sql.replace("REFERENCES users (id)", "REFERENCES users (id) ON DELETE CASCADE", 1)
+        self.create_sql = sql.replace(f"CREATE TABLE {self.table}", "CREATE TABLE {name}", 1)
+        conn.execute("PRAGMA foreign_keys = OFF")
+        super().apply(conn)  # 结束时恢复外键检查
+        orphans = len(conn.execute(f"PRAGMA foreign_key_check({self.table})").fetchall())
+        if orphans:
+            print(f"[MIGRATE] {self.table} 中有 {orphans} 条无主记录")
+
+
+class Backfill:
+    """以 INSERT ... SELECT 回填数据，按源表 rowid 分批，每批一个短事务
+
+    select 须带 WHERE 子句，源表以 {table} 代表、别名为 src；目标表的唯一约束保证重复执行不产生重复行。
+    """
+
+    def __init__(self, table, description, insert, select, batch=COPY_BATCH, pause=COPY_PAUSE):
+        self.table, self.description, self.insert, self.select = table, description, insert, select
+        self.batch, self.pause = batch, pause
+
+    def describe(self):
+        return f"{self.table} {self.description}"
+
+    def estimate(self, conn):
+        rows = _row_estimate(conn, self.table)
+        seconds = _sampled(conn, self.table, f"SELECT * FROM {self.table}", lambda: conn.execute(
+            f"SELECT count(*) FROM ({self.select.format(table='temp._migration_sample')})").fetchone())
+        return seconds, seconds * min(self.batch, rows) / max(rows, 1)
+
+    def apply(self, conn):
+        last = _row_estimate(conn, self.table)
+        start = 0
+        while start < last:
+            conn.execute(f"{self.insert} {self.select.format(table=self.table)} AND src.rowid > ? AND src.rowid <= ?",
+                         (start, start + self.batch))
+            conn.commit()
+            start += self.batch
+            time.sleep(self.pause)
+
+
+class FillColumn:
+    """逐行用 Python 计算列值（无法用 SQL 表达时），只填仍为 NULL 的行，按 id 分批，每批一个短事务"""
+
+    def __init__(self, table, column, inputs, compute, where="1", batch=COPY_BATCH, pause=COPY_PAUSE):
+        self.table, self.column, self.inputs, self.compute, self.where = table, column, inputs, compute, where
+        self.batch, self.pause = batch, pause
+
+    def describe(self):
+        return f"{self.table} 计算 {self.column}"
+
+    def estimate(self, conn):
+        rows = _row_estimate(conn, self.table)
+        seconds = _sampled(conn, self.table, f"SELECT {self.inputs} FROM {self.table} WHERE {self.where}",
+                           lambda: [self.compute(*row) for row in conn.execute("SELECT * FROM temp._migration_sample")])
+        return seconds, seconds * min(self.batch, rows) / max(rows, 1)
+
+    def apply(self, conn):
+        last = 0
+        while True:
+            rows = conn.execute(f"SELECT id, {self.inputs} FROM {self.table} WHERE {self.column} IS NULL "
+                                f"AND {self.where} AND id > ? ORDER BY id LIMIT ?", (last, self.batch)).fetchall()
+            if not rows:
+                break
+            last = rows[-1][0]
+            conn.executemany(f"UPDATE {self.table} SET {self.column} = ? WHERE id = ?",
+                             [(self.compute(*row[1:]), row[0]) for row in rows])
+            conn.commit()
+            time.sleep(self.pause)
+
+
+class RebuildFts:
+    """按内容表重建外部内容全文索引（FTS5 的 rebuild 是单条语句，期间持有写锁）；全文索引不存在时跳过"""
+
+    def __init__(self, table, fts, columns):
+        self.table, self.fts, self.columns = table, fts, columns
+
+    def describe(self):
+        return f"{self.table} 重建全文索引 {self.fts}"
+
+    def estimate(self, conn):
+        def build():
+            conn.execute(f"CREATE VIRTUAL TABLE temp._migration_fts USING fts5({self.columns}, tokenize='trigram')")
+            conn.execute(f"INSERT INTO temp._migration_fts SELECT {self.columns} FROM temp._migration_sample")
+            conn.execute("DROP TABLE temp._migration_fts")
+        try:
+            seconds = _sampled(conn, self.table, f"SELECT {self.columns} FROM {self.table}", build)
+        except sqlite3.OperationalError:
+            return 0.0, 0.0  # 未编译 FTS5
+        return seconds, seconds
+
+    def apply(self, conn):
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (self.fts,)).fetchone():
+            conn.execute(f"INSERT INTO {self.fts}({self.fts}) VALUES ('rebuild')")
+            conn.commit()
+
+
+class Migration:
+    def __init__(self, version, name, steps, background=False):
+        self.version, self.name, self.steps, self.background = version, name, steps, background
+
+
+def _history_backfill(table, date_col, content):
+    content = content.format(r='src')
+    return Backfill(table, "导入历史检索文档",
+                    "INSERT OR IGNORE INTO history_docs (user_id, owner, source, source_id, record_date, content)",
+                    f"SELECT src.user_id, '<' || src.user_id || '>', '{table}', src.id, src.{date_col}, {content} "
+                    f"FROM {{table}} AS src WHERE src.user_id IS NOT NULL AND trim({content}) != ''")
+
+
+# 版本号只增不改；已发布的迁移不要修改，新的结构变更追加新版本。
+# init_db 按最新结构建新表，对新库而言以下迁移都是空操作；旧库由这些迁移补齐。
+MIGRATIONS = [
+    Migration(1, "按角色统计用户数的索引", [CreateIndex('idx_users_role', 'users', 'role')], background=True),
+    Migration(2, "提醒的下一次触发时间", [
+        AddColumn('reminders', 'next_fire_at', 'TEXT'),
+        FillColumn('reminders', 'next_fire_at', 'reminder_time, repeat_type',
+                   lambda t, r: database.next_occurrence(t, r, datetime.now()), where="is_active = 1"),
+        CreateIndex('idx_reminders_due', 'reminders', 'is_active, next_fire_at'),
+    ]),
+    Migration(3, "目标增量进度与按用户、日期的索引", [
+        AddColumn('health_goals', 'progress_date', 'TEXT'),
+        CreateIndex('idx_health_goals_user', 'health_goals', 'user_id, status'),
+        CreateIndex('idx_health_data_user', 'health_data', 'user_id, record_date'),
+        CreateIndex('idx_diet_records_user', 'diet_records', 'user_id, record_date'),
+    ]),
+    Migration(4, "用户检索全文索引", [RebuildFts('users', 'users_fts', ', '.join(database.USER_SEARCH_FIELDS))]),
+    Migration(5, "历史检索文档", [_history_backfill(table, date_col, content)
+                                 for table, (date_col, content) in database.HISTORY_SOURCES.items()]),
+    Migration(6, "子表级联删除", [CascadeForeignKeys(table) for table in database.CHILD_TABLES] + [
+        CreateIndex('idx_medications_user', 'medications', 'user_id, start_date'),
+        CreateIndex('idx_reminders_user', 'reminders', 'user_id'),
+        CreateIndex('idx_notifications_user', 'notifications', 'user_id, is_read'),
+    ]),
+    Migration(7, "用户列表按注册时间分页的索引", [CreateIndex('idx_users_created', 'users', 'created_at')],
+              background=True),
+]
+
+
+def _columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})").fetchall()]
+
+
+def _dependents(conn, table, kind=None):
+    """表上的索引与触发器（自动创建的约束索引没有 sql，不需要恢复）"""
+    kinds = (kind,) if kind else ('index', 'trigger')
+    rows = conn.execute(f"SELECT name, sql FROM sqlite_master WHERE tbl_name = ? AND sql IS NOT NULL "
+                        f"AND type IN ({','.join('?' * len(kinds))})", (table,) + kinds).fetchall()
+    return [tuple(row) for row in rows]
+
+
+def _row_estimate(conn, table):
+    """以最大 rowid 估算行数：走主键 B 树只需 O(log n)，不用 count(*) 扫全表"""
+    return conn.execute(f"SELECT max(rowid) FROM {table}").fetchone()[0] or 0
+
+
+def _sampled(conn, table, select, work):
+    """取 SAMPLE_ROWS 行到临时表上执行 work 并计时，按行数线性外推到全表（秒）"""
+    rows = _row_estimate(conn, table)
+    if rows == 0:
+        return 0.0
+    started = time.perf_counter()
+    conn.execute(f"CREATE TEMP TABLE _migration_sample AS {select} LIMIT {SAMPLE_ROWS}")
+    try:
+        sampled = conn.execute("SELECT count(*) FROM temp._migration_sample").fetchone()[0]
+        work()
+        elapsed = time.perf_counter() - started
+    finally:
+        conn.execute("DROP TABLE temp._migration_sample")
+    return elapsed * rows / max(sampled, 1)
+
+
+def ensure_version_table(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        name TEXT,
+        applied_at TEXT,
+        seconds REAL
+    )
+    """)
+    conn.commit()
+
+
+def applied_versions(conn):
+    """已应用的版本；尚无 schema_version 表时为空（不建表，只读连接也可调用）"""
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'schema_version'").fetchone():
+        return set()
+    return {row[0] for row in conn.execute("SELECT version FROM schema_version").fetchall()}
+
+
+def pending(conn, migrations=None):
+    done = applied_versions(conn)
+    return [m for m in sorted(migrations or MIGRATIONS, key=lambda m: m.version) if m.version not in done]
+
+
+def _each_database(work, readonly=False):
+    """在目录库与各分片库上依次执行 work(conn, 库文件名)，返回结果列表
+
+    readonly 为真时以 mode=ro 打开（不存在的库跳过），连接无法修改库文件，临时表仍可使用。
+    """
+    results = []
+    for path in database.database_paths():
+        if readonly:
+            if not os.path.exists(path):
+                continue
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, factory=database.TimedConnection)
+        else:
+            conn = database.connect(path)
+        try:
+            results.append(work(conn, os.path.basename(path)))
+        finally:
+            conn.close()
+    return results
+
+
+def dry_run(conn=None, migrations=None):
+    """估算待执行迁移的耗时，返回 [{version, name, database, steps: [{step, rows, seconds, lock_seconds}]}]
+
+    未传 conn 时以只读方式逐个估算目录库与各分片库。
+    """
+    if conn is None:
+        return [m for plan in _each_database(lambda c, name: _dry_run(c, migrations, name), readonly=True)
+                for m in plan]
+    return _dry_run(conn, migrations, None)
+
+
+def _dry_run(conn, migrations, name):
+    plan = []
+    for m in pending(conn, migrations):
+        steps = []
+        for step in m.steps:
+            seconds, lock = step.estimate(conn)
+            steps.append({"step": step.describe(), "rows": _row_estimate(conn, step.table),
+                          "seconds": round(seconds, 3), "lock_seconds": round(lock, 3)})
+        plan.append({"version": m.version, "name": m.name, "database": name, "background": m.background,
+                     "steps": steps})
+    return plan
+
+
+def migrate(conn=None, migrations=None, foreground_only=False, progress=None):
+    """按版本顺序应用待执行的迁移，返回本次应用的版本列表
+
+    未传 conn 时依次迁移目录库与各分片库。
+    foreground_only 为真时跳过 background 迁移（服务启动阶段使用），由 start_background 随后补上；
+    background 迁移只做索引等性能相关的变更，不能作为之后迁移的前提。
+    每个步骤都可重复执行，中途中断后再次运行会从未记录版本的迁移重新开始。
+    """
+    if conn is None:
+        applied = _each_database(lambda c, name: _migrate(c, migrations, foreground_only, progress))
+        return sorted({version for done in applied for version in done})
+    return _migrate(conn, migrations, foreground_only, progress)
+
+
+def _migrate(conn, migrations, foreground_only, progress):
+    ensure_version_table(conn)
+    done = []
+    for m in pending(conn, migrations):
+        if foreground_only and m.background:
+            continue
+        started = time.perf_counter()
+        for step in m.steps:
+            if progress:
+                progress(f"[MIGRATE] v{m.version} {step.describe()}")
+            step.apply(conn)
+        conn.execute("INSERT INTO schema_version (version, name, applied_at, seconds) VALUES (?, ?, ?, ?)",
+                     (m.version, m.name, datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                      round(time.perf_counter() - started, 3)))
+        conn.commit()
+        done.append(m.version)
+    return done
+
+
+def start_background(progress=print):
+    """在后台线程应用剩余的迁移（服务已开始接受连接）"""
+    def run():
+        try:
+            done = migrate(progress=progress)
+            if done:
+                progress(f"[MIGRATE] 后台迁移完成: {done}")
+        except Exception as e:
+            progress(f"[MIGRATE] 后台迁移失败: {e}")
+    threading.Thread(target=run, daemon=True, name='migrations').start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HealthGuard 数据库结构迁移")
+    parser.add_argument("--dry-run", action="store_true", help="只估算待执行迁移的耗时，不修改数据库")
+    parser.add_argument("--status", action="store_true", help="查看已应用的版本")
+    args = parser.parse_args()
+
+    if args.status:
+        def status(conn, name):
+            done = applied_versions(conn)
+            if done:
+                for row in conn.execute("SELECT version, name, applied_at, seconds FROM schema_version ORDER BY version"):
+                    print(f"[{name}] v{row[0]}  {row[1]}  {row[2]}  {row[3]} 秒")
+            print(f"[{name}] 待执行: {[m.version for m in pending(conn)]}")
+        if not _each_database(status, readonly=True):
+            print("数据库尚未创建")
+    elif args.dry_run:
+        # 只读打开，不建表、不改日志模式；尚未创建的库没有需要迁移的数据
+        plan = dry_run()
+        if not plan:
+            print("没有待执行的迁移")
+        for m in plan:
+            print(f"[{m['database']}] v{m['version']} {m['name']}{'（后台）' if m['background'] else ''}")
+            for s in m["steps"]:
+                print(f"   {s['step']}: 约 {s['rows']} 行, 预计 {s['seconds']} 秒, 最长持锁 {s['lock_seconds']} 秒")
+    else:
+        database.init_db()
+        done = migrate(progress=print)
+        print(f"✅ 已应用: {done}" if done else "没有待执行的迁移")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import kdf
+
+# --- 哈希配置 ---
+HASH_SCHEME = 'scrypt'        # 'scrypt' 或 'pbkdf2_sha256'
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+PBKDF2_ITERATIONS = 260000
+SALT_BYTES = 16
+
+# KDF 运算使用独立进程池，避免占用 GIL 拖慢请求线程
+KDF_WORKERS = max(1, min(4, (os.cpu_count() or 2) // 2))
+# 同时进行（执行中 + 排队）的 KDF 运算上限：等待 KDF 的请求线程不超过这个数，超出时抛出 Busy，
+# 由服务端回复"服务器繁忙"，登录洪峰不会占满请求执行器
+KDF_MAX_PENDING = KDF_WORKERS * 2
+
+# 已验证凭据缓存：短时间内重复登录无需再次执行 KDF
+CREDENTIAL_CACHE_SIZE = 1024
+CREDENTIAL_CACHE_TTL = 600
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_slots = None
+
+
+class Busy(Exception):
+    """进行中的 KDF 运算已达 KDF_MAX_PENDING"""
+
+
+def _get_pool():
+    global _pool, _pool_pid
+    # fork 出的子进程（多进程服务模式）不能沿用父进程的进程池，需要重建
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                # 不用 fork 直接复制服务进程：否则子进程会继承监听套接字和客户端连接
+                method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else None
+                context = multiprocessing.get_context(method)
+                if method == 'forkserver':
+                    # forkserver 默认预加载 __main__（server.py / supervisor.py），改为只预加载无副作用的 kdf；
+                    # 池中子进程仍会按 multiprocessing 的约定以 __mp_main__ 导入主模块，
+                    # 所以主模块在导入时不得启动线程或打开连接（请求执行器等在 server.start_server 中创建）
+                    context.set_forkserver_preload(['kdf'])
+                _pool = ProcessPoolExecutor(max_workers=KDF_WORKERS, mp_context=context)
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def _run_kdf(scheme, password, salt, params):
+    global _pool, _slots
+    if _slots is None or _slots[0] != KDF_MAX_PENDING:
+        with _pool_lock:
+            if _slots is None or _slots[0] != KDF_MAX_PENDING:
+                _slots = (KDF_MAX_PENDING, threading.BoundedSemaphore(KDF_MAX_PENDING))
+    slots = _slots[1]
+    if not slots.acquire(blocking=False):
+        raise Busy("密码校验繁忙，请稍后重试")
+    try:
+        try:
+            return _get_pool().submit(kdf.derive, scheme, password, salt, params).result()
+        except BrokenProcessPool:
+            # 工作进程异常退出：丢弃进程池，下次调用时重建
+            _pool = None
+        except (OSError, RuntimeError):
+            pass
+        # 进程池不可用（如受限环境）时退化为当前线程计算
+        return kdf.derive(scheme, password, salt, params)
+    finally:
+        slots.release()
+
+
+def _current_params():
+    if HASH_SCHEME == 'scrypt':
+        return (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return (PBKDF2_ITERATIONS,)
+
+
+def hash_password(password):
+    """生成带随机盐的密码哈希，格式: scheme$参数$盐$摘要"""
+    salt = secrets.token_bytes(SALT_BYTES)
+    params = _current_params()
+    digest = _run_kdf(HASH_SCHEME, password, salt, params)
+    return '$'.join([HASH_SCHEME, ','.join(str(v) for v in params), salt.hex(), digest])
+
+
+def verify_password(password, stored):
+    """校验密码，返回 (是否匹配, 是否需要升级为当前哈希配置)"""
+    if '$' not in stored:
+        # 旧版无盐 SHA-256
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, stored), True
+
+    try:
+        scheme, params, salt, digest = stored.split('$')
+        params = tuple(int(v) for v in params.split(','))
+        salt = bytes.fromhex(salt)
+    except ValueError:
+        return False, False
+    if scheme not in ('scrypt', 'pbkdf2_sha256'):
+        return False, False
+
+    ok = hmac.compare_digest(_run_kdf(scheme, password, salt, params), digest)
+    return ok, scheme != HASH_SCHEME or params != _current_params()
+
+
+class CredentialCache:
+    """已验证凭据的 LRU 缓存
+
+    只保存以进程随机密钥计算的 HMAC，不保存明文；存储哈希变化（如改密、升级）后自动失效。
+    """
+
+    def __init__(self, size=CREDENTIAL_CACHE_SIZE, ttl=CREDENTIAL_CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._key = secrets.token_bytes(32)
+        self._entries = OrderedDict()  # username -> (stored_hash, mac, expires_at)
+        self._lock = threading.Lock()
+
+    def _mac(self, username, password):
+        return hmac.new(self._key, f"{username}\0{password}".encode(), hashlib.sha256).digest()
+
+    def check(self, username, password, stored):
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return False
+            cached_hash, mac, expires_at = entry
+            if cached_hash != stored or expires_at < time.monotonic():
+                del self._entries[username]
+                return False
+            self._entries.move_to_end(username)
+        return hmac.compare_digest(mac, self._mac(username, password))
+
+    def remember(self, username, password, stored):
+        entry = (stored, self._mac(username, password), time.monotonic() + self.ttl)
+        with self._lock:
+            self._entries[username] = entry
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def forget(self, username):
+        with self._lock:
+            self._entries.pop(username, None)
+
+
+credential_cache = CredentialCache()
@@ -0,0 +1,508 @@
+import json
+import socket
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from collections import deque
+from itertools import accumulate
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+RECV_SIZE = 65536
+
+# --- 分帧协议（hello 协商后启用） ---
+# 帧头: 1 字节标志位 + 4 字节正文长度（网络字节序）
+FRAME_HEADER = struct.Struct('!BI')
+FLAG_COLUMNAR = 0x01        # 正文为 JSON 信封 + 列式编码的 data
+FLAG_COMPRESSED = 0x02      # 正文经过协商的压缩算法压缩
+MAX_FRAME_SIZE = 256 * 1024 * 1024
+SMALL_FRAME = 64 * 1024     # 小于此值时帧头与正文合并为一次发送
+
+# 支持的编码，按优先级排列；json 始终可用以保证兼容
+CODECS = ('columnar', 'json')
+
+# 超过该大小的帧才压缩（字节），压缩后不更小则按原样发送
+COMPRESS_THRESHOLD = 1024
+
+# TCP keepalive：连接空闲多久后开始探测、探测间隔与失败次数（秒/次），用于发现已失联的对端
+KEEPALIVE_IDLE = 60
+KEEPALIVE_INTERVAL = 10
+KEEPALIVE_COUNT = 5
+COMPRESS_LEVELS = {'zstd': 3, 'zlib': 6}
+
+
+class JsonSerializer:
+    """标准库 JSON 序列化：复用编码器实例，输出紧凑的 UTF-8"""
+    name = 'json'
+
+    def __init__(self):
+        self._encoder = json.JSONEncoder(ensure_ascii=False, separators=(',', ':'), default=_default)
+
+    def dumps(self, obj):
+        return self._encoder.encode(obj).encode('utf-8')
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+class OrjsonSerializer:
+    """orjson 序列化：直接产出 bytes，省去中间 str 与再编码的拷贝"""
+    name = 'orjson'
+
+    def dumps(self, obj):
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+
+def _default(obj):
+    # namedtuple 等 tuple 子类按数组输出
+    if isinstance(obj, tuple):
+        return list(obj)
+    raise TypeError(f"无法序列化的类型: {type(obj).__name__}")
+
+
+def get_serializer(name=None):
+    """按名称获取序列化器，默认优先使用已安装的 orjson"""
+    if name == 'json' or (name is None and orjson is None):
+        return JsonSerializer()
+    if orjson is None:
+        raise ValueError("orjson 未安装")
+    return OrjsonSerializer()
+
+
+def enable_keepalive(sock, idle=KEEPALIVE_IDLE, interval=KEEPALIVE_INTERVAL, count=KEEPALIVE_COUNT):
+    """开启 TCP keepalive；探测参数仅在支持的平台上设置"""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for name, value in (('TCP_KEEPIDLE', idle), ('TCP_KEEPINTVL', interval), ('TCP_KEEPCNT', count)):
+        if hasattr(socket, name):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+
+def send_message(sock, data):
+    """发送完整消息；sendall 内部以 memoryview 切片续发，不会出现只发送一部分的问题"""
+    sock.sendall(data)
+
+
+def recv_json(sock, serializer):
+    """接收一条完整的 JSON 消息（旧版无分帧协议），返回 (消息, 字节数)；大响应会分多次到达"""
+    chunks = []
+    while True:
+        chunk = sock.recv(RECV_SIZE)
+        if not chunk:
+            if chunks:
+                raise ConnectionError("连接在消息中途断开")
+            return None
+        chunks.append(chunk)
+        # 只有以 '}' 结尾时才尝试解析，避免对大消息反复解析
+        if chunk.rstrip().endswith(b'}'):
+            data = b''.join(chunks) if len(chunks) > 1 else chunk
+            try:
+                return serializer.loads(data), len(data)
+            except ValueError:
+                continue
+
+
+def negotiate(requested):
+    """从客户端声明的编码中选出双方都支持、优先级最高的一个"""
+    requested = requested or ()
+    for codec in CODECS:
+        if codec in requested:
+            return codec
+    return 'json'
+
+
+def compressions():
+    """本端支持的压缩算法，按优先级排列"""
+    return ('zstd', 'zlib') if zstandard is not None else ('zlib',)
+
+
+def negotiate_compression(requested):
+    requested = requested or ()
+    for name in compressions():
+        if name in requested:
+            return name
+    return None
+
+
+class ZlibCompressor:
+    name = 'zlib'
+
+    def __init__(self, level=None):
+        self.level = COMPRESS_LEVELS['zlib'] if level is None else level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        d = zlib.decompressobj()
+        out = d.decompress(data, MAX_FRAME_SIZE)
+        if d.unconsumed_tail:
+            raise ValueError("解压后帧过大")
+        return out
+
+
+class ZstdCompressor:
+    name = 'zstd'
+
+    def __init__(self, level=None):
+        level = COMPRESS_LEVELS['zstd'] if level is None else level
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def decompress(self, data):
+        return self._decompressor.decompress(data, max_output_size=MAX_FRAME_SIZE)
+
+
+def get_compressor(name):
+    if name == 'zstd' and zstandard is not None:
+        return ZstdCompressor()
+    if name == 'zlib':
+        return ZlibCompressor()
+    return None
+
+
+def send_frame(sock, flags, body):
+    header = FRAME_HEADER.pack(flags, len(body))
+    if len(body) < SMALL_FRAME:
+        sock.sendall(header + body)
+    else:
+        # 大帧分两次发送，避免为拼接帧头再拷贝一遍正文
+        sock.sendall(header)
+        sock.sendall(body)
+
+
+def recv_exact(sock, size):
+    """读取恰好 size 字节，直接写入预分配缓冲区；连接关闭返回 None"""
+    buf = bytearray(size)
+    view = memoryview(buf)
+    got = 0
+    while got < size:
+        n = sock.recv_into(view[got:])
+        if n == 0:
+            if got:
+                raise ConnectionError("连接在消息中途断开")
+            return None
+        got += n
+    return buf
+
+
+def recv_frame(sock):
+    """读取一帧，返回 (flags, body)；连接关闭返回 None"""
+    header = recv_exact(sock, FRAME_HEADER.size)
+    if header is None:
+        return None
+    flags, size = FRAME_HEADER.unpack(header)
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"帧过大: {size} 字节")
+    body = recv_exact(sock, size) if size else bytearray()
+    if body is None:
+        raise ConnectionError("连接在消息中途断开")
+    return flags, body
+
+
+# --- 列式编码 ---
+# 列表响应按列存储：列名只出现一次，数值列用定长数组，字符串列整体编码
+COL_NULL, COL_INT, COL_FLOAT, COL_SCALED, COL_STR, COL_DICT, COL_JSON = range(7)
+
+_INT_TYPECODES = (('b', 1 << 7), ('h', 1 << 15), ('i', 1 << 31), ('q', 1 << 63))
+_LITTLE = sys.byteorder == 'little'
+_COLUMNS_HEADER = struct.Struct('!IH')
+_PART = struct.Struct('!I')
+
+
+def _pack_array(code, values):
+    arr = array(code, values)
+    if not _LITTLE:
+        arr.byteswap()
+    return arr.tobytes()
+
+
+def _unpack_array(code, data):
+    arr = array(code)
+    arr.frombytes(data)
+    if not _LITTLE:
+        arr.byteswap()
+    return arr.tolist()
+
+
+def _int_typecode(values):
+    """选择能容纳全部取值的最窄整数类型，超出 int64 返回 None"""
+    lo, hi = min(values), max(values)
+    for code, bound in _INT_TYPECODES:
+        if -bound <= lo and hi < bound:
+            return code
+    return None
+
+
+def _scale_floats(values):
+    """小数位不超过 3 位的浮点列（体重、体温等）转为放大后的整数存储"""
+    for digits in range(4):
+        factor = 10 ** digits
+        try:
+            scaled = [round(v * factor) for v in values]
+        except (ValueError, OverflowError):  # NaN / inf
+            return None
+        if all(s / factor == v for s, v in zip(scaled, values)):
+            code = _int_typecode(scaled)
+            if code:
+                return digits, code, scaled
+    return None
+
+
+def _str_parts(values):
+    lengths = [len(v) for v in values]
+    code = _int_typecode(lengths) if lengths else 'b'
+    return [code.encode(), _pack_array(code, lengths), ''.join(values).encode('utf-8')]
+
+
+def _encode_column(values):
+    """返回 (列类型, 空值掩码, 数据段列表)"""
+    present = [v for v in values if v is not None]
+    if not present:
+        return COL_NULL, b'', []
+    nulls = bytes(v is None for v in values) if len(present) < len(values) else b''
+    kinds = {type(v) for v in present}
+
+    if kinds == {int}:
+        code = _int_typecode(present)
+        if code:
+            filled = [0 if v is None else v for v in values] if nulls else values
+            return COL_INT, nulls, [code.encode(), _pack_array(code, filled)]
+
+    if float in kinds and kinds <= {int, float}:
+        filled = [0 if v is None else v for v in values] if nulls else values
+        scaled = _scale_floats(filled)
+        if scaled:
+            digits, code, ints = scaled
+            return COL_SCALED, nulls, [bytes([digits]), code.encode(), _pack_array(code, ints)]
+        return COL_FLOAT, nulls, [_pack_array('d', filled)]
+
+    if kinds == {str}:
+        filled = ['' if v is None else v for v in values] if nulls else values
+        uniq = list(dict.fromkeys(filled))
+        if len(uniq) * 2 <= len(filled):
+            # 低基数列（餐次、角色、日期重复的饮食记录等）用字典编码
+            index = {v: i for i, v in enumerate(uniq)}
+            ids = [index[v] for v in filled]
+            code = _int_typecode(ids)
+            return COL_DICT, nulls, [code.encode(), _pack_array(code, ids)] + _str_parts(uniq)
+        return COL_STR, nulls, _str_parts(filled)
+
+    return COL_JSON, b'', [json.dumps(values, ensure_ascii=False).encode('utf-8')]
+
+
+def _decode_strs(parts):
+    code, lengths, blob = parts
+    lengths = _unpack_array(chr(code[0]), lengths)
+    text = bytes(blob).decode('utf-8')
+    ends = list(accumulate(lengths))
+    return [text[end - n:end] for n, end in zip(lengths, ends)]
+
+
+def _decode_column(kind, count, parts):
+    if kind == COL_NULL:
+        return [None] * count
+    if kind == COL_INT:
+        return _unpack_array(chr(parts[0][0]), parts[1])
+    if kind == COL_SCALED:
+        factor = 10 ** parts[0][0]
+        ints = _unpack_array(chr(parts[1][0]), parts[2])
+        return [v / factor for v in ints]
+    if kind == COL_FLOAT:
+        return _unpack_array('d', parts[0])
+    if kind == COL_STR:
+        return _decode_strs(parts)
+    if kind == COL_DICT:
+        ids = _unpack_array(chr(parts[0][0]), parts[1])
+        uniq = _decode_strs(parts[2:])
+        return [uniq[i] for i in ids]
+    return json.loads(bytes(parts[0]))
+
+
+def is_columnar(rows):
+    """仅对字段一致的字典列表使用列式编码"""
+    if not isinstance(rows, list) or not rows or not isinstance(rows[0], dict):
+        return False
+    keys = rows[0].keys()
+    return all(isinstance(r, dict) and r.keys() == keys for r in rows)
+
+
+def encode_columns(rows):
+    """列表 -> 列式二进制：行数/列数，随后每列为 列名 + 类型 + 空值掩码 + 数据段"""
+    columns = list(rows[0])
+    out = [_COLUMNS_HEADER.pack(len(rows), len(columns))]
+    for col in columns:
+        kind, nulls, parts = _encode_column([r[col] for r in rows])
+        name = col.encode('utf-8')
+        out.append(bytes([len(name)]) + name + bytes([kind, len(parts)]))
+        out.append(_PART.pack(len(nulls)) + nulls)
+        for part in parts:
+            out.append(_PART.pack(len(part)))
+            out.append(part)
+    return b''.join(out)
+
+
+def decode_columns(data):
+    view = memoryview(data)
+    count, ncols = _COLUMNS_HEADER.unpack_from(view)
+    pos = _COLUMNS_HEADER.size
+    names, columns = [], []
+    for _ in range(ncols):
+        size = view[pos]
+        names.append(bytes(view[pos + 1:pos + 1 + size]).decode('utf-8'))
+        pos += 1 + size
+        kind, nparts = view[pos], view[pos + 1]
+        pos += 2
+        parts = []
+        for _ in range(nparts + 1):
+            (size,) = _PART.unpack_from(view, pos)
+            pos += _PART.size
+            parts.append(view[pos:pos + size])
+            pos += size
+        nulls, parts = parts[0], parts[1:]
+        values = _decode_column(kind, count, parts)
+        if len(nulls):
+            values = [None if m else v for v, m in zip(values, nulls)]
+        columns.append(values)
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+class Connection:
+    """单条连接的收发：hello 协商前使用旧版 JSON 协议，协商后切换为分帧协议"""
+
+    def __init__(self, sock, serializer):
+        self.sock = sock
+        self.serializer = serializer
+        self.framed = False
+        self.codec = 'json'
+        self.compressor = None
+        self._send_lock = threading.Lock()  # 流水线模式下多个工作线程共用一条连接发送
+        self._next_id = 0
+        self.events = deque(maxlen=256)  # 服务端主动推送的事件（如新通知）
+        self.last_recv_size = 0  # 最近一条接收消息的线路字节数
+        # 压缩统计（收发双向）：原始字节、压缩后字节、压缩/解压耗时
+        self.stats = {"raw_bytes": 0, "compressed_bytes": 0, "compress_seconds": 0.0,
+                      "decompress_seconds": 0.0, "frames_compressed": 0}
+
+    def upgrade(self, codec, compression=None):
+        self.framed = True
+        self.codec = codec
+        self.compressor = get_compressor(compression)
+
+    def compression_ratio(self):
+        if not self.stats["compressed_bytes"]:
+            return 1.0
+        return round(self.stats["raw_bytes"] / self.stats["compressed_bytes"], 2)
+
+    def compression_summary(self):
+        s = self.stats
+        return (f"压缩 {s['frames_compressed']} 帧, 压缩比 {self.compression_ratio()}, "
+                f"压缩耗时 {s['compress_seconds'] * 1000:.1f} ms, 解压耗时 {s['decompress_seconds'] * 1000:.1f} ms")
+
+    def encode(self, message):
+        """编码为 (flags, body)；列式模式下 data 为列表时单独按列编码，大帧再压缩"""
+        data = message.get('data') if isinstance(message, dict) else None
+        if self.codec == 'columnar' and is_columnar(data):
+            envelope = self.serializer.dumps({k: v for k, v in message.items() if k != 'data'})
+            flags, body = FLAG_COLUMNAR, _PART.pack(len(envelope)) + envelope + encode_columns(data)
+        else:
+            flags, body = 0, self.serializer.dumps(message)
+
+        if self.compressor and len(body) > COMPRESS_THRESHOLD:
+            start = time.perf_counter()
+            packed = self.compressor.compress(body)
+            self.stats["compress_seconds"] += time.perf_counter() - start
+            if len(packed) < len(body):
+                self.stats["raw_bytes"] += len(body)
+                self.stats["compressed_bytes"] += len(packed)
+                self.stats["frames_compressed"] += 1
+                return flags | FLAG_COMPRESSED, packed
+        return flags, body
+
+    def decode(self, flags, body):
+        if flags & FLAG_COMPRESSED:
+            if self.compressor is None:
+                raise ValueError("收到压缩帧但未协商压缩算法")
+            start = time.perf_counter()
+            packed_size, body = len(body), self.compressor.decompress(body)
+            self.stats["decompress_seconds"] += time.perf_counter() - start
+            self.stats["raw_bytes"] += len(body)
+            self.stats["compressed_bytes"] += packed_size
+            self.stats["frames_compressed"] += 1
+        if not flags & FLAG_COLUMNAR:
+            return self.serializer.loads(body)
+        (size,) = _PART.unpack_from(body)
+        view = memoryview(body)
+        message = self.serializer.loads(bytes(view[_PART.size:_PART.size + size]))
+        message['data'] = decode_columns(view[_PART.size + size:])
+        return message
+
+    def send(self, message):
+        """发送一条消息，返回 (线路字节数, 编码耗时)"""
+        with self._send_lock:
+            start = time.perf_counter()
+            if not self.framed:
+                data = self.serializer.dumps(message)
+                elapsed = time.perf_counter() - start
+                send_message(self.sock, data)
+                return len(data), elapsed
+            flags, body = self.encode(message)
+            elapsed = time.perf_counter() - start
+            send_frame(self.sock, flags, body)
+            return FRAME_HEADER.size + len(body), elapsed
+
+    def recv(self):
+        """接收下一条响应；分帧模式下穿插到达的推送事件存入 events"""
+        if not self.framed:
+            received = recv_json(self.sock, self.serializer)
+            if received is None:
+                return None
+            message, self.last_recv_size = received
+            return message
+        while True:
+            frame = recv_frame(self.sock)
+            if frame is None:
+                return None
+            self.last_recv_size = FRAME_HEADER.size + len(frame[1])
+            message = self.decode(*frame)
+            if isinstance(message, dict) and 'event' in message and 'status' not in message:
+                self.events.append(message)
+                continue
+            return message
+
+    def pipeline(self, requests):
+        """流水线发送多个请求（需已协商分帧协议），按请求顺序返回响应
+
+        服务端会并发执行并乱序返回，这里按 id 重新排序；相互依赖的请求不要放在同一批。
+        """
+        ids = []
+        for request in requests:
+            self._next_id += 1
+            ids.append(self._next_id)
+            self.send(dict(request, id=self._next_id))
+        pending = set(ids)
+        responses = {}
+        while pending:
+            response = self.recv()
+            if response is None:
+                raise ConnectionError("服务器已断开连接")
+            request_id = response.pop('id', None)
+            if request_id in pending:
+                pending.discard(request_id)
+                responses[request_id] = response
+        return [responses[i] for i in ids]
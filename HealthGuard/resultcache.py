@@ -0,0 +1,112 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+# 可缓存的查询种类，对应 database 中的 get_user_profile / get_user_goals / get_user_reminders / get_user_medications
+KINDS = ('profile', 'goals', 'reminders', 'medications')
+
+
+def _user(user_id):
+    """请求中的 user_id 可能是字符串或整数，统一为整数，保证同一用户只有一组键"""
+    try:
+        return int(user_id)
+    except (TypeError, ValueError):
+        return user_id
+
+
+class ResultCache:
+    """按用户缓存高频读取结果的 LRU，总条数不超过 max_entries
+
+    键为 (user_id, 种类, 查询参数)；写入在提交后按 (user_id, 种类) 精确失效。每次失效给 (user_id, 种类) 分配新的版本号，
+    未命中时先记下版本再查询，查询期间若被失效则结果不入缓存，避免把提交前读到的旧值放回去。
+    版本表超过 max_entries 时整体清空并换一个新的默认版本，进行中的查询因此全部作废（不入缓存），版本表不会无限增长。
+    服务进程之外的写入（导入工具、恢复备份、其他主机）不会触发失效，条目最多保留 ttl 秒。
+    缓存的结果对象在调用方之间共享，只读使用。多进程模式下失效经 publish 广播给其他工作进程。
+    """
+
+    def __init__(self, max_entries, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.publish = None   # publish(event)：把失效事件发给其他进程，单进程模式为 None
+        self.source = None    # 缓存内容所属的数据库，切换数据库时整体清空
+        self._entries = OrderedDict()  # 键 -> (结果, 过期时刻)
+        self._index = {}      # (user_id, 种类) -> 该组合下的所有键
+        self._versions = {}
+        self._counter = itertools.count(1)
+        self._default = 0     # 版本表中没有的组合所用的版本
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    def _version(self, group):
+        return self._versions.get(group, self._default)
+
+    def _remove(self, key):
+        del self._entries[key]
+        group = self._index[key[:2]]
+        group.discard(key)
+        if not group:
+            del self._index[key[:2]]
+
+    def get(self, user_id, kind, args, load):
+        """命中时直接返回，否则调用 load() 查询并放入缓存"""
+        if self.max_entries <= 0:
+            return load()
+        user_id = _user(user_id)
+        key = (user_id, kind, args)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > now):
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return entry[0]
+            if entry is not None:
+                self._remove(key)
+                self.stats["expirations"] += 1
+            self.stats["misses"] += 1
+            version = self._version((user_id, kind))
+        value = load()
+        with self._lock:
+            if version == self._version((user_id, kind)):
+                self._entries[key] = (value, None if self.ttl is None else now + self.ttl)
+                self._index.setdefault((user_id, kind), set()).add(key)
+                while len(self._entries) > self.max_entries:
+                    self._remove(next(iter(self._entries)))
+                    self.stats["evictions"] += 1
+        return value
+
+    def invalidate(self, changes, publish=True):
+        """使 [(user_id, 种类)] 的缓存失效，种类为 None 表示该用户的全部结果"""
+        changes = [(_user(user_id), kind) for user_id, kind in changes]
+        with self._lock:
+            for user_id, kind in changes:
+                for k in (KINDS if kind is None else (kind,)):
+                    self._versions[(user_id, k)] = next(self._counter)
+                    for key in self._index.pop((user_id, k), ()):
+                        del self._entries[key]
+            if len(self._versions) > max(self.max_entries, 1):
+                self._reset_versions()
+            self.stats["invalidations"] += len(changes)
+        if publish and self.publish is not None:
+            self.publish({"type": "cache_invalidate", "changes": changes})
+
+    def _reset_versions(self):
+        self._versions.clear()
+        self._default = next(self._counter)
+
+    def apply(self, event):
+        """处理其他进程广播的失效事件"""
+        self.invalidate(event["changes"], publish=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._index.clear()
+            self._reset_versions()
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(self.stats, entries=len(self._entries),
+                        hit_ratio=round(self.stats["hits"] / lookups, 3) if lookups else None)
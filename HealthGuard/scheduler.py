@@ -0,0 +1,154 @@
+import heapq
+import threading
+from datetime import datetime, timedelta
+import database
+
+# 预取窗口（秒）：只把未来这段时间内到期的提醒装入堆，内存占用与提醒总数无关
+WINDOW = 600
+# 每批触发的最大条数（同一事务）
+FIRE_BATCH = 500
+
+
+class ReminderScheduler:
+    """提醒调度线程
+
+    按 (is_active, next_fire_at) 索引分段取出即将到期的提醒放入小顶堆，到点后写入通知并推送；
+    重复提醒推进到下一次后若仍在窗口内则重新入堆。每次触发为 O(log n) 的堆操作加主键更新，
+    窗口推进只做索引范围查询，不扫描整表。分片模式下各分片的提醒进入同一个堆，按分片分批触发。
+    """
+
+    def __init__(self, deliver, window=WINDOW):
+        self.deliver = deliver    # deliver(user_id, message)：把通知推送给在线用户
+        self.window = timedelta(seconds=window)
+        self._heap = []           # (next_fire_at, shard, reminder_id)
+        self._loaded_until = None # 已装入堆的时间上界
+        self._wake = threading.Event()
+        self._rescan = False
+        self._stopped = False
+        self.stats = {"fired": 0, "batches": 0}
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True, name='reminder-scheduler').start()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+
+    def wake(self):
+        """有提醒新增或修改时调用：若其触发时间落在已装载的窗口内，下一轮会补进堆中"""
+        self._rescan = True
+        self._wake.set()
+
+    def pending(self):
+        return len(self._heap)
+
+    def _run(self):
+        conns = [database.shard_connection(shard) for shard in range(database.SHARDS)]
+        try:
+            while not self._stopped:
+                self._wake.clear()
+                now = datetime.now()
+                self._load(conns, now)
+                self._fire_due(conns, now)
+                self._wake.wait(self._sleep_seconds())
+        finally:
+            for conn in conns:
+                conn.close()
+
+    def _load(self, conns, now):
+        """推进窗口；首次装载包含停机期间已过期的提醒"""
+        horizon = (now + self.window).strftime(database.FIRE_TIME_FORMAT)
+        if self._loaded_until is None or self._rescan:
+            # 重新读取整个已装载窗口（窗口内条目有限），已在堆中的条目去重
+            self._rescan = False
+            queued = set(self._heap)
+            until = max(horizon, self._loaded_until or horizon)
+            for shard, conn in enumerate(conns):
+                for at, rid in database.due_reminders(conn, until):
+                    if (at, shard, rid) not in queued:
+                        heapq.heappush(self._heap, (at, shard, rid))
+            self._loaded_until = until
+        elif horizon > self._loaded_until:
+            for shard, conn in enumerate(conns):
+                for at, rid in database.due_reminders(conn, horizon, self._loaded_until):
+                    heapq.heappush(self._heap, (at, shard, rid))
+            self._loaded_until = horizon
+
+    def _fire_due(self, conns, now):
+        stamp = now.strftime(database.FIRE_TIME_FORMAT)
+        while self._heap and self._heap[0][0] <= stamp:
+            due = {}
+            count = 0
+            while self._heap and self._heap[0][0] <= stamp and count < FIRE_BATCH:
+                at, shard, rid = heapq.heappop(self._heap)
+                due.setdefault(shard, []).append((at, rid))
+                count += 1
+            fired, failed = [], False
+            for shard, items in due.items():
+                conn = conns[shard]
+                try:
+                    done, rescheduled = database.fire_reminders(conn, items, now)
+                except Exception as e:
+                    conn.rollback()
+                    print(f"[SCHEDULER] 触发提醒失败: {e}")
+                    self._rescan = failed = True  # 本批已出堆，下一轮从数据库重新装载
+                    continue
+                fired += done
+                for at, rid in rescheduled:
+                    if at <= self._loaded_until:
+                        heapq.heappush(self._heap, (at, shard, rid))
+            self.stats["fired"] += len(fired)
+            self.stats["batches"] += 1
+            for user_id, message in fired:
+                try:
+                    self.deliver(user_id, message)
+                except Exception as e:
+                    print(f"[SCHEDULER] 推送提醒失败: {e}")
+            if failed:
+                return
+
+    def _sleep_seconds(self):
+        """睡到堆顶到期或窗口需要推进（窗口过半）为止"""
+        now = datetime.now()
+        refresh = datetime.strptime(self._loaded_until, database.FIRE_TIME_FORMAT) - self.window / 2
+        wake_at = refresh
+        if self._heap:
+            wake_at = min(wake_at, datetime.strptime(self._heap[0][0], database.FIRE_TIME_FORMAT))
+        return max(0.05, (wake_at - now).total_seconds())
+
+
+class DailyJob:
+    """每天在固定时刻（本地时间 "HH:MM"）执行一次的后台任务，例如目标进度的夜间对账"""
+
+    def __init__(self, at, job, name):
+        self.at = datetime.strptime(at, '%H:%M').time()
+        self.job = job
+        self.name = name
+        self._wake = threading.Event()
+        self._stopped = False
+        self.last_run = None
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True, name=self.name).start()
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+
+    def next_run(self, now):
+        run = datetime.combine(now.date(), self.at)
+        return run if run > now else run + timedelta(days=1)
+
+    def _run(self):
+        while not self._stopped:
+            now = datetime.now()
+            # 分段睡眠，系统时间调整后最多晚一小时执行
+            self._wake.wait(min(3600, (self.next_run(now) - now).total_seconds()))
+            if self._stopped or datetime.now() < self.next_run(now):
+                continue
+            try:
+                result = self.job()
+                self.last_run = datetime.now()
+                print(f"[{self.name.upper()}] 完成: {result}")
+            except Exception as e:
+                print(f"[{self.name.upper()}] 执行失败: {e}")
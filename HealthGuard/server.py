@@ -1,167 +1,685 @@
+import select
 import socket
 import threading
-import json
+import time
+from concurrent.futures import TimeoutError as FutureTimeout
+import backup
+import connections
 import database
+import importer
+import metrics
+import migrations
+import passwords
+import session
+import protocol
+import scheduler
+import workpool
+import writequeue
 
 # 配置
 HOST = '0.0.0.0'
 PORT = 9999
+# 序列化器：None 表示自动选择（已安装 orjson 时优先使用）
+SERIALIZER = None
+# 请求执行线程数、排队上限（超出后按优先级拒绝，返回"服务器繁忙"），以及单连接最多同时执行的请求数
+REQUEST_WORKERS = 16
+MAX_QUEUE = 256
+MAX_INFLIGHT = 32
+LISTEN_BACKLOG = 128
+# 最大并发连接数，超出时直接回复繁忙并关闭
+MAX_CONNECTIONS = 1024
+# 连接空闲超时（秒）：超过该时间既未收到任何请求（含 ping）也没有请求在执行或刚回复即断开，None 表示不限
+IDLE_TIMEOUT = 600
+# 本地 HTTP 指标接口（Prometheus 文本格式，GET /metrics），None 表示不开启；多进程模式下第 i 个工作进程使用端口 +i
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = None
+# 是否在本进程运行提醒调度线程（多进程模式下由主进程统一运行）
+REMINDER_SCHEDULER = True
+# 目标进度夜间对账的时刻（本地时间 "HH:MM"），None 表示不运行；多进程模式下只在主进程运行
+GOAL_RECONCILE_AT = '03:30'
+# 每天归档旧健康记录的时刻（本地时间 "HH:MM"，早于 database.ARCHIVE_AFTER_DAYS 天的记录移入按年份的归档库），None 表示不运行
+ARCHIVE_AT = '04:00'
+# 每天生成在线备份快照的时刻（本地时间 "HH:MM"，快照位置与保留个数见 backup），None 表示不运行
+BACKUP_AT = '02:30'
+# 启动时应用待执行的结构迁移：普通迁移在开始监听前完成，标记为 background 的迁移在开始服务后于后台执行
+MIGRATE_ON_START = True
+# 写后台队列：开启后 add_record / add_diet 只做入队，由写线程（每个分片一个）分组提交（分组大小见 writequeue）
+WRITE_BEHIND = False
+# 写入确认时机：'commit' 提交落盘后回复；'enqueue' 入队即回复，进程崩溃时可能丢失尚未提交的一组写入
+WRITE_ACK = writequeue.ACK_COMMIT
+# 按提交确认时等待写线程的最长秒数，超时回复 timeout（写入仍在队列中，结果未确认）
+WRITE_TIMEOUT = 30
 
-def handle_client(client_socket, addr):
+# 无需会话即可调用的接口
+PUBLIC_ACTIONS = {"hello", "ping", "login", "register", "resume_session"}
+# 仅管理员可调用的接口
+ADMIN_ACTIONS = {"get_sys_stats", "get_all_users", "delete_user", "send_notification", "import_records",
+                 "import_status", "get_server_load", "list_connections", "evict_connection", "get_server_metrics"}
+
+sessions = session.SessionManager()
+# 请求执行器（由 start_pool 在服务进程内创建，执行线程属于实际处理请求的进程）
+pool = None
+# 多进程模式下的 IPC 通道（由 supervisor 在工作进程中设置），单进程模式为 None
+ipc_channel = None
+# 提醒调度器（单进程模式下由 start_server 创建）
+reminders = None
+# 写后台队列（WRITE_BEHIND 开启时由 start_writer 创建）
+writes = None
+
+# --- 在线推送：已登录的分帧连接按用户登记，用于实时推送通知 ---
+subscribers = {}  # user_id -> set(Connection)
+subscribers_lock = threading.Lock()
+# 在线连接登记表（本进程内）
+registry = connections.ConnectionRegistry()
+# 按接口统计的运行指标
+request_metrics = metrics.Metrics()
+
+def subscribe(user_id, conn):
+    with subscribers_lock:
+        subscribers.setdefault(user_id, set()).add(conn)
+
+def unsubscribe(conn):
+    with subscribers_lock:
+        for user_id in [u for u, conns in subscribers.items() if conn in conns]:
+            subscribers[user_id].discard(conn)
+            if not subscribers[user_id]:
+                del subscribers[user_id]
+
+def push_notification(user_id, message, broadcast=True):
+    """向用户的在线连接推送通知；多进程模式下经 IPC 转发给持有该用户连接的其他工作进程"""
+    with subscribers_lock:
+        conns = list(subscribers.get(user_id, ()))
+    event = {"event": "notification", "data": {"user_id": user_id, "message": message}}
+    for conn in conns:
+        try:
+            conn.send(event)
+        except OSError:
+            pass
+    if broadcast and ipc_channel:
+        ipc_channel.publish({"type": "notify", "user_id": user_id, "message": message})
+
+def reminders_changed():
+    """提醒新增后通知调度器；多进程模式下调度器在主进程，经 IPC 转达"""
+    if reminders is not None:
+        reminders.wake()
+    elif ipc_channel:
+        ipc_channel.publish({"type": "reminders_changed"})
+
+def attach_ipc(channel):
+    """工作进程接入 IPC：会话变化、通知与结果缓存失效在各工作进程间同步"""
+    global ipc_channel
+    ipc_channel = channel
+    sessions.publish = channel.publish
+    for kind in ("session_add", "session_renew", "session_revoke", "session_revoke_user", "session_snapshot"):
+        channel.on(kind, sessions.apply)
+    channel.on("notify", lambda e: push_notification(e["user_id"], e["message"], broadcast=False))
+    # 本进程写入提交后的结果缓存失效经主进程转发给其他工作进程
+    database.results.publish = channel.publish
+    channel.on("cache_invalidate", database.results.apply)
+
+def authorize(action, request, payload):
+    """校验请求令牌，失败返回错误响应；普通用户的 user_id 一律以会话为准"""
+    if action in PUBLIC_ACTIONS:
+        return None
+    current = sessions.validate(request.get('token'))
+    if current is None:
+        return {"status": "error", "code": "auth_required", "message": "会话无效或已过期，请重新登录"}
+    if action in ADMIN_ACTIONS and current['role'] != 'admin':
+        return {"status": "error", "code": "forbidden", "message": "权限不足"}
+    if current['role'] != 'admin':
+        payload['user_id'] = current['id']
+    return None
+
+def load_stats():
+    data = pool.snapshot() if pool is not None else {}
+    data["active_connections"] = registry.count()
+    data["sessions"] = sessions.count()
+    if reminders is not None:
+        data["reminders_pending"] = reminders.pending()
+    if writes is not None:
+        data["write_queue"] = dict(writes.stats, depth=writes.depth())
+    data["result_cache"] = database.results.snapshot()
+    return data
+
+def render_metrics():
+    """HTTP 指标接口的文本内容：各接口指标 + 队列与连接仪表
+
+    各接口的 db 耗时只含请求线程上的语句；开启写后台队列时，写线程的数据库耗时单独汇总为
+    write_queue_db_seconds_total。
+    """
+    load = load_stats()
+    extra = {"active_connections": load["active_connections"], "sessions": load["sessions"]}
+    if pool is not None:
+        extra["queue_depth"] = load["depth"]
+        extra["queue_rejected_total"] = load["rejected"]
+    if "write_queue" in load:
+        extra["write_queue_depth"] = load["write_queue"]["depth"]
+        extra["write_queue_rejected_total"] = load["write_queue"]["rejected"]
+        extra["write_queue_db_seconds_total"] = f'{load["write_queue"]["db_seconds"]:.6f}'
+    for name in ("hits", "misses", "evictions", "expirations"):
+        extra[f"result_cache_{name}_total"] = load["result_cache"][name]
+    return request_metrics.render(extra)
+
+def start_metrics_http(port=None):
+    port = port or METRICS_PORT
+    if port:
+        metrics.serve_http(render_metrics, METRICS_HOST, port)
+        print(f"[METRICS] http://{METRICS_HOST}:{port}/metrics")
+
+def start_pool():
+    global pool
+    pool = workpool.RequestPool(REQUEST_WORKERS, MAX_QUEUE)
+
+def start_writer():
+    global writes
+    if WRITE_BEHIND:
+        writes = writequeue.WriteQueue()
+        writes.start()
+
+def stop_writer():
+    """写完队列中尚未提交的写入"""
+    if writes is not None:
+        writes.stop()
+
+def write(insert, *args):
+    """执行一条写入，返回 (成功, 消息)；开启写后台队列时入队，按 WRITE_ACK 决定何时确认"""
+    if writes is None:
+        return database.write(insert, *args)
+    future = writes.submit(insert, *args)
+    if future is None:
+        return False, "服务器繁忙，写入队列已满，请稍后重试"
+    if WRITE_ACK == writequeue.ACK_ENQUEUE:
+        return True, "已接收"
+    try:
+        return True, future.result(WRITE_TIMEOUT)
+    except FutureTimeout:
+        raise writequeue.Timeout(f"写入 {WRITE_TIMEOUT} 秒内未提交，结果未确认，请稍后刷新查看") from None
+    except Exception as e:
+        return False, str(e)
+
+def purge_in_background(user_id):
+    success, msg = database.purge_user(user_id)
+    print(f"[PURGE] 用户 {user_id}: {msg}")
+
+# 后台导入任务：源文件路径 -> 状态（running / done / failed）与进度，供 import_status 轮询；
+# 多进程模式下只登记在受理导入的工作进程中，需在同一连接上查询
+import_jobs = {}
+_import_lock = threading.Lock()
+
+def import_in_background(job, path, fmt, chunk_size, resume):
+    def progress(stats):
+        job["progress"] = stats.to_dict()
+    success, result = importer.import_file(path, fmt, chunk_size, resume, progress, progress_every=chunk_size)
+    if success:
+        job["progress"] = result
+    else:
+        job["message"] = result
+    job["state"] = "done" if success else "failed"
+    job["finished_at"] = time.time()
+    print(f"[IMPORT] {path}: {'导入完成' if success else result}")
+
+def dispatch(request):
+    """执行单个请求并返回响应（可在工作线程中并发调用）"""
+    action = request.get('action')
+    payload = request.get('payload', {})
+    
+    response = {"status": "error", "message": "Unknown action"}
+    denied = authorize(action, request, payload)
+    
+    # 路由分发
+    if denied:
+        response = denied
+        
+    elif action == "ping":
+        response = pong(request)
+
+    elif action == "login":
+        success, data = database.login_user(payload['username'], payload['password'])
+        if success:
+            data['token'] = sessions.issue(data)
+        response = {"status": "success" if success else "error", 
+                   "data": data if success else None, 
+                   "message": data if not success else "Login OK"}
+        
+    elif action == "resume_session":
+        # 断线重连时用令牌恢复会话，省去一次密码校验
+        token = payload.get('token')
+        current = sessions.validate(token)
+        if current:
+            data = {"id": current['id'], "username": current['username'],
+                    "role": current['role'], "token": token}
+            response = {"status": "success", "data": data, "message": "Session resumed"}
+        else:
+            response = {"status": "error", "code": "auth_required", "message": "会话无效或已过期，请重新登录"}
+        
+    elif action == "logout":
+        sessions.revoke(request.get('token'))
+        response = {"status": "success", "message": "已注销"}
+        
+    elif action == "register":
+        success, msg = database.register_user(payload['username'], payload['password'], 
+                                             payload.get('age'), payload.get('gender'))
+        response = {"status": "success" if success else "error", "message": msg}
+        
+    elif action == "add_record":
+        success, msg = write(
+            database.insert_health_record,
+            payload['user_id'], payload['date'], payload.get('weight'), 
+            payload.get('sys_bp'), payload.get('dia_bp'), payload.get('steps'),
+            payload.get('heart_rate'), payload.get('blood_sugar'), 
+            payload.get('temperature'), payload.get('sleep_hours'),
+            payload.get('water_intake'), payload.get('notes')
+        )
+        response = {"status": "success" if success else "error", "message": msg}
+        
+    elif action == "get_records":
+        # columns 可选：只返回需要的列，减少传输量
+        try:
+            records = database.get_user_records(payload['user_id'], payload.get('columns'),
+                                                start_date=payload.get('start_date'), end_date=payload.get('end_date'))
+            response = {"status": "success", "data": records}
+        except ValueError as e:
+            response = {"status": "error", "message": str(e)}
+        
+    elif action == "get_sys_stats":
+        try:
+            response = {"status": "success", "data": database.get_all_stats()}
+        except database.QueryTimeout as e:
+            response = {"status": "error", "code": "timeout", "message": str(e)}
+
+    elif action == "get_server_load":
+        # 请求队列深度、拒绝次数等运行指标
+        response = {"status": "success", "data": load_stats()}
+
+    elif action == "get_server_metrics":
+        response = {"status": "success", "data": {"actions": request_metrics.snapshot(), "load": load_stats()}}
+
+    elif action == "list_connections":
+        response = {"status": "success", "data": registry.list()}
+
+    elif action == "evict_connection":
+        # 按连接编号、用户或空闲秒数断开连接（仅限本进程内的连接）
+        count = registry.evict(payload.get('connection_id'), payload.get('user_id'), payload.get('idle_seconds'))
+        response = {"status": "success", "message": f"已断开 {count} 个连接"}
+    
+    # --- 新增API ---
+    elif action == "update_profile":
+        success, msg = database.update_user_profile(payload['user_id'], **payload.get('profile_data', {}))
+        response = {"status": "success" if success else "error", "message": msg}
+        
+    elif action == "get_profile":
+        try:
+            profile = database.get_user_profile(payload['user_id'], payload.get('columns'))
+            response = {"status": "success", "data": profile}
+        except ValueError as e:
+            response = {"status": "error", "message": str(e)}
+        
+    elif action == "add_medication":
+        success, msg = database.add_medication(
+            payload['user_id'], payload['medicine_name'], payload['dosage'],
+            payload['frequency'], payload['start_date'], 
+            payload.get('end_date'), payload.get('notes')
+        )
+        response = {"status": "success" if success else "error", "message": msg}
+        
+    elif action == "get_medications":
+        meds = database.get_user_medications(payload['user_id'])
+        response = {"status": "success", "data": meds}
+        
+    elif action == "delete_medication":
+        # 普通用户的 user_id 已由 authorize 换成会话用户，只能删改自己的记录
+        success, msg = database.delete_medication(payload['med_id'], payload.get('user_id'))
+        response = {"status": "success" if success else "error", "message": msg}
+        
+    elif action == "add_goal":
+        success, msg = database.add_health_goal(
+            payload['user_id'], payload['goal_type'], payload['target_value'],
+            payload['current_value'], payload['start_date'], payload['end_date']
+        )
+        response = {"status": "success" if success else "error", "message": msg}
+        
+    elif action == "get_goals":
+        goals = database.get_user_goals(payload['user_id'])
+        response = {"status": "success", "data": goals}
+        
+    elif action == "update_goal_progress":
+        success, msg = database.update_goal_progress(payload['goal_id'], payload['current_value'],
+                                                   payload.get('user_id'))
+        response = {"status": "success" if success else "error", "message": msg}
+        
+    elif action == "add_reminder":
+        success, msg = database.add_reminder(
+            payload['user_id'], payload['reminder_type'], payload['title'],
+            payload['reminder_time'], payload.get('repeat_type', 'once')
+        )
+        if success:
+            reminders_changed()
+        response = {"status": "success" if success else "error", "message": msg}
+        
+    elif action == "get_reminders":
+        rows = database.get_user_reminders(payload['user_id'])
+        response = {"status": "success", "data": rows}
+        
+    elif action == "add_diet":
+        success, msg = write(
+            database.insert_diet_record, payload['user_id'], payload['record_date'], payload['meal_type'],
+            payload['food_description'], payload.get('calories', 0)
+        )
+        response = {"status": "success" if success else "error", "message": msg}
+        
+    elif action == "get_diet_records":
+        records = database.get_user_diet_records(payload['user_id'], payload.get('date'))
+        response = {"status": "success", "data": records}
+
+    elif action == "search_history":
+        # 检索本人历史：健康记录备注、饮食描述、用药（管理员可指定 user_id）
+        results = database.search_history(payload['user_id'], payload.get('query', ''),
+                                          payload.get('start_date'), payload.get('end_date'),
+                                          payload.get('sources'), payload.get('limit', 20), payload.get('offset', 0))
+        response = {"status": "success", "data": results}
+
+    # --- 新增：管理员API ---
+    
+    elif action == "get_all_users":
+        # 支持检索与分页：有检索词时走全文索引，结果条数有上限
+        # 分页时多取一条判断是否还有下一页（has_more）；检索到达总数上限时 truncated 为真
+        limit, offset = payload.get('limit'), payload.get('offset') or 0
+        try:
+            users = database.get_all_users(payload.get('query'), limit=limit + 1 if limit else None, offset=offset)
+            response = {"status": "success", "data": users[:limit] if limit else users}
+            if limit:
+                response["has_more"] = len(users) > limit
+                response["truncated"] = bool(payload.get('query')) and \
+                    offset + len(response["data"]) >= database.SEARCH_MAX_RESULTS
+        except database.QueryTimeout as e:
+            response = {"status": "error", "code": "timeout", "message": str(e)}
+        
+    elif action == "delete_user":
+        # 先注销该用户的会话，再分批清除数据；background 为真时立即返回，由后台线程完成
+        target_id = payload['target_id']
+        sessions.revoke_user(target_id)
+        if payload.get('background'):
+            threading.Thread(target=purge_in_background, args=(target_id,), daemon=True,
+                             name=f'purge-user-{target_id}').start()
+            response = {"status": "success", "message": "已开始后台删除该用户及其数据"}
+        else:
+            success, msg = database.purge_user(target_id)
+            response = {"status": "success" if success else "error", "message": msg}
+    
+    elif action == "import_records":
+        # 导入服务器本地的 CSV/JSONL 文件，默认从断点续传；默认在后台线程执行，不占用请求执行线程，
+        # 进度由 import_status 查询；background 为假时同步导入并直接返回统计
+        path = payload['path']
+        chunk_size = payload.get('chunk_size', importer.DEFAULT_CHUNK_SIZE)
+        if payload.get('background', True):
+            with _import_lock:
+                running = import_jobs.get(path, {}).get("state") == "running"
+                if not running:
+                    job = import_jobs[path] = {"state": "running", "started_at": time.time(),
+                                               "progress": None, "message": None}
+            if running:
+                response = {"status": "error", "message": "该文件正在导入中"}
+            else:
+                threading.Thread(target=import_in_background, daemon=True, name='import-records',
+                                 args=(job, path, payload.get('format'), chunk_size,
+                                       payload.get('resume', True))).start()
+                response = {"status": "success", "message": "已开始后台导入，可通过 import_status 查询进度"}
+        else:
+            success, result = importer.import_file(path, payload.get('format'), chunk_size,
+                                                   payload.get('resume', True), importer.print_progress)
+            response = {"status": "success" if success else "error",
+                       "data": result if success else None,
+                       "message": result if not success else "导入完成"}
+
+    elif action == "import_status":
+        job = import_jobs.get(payload['path'])
+        if job is None:
+            response = {"status": "error", "message": "没有该文件的导入任务"}
+        else:
+            response = {"status": "success", "data": dict(job)}
+    
+    # --- 新增：通知系统 API ---
+    elif action == "send_notification":
+        success, msg = database.send_notification(payload['target_id'], payload['message'])
+        if success:
+            push_notification(payload['target_id'], payload['message'])
+        response = {"status": "success" if success else "error", "message": msg}
+        
+    elif action == "get_notifications":
+        notifs = database.get_user_notifications(payload['user_id'], payload.get('only_unread', True))
+        response = {"status": "success", "data": notifs}
+        
+    elif action == "mark_read":
+        success, msg = database.mark_notification_read(payload['notif_id'], payload.get('user_id'))
+        response = {"status": "success" if success else "error", "message": msg}
+
+    elif action == "batch":
+        # 一帧内按顺序执行多个请求，结果按原顺序返回
+        results = []
+        for item in payload.get('requests', []):
+            if item.get('action') == "batch":
+                results.append({"status": "error", "message": "batch 不能嵌套"})
+            else:
+                results.append(execute(dict(item, token=request.get('token'))))
+        response = {"status": "success", "data": results}
+
+    return response
+
+def execute(request, conn=None, client=None):
+    """执行请求并兜底异常，保证每个请求都有响应；带 id 的请求原样回带 id"""
+    try:
+        response = dispatch(request)
+    except passwords.Busy:
+        # 进行中的密码运算已达上限：快速拒绝，不让登录请求堆积占满请求执行器
+        response = busy_response()
+    except writequeue.Timeout as e:
+        response = {"status": "error", "code": "timeout", "message": str(e)}
+    except Exception as e:
+        response = {"status": "error", "message": f"请求处理失败: {e}"}
+    if client is not None and request.get('action') in ("login", "resume_session") \
+            and response.get("status") == "success":
+        registry.identify(client, response["data"])
+    if conn is not None and conn.framed:
+        # 登录/恢复会话后登记该连接以接收推送，注销后取消
+        action = request.get('action')
+        if action in ("login", "resume_session") and response.get("status") == "success":
+            subscribe(response["data"]["id"], conn)
+        elif action == "logout":
+            unsubscribe(conn)
+    if 'id' in request:
+        response['id'] = request['id']
+    return response
+
+def negotiate(payload):
+    """hello：协商线路编码与压缩，返回 (响应, 升级参数)"""
+    upgrade = (protocol.negotiate(payload.get('codecs')),
+               protocol.negotiate_compression(payload.get('compression')))
+    response = {"status": "success", "data": {"codec": upgrade[0], "compression": upgrade[1], "framed": True}}
+    return response, upgrade
+
+def busy_response(request=None):
+    """过载时的快速拒绝响应，retry_after 为建议的重试等待秒数"""
+    response = {"status": "error", "code": "busy", "retry_after": pool.retry_after() if pool is not None else 1,
+                "message": "服务器繁忙，请稍后重试"}
+    if request and 'id' in request:
+        response['id'] = request['id']
+    return response
+
+def respond(conn, request, response, started, size_in=0, db_time=0.0):
+    """发送响应并记录该接口的耗时、错误、收发字节数与数据库/编码耗时"""
+    try:
+        size_out, encode_time = conn.send(response)
+    except OSError:
+        size_out, encode_time = 0, 0.0  # 连接已关闭，丢弃响应
+    request_metrics.observe(request.get('action'), time.perf_counter() - started, response.get('status') != 'success',
+                    size_in, size_out, db_time, encode_time)
+
+def process(conn, request, client, started, size_in):
+    """在执行线程中完成请求：执行、回复、记录指标"""
+    db_start = database.db_seconds()
+    try:
+        response = execute(request, conn, client)
+        respond(conn, request, response, started, size_in, database.db_seconds() - db_start)
+    finally:
+        registry.finish(client)
+
+def submit(conn, request, client, started, size_in):
+    """按接口优先级提交到请求执行器，队列已满时返回 None"""
+    registry.begin(client)
+    future = pool.submit(workpool.priority_of(request.get('action')), process,
+                         conn, request, client, started, size_in)
+    if future is None:
+        registry.finish(client)
+    return future
+
+def pong(request):
+    response = {"status": "success", "data": {"pong": time.time()}}
+    if 'id' in request:
+        response['id'] = request['id']
+    return response
+
+def run_pipelined(conn, request, inflight, client, started, size_in):
+    """流水线请求：执行完成后在执行线程中直接回复"""
+    future = submit(conn, request, client, started, size_in)
+    if future is None:
+        inflight.release()
+        respond(conn, request, busy_response(request), started, size_in)
+    else:
+        future.add_done_callback(lambda f: inflight.release())
+
+def wait_request(poller, client, timeout):
+    """等待下一条请求到达；空闲时间从最近一次收到请求或回复完成算起，请求执行期间不计空闲，超时返回 False"""
+    if timeout is None:
+        return True
+    while True:
+        idle = registry.idle_seconds(client)
+        if idle >= timeout:
+            return False
+        if poller.poll((timeout - idle) * 1000):
+            return True
+
+def handle_client(client_socket, addr, client):
     """处理单个客户端连接的线程函数"""
     print(f"[NEW CONNECTION] {addr} connected.")
     
+    client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    # 空闲超时回收被遗弃的连接（由 wait_request 判断；套接字超时只兜底消息读到一半或发送卡住的对端）；
+    # keepalive 发现对端已失联（如断网、休眠）的半开连接
+    idle_timeout = IDLE_TIMEOUT
+    client_socket.settimeout(idle_timeout)
+    protocol.enable_keepalive(client_socket)
+    poller = select.poll()
+    poller.register(client_socket, select.POLLIN)
+    conn = protocol.Connection(client_socket, protocol.get_serializer(SERIALIZER))
+    # 限制单连接上同时执行的请求数，超出时暂停读取，形成自然背压
+    inflight = threading.BoundedSemaphore(MAX_INFLIGHT)
     try:
         while True:
-            request_data = client_socket.recv(8192).decode('utf-8')
-            if not request_data:
+            if not wait_request(poller, client, idle_timeout):
+                print(f"[IDLE TIMEOUT] {addr} 超过 {idle_timeout} 秒无请求，断开连接")
                 break
+            request = conn.recv()
+            if request is None:
+                break
+            registry.touch(client)
+            started, size_in = time.perf_counter(), conn.last_recv_size
             
-            request = json.loads(request_data)
-            action = request.get('action')
-            payload = request.get('payload', {})
-            
-            response = {"status": "error", "message": "Unknown action"}
-            
-            # 路由分发
-            if action == "login":
-                success, data = database.login_user(payload['username'], payload['password'])
-                response = {"status": "success" if success else "error", 
-                           "data": data if success else None, 
-                           "message": data if not success else "Login OK"}
-                
-            elif action == "register":
-                success, msg = database.register_user(payload['username'], payload['password'], 
-                                                     payload.get('age'), payload.get('gender'))
-                response = {"status": "success" if success else "error", "message": msg}
-                
-            elif action == "add_record":
-                success, msg = database.add_health_record(
-                    payload['user_id'], payload['date'], payload.get('weight'), 
-                    payload.get('sys_bp'), payload.get('dia_bp'), payload.get('steps'),
-                    payload.get('heart_rate'), payload.get('blood_sugar'), 
-                    payload.get('temperature'), payload.get('sleep_hours'),
-                    payload.get('water_intake'), payload.get('notes')
-                )
-                response = {"status": "success" if success else "error", "message": msg}
-                
-            elif action == "get_records":
-                records = database.get_user_records(payload['user_id'])
-                response = {"status": "success", "data": records}
-                
-            elif action == "get_sys_stats":
-                stats = database.get_all_stats()
-                response = {"status": "success", "data": stats}
-            
-            # --- 新增API ---
-            elif action == "update_profile":
-                success, msg = database.update_user_profile(payload['user_id'], **payload.get('profile_data', {}))
-                response = {"status": "success" if success else "error", "message": msg}
-                
-            elif action == "get_profile":
-                profile = database.get_user_profile(payload['user_id'])
-                response = {"status": "success", "data": profile}
-                
-            elif action == "add_medication":
-                success, msg = database.add_medication(
-                    payload['user_id'], payload['medicine_name'], payload['dosage'],
-                    payload['frequency'], payload['start_date'], 
-                    payload.get('end_date'), payload.get('notes')
-                )
-                response = {"status": "success" if success else "error", "message": msg}
-                
-            elif action == "get_medications":
-                meds = database.get_user_medications(payload['user_id'])
-                response = {"status": "success", "data": meds}
-                
-            elif action == "delete_medication":
-                success, msg = database.delete_medication(payload['med_id'])
-                response = {"status": "success" if success else "error", "message": msg}
-                
-            elif action == "add_goal":
-                success, msg = database.add_health_goal(
-                    payload['user_id'], payload['goal_type'], payload['target_value'],
-                    payload['current_value'], payload['start_date'], payload['end_date']
-                )
-                response = {"status": "success" if success else "error", "message": msg}
-                
-            elif action == "get_goals":
-                goals = database.get_user_goals(payload['user_id'])
-                response = {"status": "success", "data": goals}
-                
-            elif action == "update_goal_progress":
-                success, msg = database.update_goal_progress(payload['goal_id'], payload['current_value'])
-                response = {"status": "success" if success else "error", "message": msg}
-                
-            elif action == "add_reminder":
-                success, msg = database.add_reminder(
-                    payload['user_id'], payload['reminder_type'], payload['title'],
-                    payload['reminder_time'], payload.get('repeat_type', 'once')
-                )
-                response = {"status": "success" if success else "error", "message": msg}
-                
-            elif action == "get_reminders":
-                reminders = database.get_user_reminders(payload['user_id'])
-                response = {"status": "success", "data": reminders}
-                
-            elif action == "add_diet":
-                success, msg = database.add_diet_record(
-                    payload['user_id'], payload['record_date'], payload['meal_type'],
-                    payload['food_description'], payload.get('calories', 0)
-                )
-                response = {"status": "success" if success else "error", "message": msg}
-                
-            elif action == "get_diet_records":
-                records = database.get_user_diet_records(payload['user_id'], payload.get('date'))
-                response = {"status": "success", "data": records}
-
-            # --- 新增：管理员API ---
-            
-            elif action == "get_all_users":
-                # 支持搜索功能
-                users = database.get_all_users(payload.get('query'))
-                response = {"status": "success", "data": users}
-                
-            elif action == "delete_user":
-                success, msg = database.delete_user(payload['target_id'])
-                response = {"status": "success" if success else "error", "message": msg}
-            
-            # --- 新增：通知系统 API ---
-            elif action == "send_notification":
-                success, msg = database.send_notification(payload['target_id'], payload['message'])
-                response = {"status": "success" if success else "error", "message": msg}
-                
-            elif action == "get_notifications":
-                notifs = database.get_user_notifications(payload['user_id'], payload.get('only_unread', True))
-                response = {"status": "success", "data": notifs}
-                
-            elif action == "mark_read":
-                success, msg = database.mark_notification_read(payload['notif_id'])
-                response = {"status": "success" if success else "error", "message": msg}
-
-            # 发送响应
-            client_socket.send(json.dumps(response).encode('utf-8'))
+            if request.get('action') == "ping":
+                # 应用层心跳：直接回复，不进入执行队列，过载时也能及时响应
+                respond(conn, request, pong(request), started, size_in)
+            elif request.get('action') == "hello":
+                # 回复仍按当前协议发送，之后切换为分帧协议
+                response, upgrade = negotiate(request.get('payload', {}))
+                if 'id' in request:
+                    response['id'] = request['id']
+                respond(conn, request, response, started, size_in)
+                conn.upgrade(*upgrade)
+            elif conn.framed and 'id' in request:
+                # 流水线请求：并发执行，响应按完成顺序返回
+                inflight.acquire()
+                run_pipelined(conn, request, inflight, client, started, size_in)
+            else:
+                # 顺序请求同样经由执行器排队（执行线程负责回复），连接线程等待完成后再读下一条
+                future = submit(conn, request, client, started, size_in)
+                if future:
+                    future.result()
+                else:
+                    respond(conn, request, busy_response(request), started, size_in)
             
+    except socket.timeout:
+        print(f"[TIMEOUT] {addr} 超过 {idle_timeout} 秒未完成收发，断开连接")
     except Exception as e:
         print(f"[ERROR] {addr}: {e}")
     finally:
+        unsubscribe(conn)
+        registry.unregister(client)
         client_socket.close()
         print(f"[DISCONNECTED] {addr} disconnected.")
+        if conn.stats["frames_compressed"]:
+            print(f"[COMPRESSION] {addr} {conn.compression_summary()}")
 
-def start_server():
-    """启动服务器"""
-    database.init_db()
+def create_listener(reuse_port=False):
+    """创建监听套接字；多进程模式下各工作进程以 SO_REUSEPORT 共享同一端口"""
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     server.bind((HOST, PORT))
-    server.listen(5)
-    print(f"[LISTENING] Server is listening on {HOST}:{PORT}")
-    
+    server.listen(LISTEN_BACKLOG)
+    return server
+
+def reject(client_sock):
+    """连接数已达上限：回复繁忙后立即关闭，不为其创建线程"""
+    try:
+        serializer = protocol.get_serializer(SERIALIZER)
+        protocol.send_message(client_sock, serializer.dumps(busy_response()))
+        client_sock.shutdown(socket.SHUT_WR)
+    except OSError:
+        pass
+    finally:
+        client_sock.close()
+
+def serve(server):
+    """accept 循环，监听套接字被关闭时返回"""
     while True:
-        client_sock, addr = server.accept()
-        thread = threading.Thread(target=handle_client, args=(client_sock, addr))
+        try:
+            client_sock, addr = server.accept()
+        except OSError:
+            break
+        if registry.count() >= MAX_CONNECTIONS:
+            reject(client_sock)
+            continue
+        client = registry.register(client_sock, addr)
+        thread = threading.Thread(target=handle_client, args=(client_sock, addr, client), daemon=True)
         thread.start()
-        print(f"[ACTIVE CONNECTIONS] {threading.active_count() - 1}")
+        print(f"[ACTIVE CONNECTIONS] {registry.count()}")
+
+def start_server():
+    """启动服务器（单进程模式；多进程模式见 supervisor.py）"""
+    global reminders
+    database.init_db()
+    if MIGRATE_ON_START:
+        migrations.migrate(foreground_only=True, progress=print)
+    server = create_listener()
+    start_pool()
+    start_metrics_http()
+    if MIGRATE_ON_START:
+        migrations.start_background()
+    if REMINDER_SCHEDULER:
+        reminders = scheduler.ReminderScheduler(push_notification)
+        reminders.start()
+    if GOAL_RECONCILE_AT:
+        scheduler.DailyJob(GOAL_RECONCILE_AT, database.reconcile_goals, 'goal-reconcile').start()
+    if ARCHIVE_AT:
+        scheduler.DailyJob(ARCHIVE_AT, database.archive_health_data, 'archive').start()
+    if BACKUP_AT:
+        scheduler.DailyJob(BACKUP_AT, backup.snapshot, 'backup').start()
+    start_writer()
+    print(f"[LISTENING] Server is listening on {HOST}:{PORT}")
+    try:
+        serve(server)
+    finally:
+        stop_writer()
 
 if __name__ == "__main__":
     start_server()
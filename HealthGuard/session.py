@@ -0,0 +1,107 @@
+import secrets
+import threading
+import time
+
+# 会话有效期（秒），每次成功校验都会顺延
+SESSION_TTL = 8 * 3600
+# 过期会话的清理间隔（秒）
+PURGE_INTERVAL = 300
+# 多进程模式下，会话续期同步给其他工作进程的最小间隔（秒）
+SYNC_INTERVAL = 300
+
+
+class SessionManager:
+    """内存会话表：登录时签发不透明令牌，后续请求只需一次字典查找即可完成认证"""
+
+    def __init__(self, ttl=SESSION_TTL, publish=None):
+        self.ttl = ttl
+        # 多进程模式下由 server 设置，用于把会话变化广播给其他工作进程
+        self.publish = publish
+        self._sessions = {}  # token -> {"id", "username", "role", "expires_at"}
+        self._lock = threading.Lock()
+        self._next_purge = time.monotonic() + PURGE_INTERVAL
+
+    def issue(self, user):
+        """为登录成功的用户签发令牌"""
+        token = secrets.token_urlsafe(32)
+        session = {"id": user["id"], "username": user["username"], "role": user["role"],
+                   "expires_at": time.monotonic() + self.ttl}
+        with self._lock:
+            self._sessions[token] = session
+            if session["expires_at"] - self.ttl >= self._next_purge:
+                self._purge_locked()
+        if self.publish:
+            session["synced_at"] = time.monotonic()
+            self.publish({"type": "session_add", "token": token, "session": dict(session)})
+        return token
+
+    def validate(self, token):
+        """校验令牌，有效则顺延有效期并返回会话，否则返回 None"""
+        session = self._sessions.get(token) if token else None
+        if session is None:
+            return None
+        now = time.monotonic()
+        if session["expires_at"] < now:
+            self._revoke_local(token)
+            return None
+        session["expires_at"] = now + self.ttl
+        if self.publish and now - session.get("synced_at", 0) > SYNC_INTERVAL:
+            session["synced_at"] = now
+            self.publish({"type": "session_renew", "token": token, "expires_at": session["expires_at"]})
+        return session
+
+    def revoke(self, token):
+        if self.publish and token:
+            self.publish({"type": "session_revoke", "token": token})
+        return self._revoke_local(token)
+
+    def revoke_user(self, user_id):
+        """撤销某个用户的全部会话（如账号被删除）"""
+        if self.publish:
+            self.publish({"type": "session_revoke_user", "user_id": user_id})
+        return self._revoke_user_local(user_id)
+
+    def apply(self, event):
+        """应用其他工作进程广播来的会话变化（不再转发）"""
+        kind = event["type"]
+        if kind == "session_add":
+            with self._lock:
+                self._sessions[event["token"]] = event["session"]
+        elif kind == "session_renew":
+            session = self._sessions.get(event["token"])
+            if session:
+                session["expires_at"] = max(session["expires_at"], event["expires_at"])
+        elif kind == "session_revoke":
+            self._revoke_local(event["token"])
+        elif kind == "session_revoke_user":
+            self._revoke_user_local(event["user_id"])
+        elif kind == "session_snapshot":
+            with self._lock:
+                self._sessions.update(event["sessions"])
+
+    def snapshot(self):
+        """当前有效会话的副本，供新启动的工作进程同步"""
+        with self._lock:
+            self._purge_locked()
+            return {t: dict(s) for t, s in self._sessions.items()}
+
+    def _revoke_local(self, token):
+        with self._lock:
+            return self._sessions.pop(token, None) is not None
+
+    def _revoke_user_local(self, user_id):
+        with self._lock:
+            tokens = [t for t, s in self._sessions.items() if s["id"] == user_id]
+            for token in tokens:
+                del self._sessions[token]
+        return len(tokens)
+
+    def count(self):
+        return len(self._sessions)
+
+    def _purge_locked(self):
+        now = time.monotonic()
+        expired = [t for t, s in self._sessions.items() if s["expires_at"] < now]
+        for token in expired:
+            del self._sessions[token]
+        self._next_purge = now + PURGE_INTERVAL
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+HealthGuard 慢查询日志
+database.SLOW_QUERY_MS 设置为阈值（毫秒）后，超过阈值的语句连同参数形态与 EXPLAIN QUERY PLAN
+以 JSON 行写入轮转日志；本脚本按语句汇总最耗时的查询。
+
+用法:
+    python slowlog.py                       # 汇总 slow_query.log 及其轮转文件
+    python slowlog.py other.log --top 20 --sort max
+"""
+
+import argparse
+import glob
+import json
+import logging
+import sqlite3
+import threading
+import time
+from logging.handlers import RotatingFileHandler
+
+LOG_FILE = 'slow_query.log'
+MAX_BYTES = 10 * 1024 * 1024
+BACKUP_COUNT = 5
+
+_logger = None
+_lock = threading.Lock()
+_plans = {}  # 语句文本 -> 执行计划，同一语句只 EXPLAIN 一次
+MAX_PLANS = 512
+
+
+def _get_logger():
+    global _logger
+    with _lock:
+        if _logger is None:
+            logger = logging.getLogger('healthguard.slow_query')
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            handler = RotatingFileHandler(LOG_FILE, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT, encoding='utf-8')
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+            _logger = logger
+    return _logger
+
+
+def normalize(sql):
+    return ' '.join(sql.split())
+
+
+def params_shape(params):
+    """参数只记录类型与长度，不落盘具体值（可能含用户隐私）"""
+    if params is None:
+        return "executemany"
+    if isinstance(params, dict):
+        return {k: _value_shape(v) for k, v in params.items()}
+    return [_value_shape(v) for v in params]
+
+
+def _value_shape(value):
+    if isinstance(value, (str, bytes)):
+        return f"{type(value).__name__}({len(value)})"
+    return type(value).__name__
+
+
+def explain(conn, sql, params):
+    """取语句的执行计划，按父子关系缩进；无法 EXPLAIN 的语句返回空列表"""
+    key = normalize(sql)
+    plan = _plans.get(key)
+    if plan is not None:
+        return plan
+    if params is None or not key.upper().startswith(('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')):
+        return []
+    try:
+        # 使用普通游标，避免执行计划本身被计时或再次记入慢查询
+        rows = sqlite3.Connection.cursor(conn).execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+    except sqlite3.Error:
+        return []
+    depth = {0: -1}
+    plan = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        plan.append("  " * depth[node_id] + detail)
+    if len(_plans) < MAX_PLANS:
+        _plans[key] = plan
+    return plan
+
+
+def record(conn, sql, params, seconds):
+    """写入一条慢查询"""
+    entry = {"ts": time.strftime('%Y-%m-%d %H:%M:%S'), "ms": round(seconds * 1000, 2),
+             "sql": normalize(sql), "params": params_shape(params), "plan": explain(conn, sql, params),
+             "thread": threading.current_thread().name}
+    _get_logger().info(json.dumps(entry, ensure_ascii=False))
+
+
+def load(path=LOG_FILE):
+    """读取日志及其轮转文件（path.1, path.2 ...）"""
+    entries = []
+    for name in [path] + sorted(glob.glob(glob.escape(path) + '.*')):
+        try:
+            with open(name, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue  # 写入中途截断的行
+        except FileNotFoundError:
+            continue
+    return entries
+
+
+def summarize(entries, top=10, sort='total'):
+    """按语句汇总：次数、总耗时、最大与平均耗时，以及是否存在全表扫描"""
+    groups = {}
+    for e in entries:
+        g = groups.setdefault(e["sql"], {"sql": e["sql"], "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                                         "plan": e.get("plan", [])})
+        g["count"] += 1
+        g["total_ms"] += e["ms"]
+        g["max_ms"] = max(g["max_ms"], e["ms"])
+    for g in groups.values():
+        g["avg_ms"] = round(g["total_ms"] / g["count"], 2)
+        g["total_ms"] = round(g["total_ms"], 2)
+        # "SCAN 表名" 表示全表扫描；"SCAN ... USING INDEX" 等按索引扫描不计
+        g["full_scan"] = any(p.strip().startswith("SCAN") and "INDEX" not in p for p in g["plan"])
+    key = {"total": "total_ms", "max": "max_ms", "avg": "avg_ms", "count": "count"}[sort]
+    return sorted(groups.values(), key=lambda g: g[key], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="汇总 HealthGuard 慢查询日志")
+    parser.add_argument("path", nargs="?", default=LOG_FILE, help="日志文件（默认 slow_query.log）")
+    parser.add_argument("--top", type=int, default=10, help="显示前 N 条语句")
+    parser.add_argument("--sort", choices=("total", "max", "avg", "count"), default="total", help="排序依据")
+    args = parser.parse_args()
+
+    entries = load(args.path)
+    if not entries:
+        print(f"没有慢查询记录: {args.path}")
+        return
+    print(f"共 {len(entries)} 条慢查询记录\n")
+    for i, g in enumerate(summarize(entries, args.top, args.sort), 1):
+        flag = "  [全表扫描]" if g["full_scan"] else ""
+        print(f"{i}. 次数 {g['count']}  总计 {g['total_ms']} ms  最大 {g['max_ms']} ms  平均 {g['avg_ms']} ms{flag}")
+        print(f"   {g['sql']}")
+        for line in g["plan"]:
+            print(f"     {line}")
+        print()
+
+
+if __name__ == "__main__":
+    main()
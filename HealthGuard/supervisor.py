@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+HealthGuard 多进程服务模式
+主进程启动 N 个工作进程，各自以 SO_REUSEPORT 监听同一端口，由内核分摊连接；
+主进程负责崩溃重启、滚动重启（SIGHUP）以及工作进程间的 IPC 事件中转（会话同步、通知推送）。
+工作进程以 spawn 方式在全新的解释器中启动：主进程此时已有 IPC、调度等线程和打开的 SQLite 连接，
+fork 会把这些线程持有的锁以锁住的状态复制进子进程。主进程中修改过的模块配置随启动参数一并传入。
+
+用法:
+    python supervisor.py --workers 16
+    kill -HUP <主进程 pid>    # 滚动重启所有工作进程
+"""
+
+import importlib
+import os
+import pickle
+import sys
+import time
+import signal
+import socket
+import argparse
+import threading
+import multiprocessing
+import backup
+import database
+import ipc
+import migrations
+import server
+import scheduler
+import session
+
+WORKERS = os.cpu_count() or 2
+READY_TIMEOUT = 10      # 等待新工作进程就绪的最长时间（秒）
+DRAIN_TIMEOUT = 30      # 工作进程停止接收新连接后，等待已有连接结束的最长时间（秒）
+RESTART_BACKOFF = 1.0   # 崩溃后重启的最小间隔（秒），避免崩溃循环占满 CPU
+# 需要同步给工作进程的配置所在模块（模块级大写常量）
+CONFIG_MODULES = ('database', 'server', 'session', 'passwords', 'protocol', 'writequeue', 'workpool',
+                  'connections', 'slowlog', 'metrics', 'scheduler', 'migrations', 'backup')
+CONFIG_TYPES = (bool, int, float, str, type(None), tuple, list, dict, set, frozenset)
+
+
+def config_snapshot():
+    """主进程当前的模块配置 {模块名: {常量名: 值}}，只取可序列化的简单值"""
+    snapshot = {}
+    for name in CONFIG_MODULES:
+        module = sys.modules.get(name)
+        if module is None:
+            continue
+        values = {}
+        for key, value in vars(module).items():
+            if not key.isupper() or key.startswith('_') or not isinstance(value, CONFIG_TYPES):
+                continue
+            try:
+                pickle.dumps(value)
+            except Exception:
+                continue
+            values[key] = value
+        snapshot[name] = values
+    return snapshot
+
+
+def apply_config(snapshot):
+    for name, values in snapshot.items():
+        module = importlib.import_module(name)
+        for key, value in values.items():
+            setattr(module, key, value)
+
+
+def worker_main(slot, conn, ready, config):
+    """工作进程入口（spawn 启动的新解释器）"""
+    apply_config(config)
+    # 先接收会话快照，保证重启后的进程能识别已登录用户的令牌
+    channel = ipc.WorkerChannel(conn)
+    server.sessions.apply(conn.recv())
+    server.attach_ipc(channel)
+    channel.start()
+
+    listener = server.create_listener(reuse_port=True)
+    server.start_pool()
+    server.start_writer()
+    if server.METRICS_PORT:
+        server.start_metrics_http(server.METRICS_PORT + slot)
+
+    def stop(signum, frame):
+        # 关闭监听套接字：内核不再把新连接分给本进程，accept 循环随即退出
+        listener.close()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C 由主进程统一处理
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    ready.set()
+    print(f"[WORKER {slot}] pid {os.getpid()} 开始监听 {server.HOST}:{server.PORT}")
+
+    server.serve(listener)
+
+    # 排空：等待已有连接处理完毕或超时
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    while server.registry.count() > 0 and time.monotonic() < deadline:
+        time.sleep(0.2)
+    server.stop_writer()
+    print(f"[WORKER {slot}] pid {os.getpid()} 已退出（剩余连接 {server.registry.count()}）")
+    os._exit(0)
+
+
+class Supervisor:
+    """管理工作进程的生命周期"""
+
+    def __init__(self, workers=WORKERS):
+        self.count = workers
+        self.ctx = multiprocessing.get_context('spawn')
+        self.hub = ipc.Hub(session.SessionManager())
+        self.workers = {}  # slot -> (Process, 启动时间)
+        # pid -> 就绪事件：spawn 的子进程启动时才取得事件的信号量，父进程须一直持有引用，否则信号量被提前释放
+        self.ready_events = {}
+        self.restart_requested = False
+        self.stopping = False
+        # 提醒调度只在主进程运行一份，触发的通知经 IPC 推送给持有该用户连接的工作进程
+        self.reminders = scheduler.ReminderScheduler(
+            lambda user_id, message: self.hub.broadcast({"type": "notify", "user_id": user_id, "message": message}))
+        self.hub.on("reminders_changed", lambda e: self.reminders.wake())
+        # 主进程中的提醒触发、夜间对账等写入也要让工作进程的结果缓存失效
+        database.results.publish = self.hub.broadcast
+
+    def spawn(self, slot):
+        parent_conn, child_conn = self.ctx.Pipe()
+        ready = self.ctx.Event()
+        proc = self.ctx.Process(target=worker_main, args=(slot, child_conn, ready, config_snapshot()),
+                                name=f"healthguard-worker-{slot}")
+        proc.start()
+        child_conn.close()
+        self.hub.add(proc.pid, parent_conn)
+        self.ready_events[proc.pid] = ready
+        return proc, ready
+
+    def stop_worker(self, proc):
+        """通知工作进程停止接收新连接并排空，超时后强制结束"""
+        if proc.is_alive():
+            proc.terminate()  # SIGTERM
+        proc.join(DRAIN_TIMEOUT + 5)
+        if proc.is_alive():
+            proc.kill()
+            proc.join()
+        self.hub.remove(proc.pid)
+        self.ready_events.pop(proc.pid, None)
+
+    def rolling_restart(self):
+        """逐个替换工作进程：新进程就绪后再停止旧进程，期间端口始终有进程在服务"""
+        print("[SUPERVISOR] 开始滚动重启")
+        for slot in sorted(self.workers):
+            old, _ = self.workers[slot]
+            proc, ready = self.spawn(slot)
+            if not ready.wait(READY_TIMEOUT):
+                print(f"[SUPERVISOR] 工作进程 {slot} 未能就绪，停止滚动重启")
+                self.stop_worker(proc)
+                return
+            self.workers[slot] = (proc, time.monotonic())
+            self.stop_worker(old)
+        print("[SUPERVISOR] 滚动重启完成")
+
+    def check_workers(self):
+        """重启意外退出的工作进程"""
+        for slot, (proc, started) in list(self.workers.items()):
+            if proc.is_alive():
+                continue
+            print(f"[SUPERVISOR] 工作进程 {slot} (pid {proc.pid}) 异常退出，退出码 {proc.exitcode}，正在重启")
+            self.hub.remove(proc.pid)
+            self.ready_events.pop(proc.pid, None)
+            wait = RESTART_BACKOFF - (time.monotonic() - started)
+            if wait > 0:
+                time.sleep(wait)
+            proc, _ = self.spawn(slot)
+            self.workers[slot] = (proc, time.monotonic())
+
+    def run(self):
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            print("当前平台不支持 SO_REUSEPORT，请使用单进程模式: python server.py")
+            sys.exit(1)
+
+        database.init_db()
+        if server.MIGRATE_ON_START:
+            migrations.migrate(foreground_only=True, progress=print)
+        self.hub.start()
+        for slot in range(self.count):
+            self.workers[slot] = (self.spawn(slot)[0], time.monotonic())
+        if server.MIGRATE_ON_START:
+            migrations.start_background()
+        self.reminders.start()
+        if server.GOAL_RECONCILE_AT:
+            scheduler.DailyJob(server.GOAL_RECONCILE_AT, database.reconcile_goals, 'goal-reconcile').start()
+        if server.ARCHIVE_AT:
+            scheduler.DailyJob(server.ARCHIVE_AT, database.archive_health_data, 'archive').start()
+        if server.BACKUP_AT:
+            scheduler.DailyJob(server.BACKUP_AT, backup.snapshot, 'backup').start()
+
+        signal.signal(signal.SIGHUP, lambda s, f: setattr(self, 'restart_requested', True))
+        signal.signal(signal.SIGTERM, lambda s, f: setattr(self, 'stopping', True))
+        signal.signal(signal.SIGINT, lambda s, f: setattr(self, 'stopping', True))
+        print(f"[SUPERVISOR] pid {os.getpid()} 已启动 {self.count} 个工作进程")
+
+        while not self.stopping:
+            time.sleep(0.5)
+            if self.restart_requested:
+                self.restart_requested = False
+                self.rolling_restart()
+            self.check_workers()
+
+        print("[SUPERVISOR] 正在停止所有工作进程...")
+        threads = [threading.Thread(target=self.stop_worker, args=(proc,)) for proc, _ in self.workers.values()]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HealthGuard 多进程服务模式")
+    parser.add_argument("--workers", type=int, default=WORKERS, help="工作进程数（默认等于 CPU 核数）")
+    args = parser.parse_args()
+    Supervisor(args.workers).run()
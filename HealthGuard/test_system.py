@@ -7,6 +7,10 @@ HealthGuard 系统功能测试脚本
 
 import database
 import datetime
+import os
+import sqlite3
+import tempfile
+import time
 
 def test_database():
     """测试数据库功能"""
@@ -16,6 +20,9 @@ def test_database():
     
     # 1. 初始化数据库
     print("\n[测试1] 初始化数据库...")
+    # 使用临时库，不改动工作目录中的 health_system.db
+    original = database.DB_FILE
+    database.DB_FILE = os.path.join(tempfile.mkdtemp(), 'test.db')
     database.init_db()
     print("✅ 数据库初始化成功")
     
@@ -35,6 +42,7 @@ def test_database():
         user_id = data['id']
     else:
         print(f"❌ 登录失败: {data}")
+        database.DB_FILE = original
         return
     
     # 4. 测试更新用户档案
@@ -120,6 +128,1114 @@ def test_database():
     print("\n" + "=" * 50)
     print("✅ 所有数据库功能测试完成！")
     print("=" * 50)
+    database.DB_FILE = original
+
+def _use_temp_db():
+    """切换到临时数据库，返回原数据库路径以便恢复"""
+    original = database.DB_FILE
+    database.DB_FILE = os.path.join(tempfile.mkdtemp(), 'test.db')
+    database.init_db()
+    # 测试数据挂在用户 2、3 名下（外键约束要求用户存在）
+    conn = database.get_connection()
+    conn.executemany("INSERT INTO users (id, username, password, role) VALUES (?, ?, 'x', 'user')",
+                     [(2, "member2"), (3, "member3")])
+    conn.commit()
+    conn.close()
+    return original
+
+def test_importer():
+    """测试历史数据流式导入与断点续传"""
+    import importer
+    print("\n[测试] 历史数据导入...")
+    original = _use_temp_db()
+    try:
+        path = os.path.join(os.path.dirname(database.DB_FILE), 'history.csv')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("username,date,weight,sys_bp,dia_bp,steps\n")
+            for day in range(1, 11):
+                f.write(f"admin,2024-01-{day:02d},70,120,80,5000\n")
+            f.write("admin,2024-02-01,abc,120,80,5000\n")
+            f.write("nobody,2024-02-02,70,120,80,5000\n")
+            f.write("admin,2024-02-30,70,120,80,5000\n")
+
+        # 模拟上次导入已完成前 4 行
+        with open(importer.checkpoint_path(path), 'w', encoding='utf-8') as f:
+            f.write('{"line": 4}')
+        success, stats = importer.import_file(path, chunk_size=3)
+        assert success, stats
+        assert stats['skipped'] == 4 and stats['inserted'] == 6 and stats['rejected'] == 3
+        assert "record_date" in stats['errors'][-1]  # 无效日期不入库
+        assert not os.path.exists(importer.checkpoint_path(path))
+        assert len(database.get_user_records(1)) == 6
+
+        # JSONL 中格式错误的行只计入拒绝，不中断导入
+        path = os.path.join(os.path.dirname(database.DB_FILE), 'history.jsonl')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('{"user_id": 2, "date": "2024-03-01", "weight": 68}\n')
+            f.write('{"user_id": 2, "date": "2024-03-02", "weight": \n')
+            f.write('[1, 2]\n')
+            f.write('{"user_id": 2, "date": "2024-03-03", "weight": 67}\n')
+        success, jsonl_stats = importer.import_file(path)
+        assert success and jsonl_stats['inserted'] == 2 and jsonl_stats['rejected'] == 2, jsonl_stats
+        assert jsonl_stats['errors'][0].startswith("第 2 行")
+
+        # 通过接口导入：在后台线程执行，轮询 import_status 查看进度；同一文件不能同时导入两次
+        import server
+        token = _login("admin", "123456")
+        path = os.path.join(os.path.dirname(database.DB_FILE), 'background.csv')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("user_id,date,weight\n")
+            for day in range(1, 29):
+                f.write(f"3,2024-04-{day:02d},60\n")
+        request = {"action": "import_records", "token": token, "payload": {"path": path, "chunk_size": 10}}
+        assert server.dispatch(request)["status"] == "success"
+        status = lambda: server.dispatch({"action": "import_status", "token": token, "payload": {"path": path}})
+        _wait_until(lambda: status()["data"]["state"] != "running")
+        job = status()["data"]
+        assert job["state"] == "done" and job["progress"]["inserted"] == 28, job
+        server.import_jobs[path]["state"] = "running"
+        try:
+            assert server.dispatch(request)["message"] == "该文件正在导入中"
+        finally:
+            server.import_jobs.pop(path)
+        print(f"✅ 导入成功: {stats['inserted']} 行, 拒绝 {stats['rejected']} 行")
+    finally:
+        database.DB_FILE = original
+
+def test_user_search():
+    """测试管理员用户检索（全文索引随增删改同步）"""
+    print("\n[测试] 用户检索...")
+    original = _use_temp_db()
+    try:
+        conn = database.get_connection()
+        conn.executemany("INSERT INTO users (username, password, role, chronic_diseases) VALUES (?, 'x', 'user', ?)",
+                         [(f"patient{i:03d}", "高血压" if i % 2 else None) for i in range(120)])
+        conn.execute("UPDATE users SET username = 'renamed' WHERE username = 'patient007'")
+        conn.execute("DELETE FROM users WHERE username = 'patient008'")
+        conn.commit()
+        conn.close()
+
+        assert len(database.search_users("atient", limit=200)) == 118
+        assert [u["username"] for u in database.search_users("pa", limit=2)] == ["patient119", "patient118"]
+        assert len(database.search_users("PA", limit=200)) == 118  # 短检索词为子串匹配，不区分大小写
+        database.register_user("王小明", "pass1234", 30, "男")
+        assert [u["username"] for u in database.search_users("小明")] == ["王小明"]
+        assert database.search_users("renamed")[0]["username"] == "renamed"
+        assert len(database.search_users("高血压", limit=10, offset=55)) == 5
+        assert len(database.get_all_users("patient", limit=1000)) == 118  # 不超过 SEARCH_MAX_RESULTS
+
+        # 客户端按 has_more 逐页加载，不会漏掉第一页之后的用户
+        import server
+        admin = _login("admin", "123456")
+        seen, offset = [], 0
+        while True:
+            page = server.dispatch({"action": "get_all_users", "token": admin,
+                                    "payload": {"limit": 50, "offset": offset}})
+            seen += [u["id"] for u in page["data"]]
+            offset += len(page["data"])
+            if not page["has_more"]:
+                break
+        assert len(seen) == len(set(seen)) == 122 and not page["truncated"]  # 含 _use_temp_db 的两个用户
+        # 分页顺序与不分页的列表一致
+        assert seen == [u["id"] for u in database.get_all_users()]
+        print("✅ 用户检索与分页正常")
+    finally:
+        database.DB_FILE = original
+
+def test_history_search():
+    """测试历史文本检索（增量维护、日期过滤、仅限本人）"""
+    print("\n[测试] 历史检索...")
+    original = _use_temp_db()
+    try:
+        conn = database.get_connection()
+        conn.executemany("INSERT INTO health_data (user_id, record_date, notes) VALUES (?, ?, ?)",
+                         [(2, "2024-01-02", "早上头疼，血压偏高"), (3, "2024-01-03", "血压偏高")])
+        conn.execute("INSERT INTO diet_records (user_id, record_date, food_description) VALUES (2, '2024-02-01', '少盐，血压偏高')")
+        conn.commit()
+
+        assert len(database.search_history(2, "血压偏高")) == 2
+        hits = database.search_history(2, "血压偏高", start_date="2024-01-15")
+        assert [h["source"] for h in hits] == ["diet_records"] and "[血压偏高]" in hits[0]["snippet"]
+        assert database.search_history(2, "头疼")[0]["snippet"] == "早上[头疼]，血压偏高"
+        assert database._snippet("早上头疼，血压偏高" * 4, "胸闷") == ("早上头疼，血压偏高" * 4)[:32] + "…"
+        conn.execute("DELETE FROM health_data WHERE user_id = 2")
+        conn.commit()
+        conn.close()
+        assert database.search_history(2, "头疼") == []
+        print("✅ 历史检索正常")
+    finally:
+        database.DB_FILE = original
+
+def test_reminder_scheduler():
+    """测试提醒调度：到期触发、写入通知、重复提醒推进到下一次"""
+    import scheduler
+    from datetime import datetime, timedelta
+    print("\n[测试] 提醒调度...")
+    original = _use_temp_db()
+    try:
+        now = datetime.now()
+        due = (now - timedelta(seconds=1)).strftime(database.FIRE_TIME_FORMAT)
+        conn = database.get_connection()
+        conn.executemany("INSERT INTO reminders (user_id, reminder_type, title, reminder_time, repeat_type, next_fire_at) "
+                         "VALUES (2, '用药', ?, '08:00', ?, ?)",
+                         [("降压药", "daily", due), ("复查", "once", due), ("散步", "weekly", "2999-01-01 08:00:00")])
+        conn.commit()
+        assert database.add_reminder(2, "测量", "血压", "25:00")[0] is False
+
+        delivered = []
+        sched = scheduler.ReminderScheduler(lambda user_id, message: delivered.append(message))
+        sched.start()
+        for _ in range(50):
+            if len(delivered) == 2:
+                break
+            time.sleep(0.05)
+        sched.stop()
+        assert sorted(delivered) == ["⏰ 用药提醒：复查", "⏰ 用药提醒：降压药"]
+        rows = dict(conn.execute("SELECT title, next_fire_at FROM reminders WHERE is_active = 1").fetchall())
+        assert set(rows) == {"降压药", "散步"} and rows["降压药"] > now.strftime(database.FIRE_TIME_FORMAT)
+        assert len(database.get_user_notifications(2)) == 2
+        conn.close()
+        print("✅ 提醒按时触发，重复提醒已推进到下一次")
+    finally:
+        database.DB_FILE = original
+
+def test_goal_progress():
+    """测试目标进度随新增记录自动推进，以及夜间对账修正偏差"""
+    print("\n[测试] 目标进度...")
+    original = _use_temp_db()
+    try:
+        database.add_health_record(2, "2024-01-01", 72.0, 120, 80, 6000)
+        database.add_health_goal(2, "减肥", 65, 75, "2024-01-01", "2024-03-31")
+        database.add_health_goal(2, "每日步数", 50000, 0, "2024-01-01", "2024-01-31")
+        database.add_health_goal(2, "控制热量", 30000, 0, "2024-01-01", "2024-01-31")
+        database.add_health_record(2, "2024-01-05", 71.2, 118, 78, 8000)
+        database.add_health_record(2, "2024-01-03", 71.8, 119, 79, 7000)  # 补录的旧体重不覆盖新读数
+        database.add_health_record(2, "2024-02-10", 70.0, 117, 77, 9000)  # 超出步数目标期
+        database.add_diet_record(2, "2024-01-05", "午餐", "米饭", 650)
+        goals = {g["goal_type"]: g["current_value"] for g in database.get_user_goals(2)}
+        assert goals == {"减肥": 70.0, "每日步数": 21000, "控制热量": 650}, goals
+        assert database.reconcile_goals() == 0
+
+        conn = database.get_connection()
+        conn.execute("DELETE FROM health_data WHERE record_date = '2024-01-05'")
+        conn.commit()
+        conn.close()
+        assert database.reconcile_goals() == 1
+        goals = {g["goal_type"]: g["current_value"] for g in database.get_user_goals(2)}
+        assert goals["每日步数"] == 13000 and goals["减肥"] == 70.0
+        print("✅ 目标进度自动推进，对账修正删除记录造成的偏差")
+    finally:
+        database.DB_FILE = original
+
+def test_write_queue():
+    """测试写后台队列：分组提交，单条失败不影响同组其他写入"""
+    import writequeue
+    print("\n[测试] 写后台队列...")
+    original = _use_temp_db()
+    try:
+        writes = writequeue.WriteQueue(group_rows=50, group_ms=20)
+        writes.start()
+        futures = [writes.submit(database.insert_health_record, 2, "2024-01-01", 70.0, 120, 80, 5000)
+                   for _ in range(99)]
+        futures.append(writes.submit(database.insert_diet_record, 2, "2024-01-01"))  # 缺少参数
+        writes.stop()
+        assert all(f.result() == "记录添加成功" for f in futures[:-1])
+        assert futures[-1].exception() is not None
+        assert len(database.get_user_records(2)) == 99
+        assert writes.stats["committed"] == 99 and writes.stats["groups"] <= 3
+        assert writes.stats["db_seconds"] > 0  # 写线程上的数据库耗时单独汇总
+
+        # 写入破坏了事务（保存点已不存在）：整组失败，写线程继续处理之后的写入
+        def broken(conn, user_id):
+            conn.execute("ROLLBACK")
+            raise RuntimeError("broken")
+        writes = writequeue.WriteQueue(group_rows=50, group_ms=20)
+        writes.start()
+        assert writes.submit(broken, 2).exception(5) is not None
+        assert writes.submit(database.insert_health_record, 2, "2024-01-02", 70.0, 120, 80, 5000).result(5) == "记录添加成功"
+        writes.stop()
+
+        # 写线程迟迟未提交时，请求等待 WRITE_TIMEOUT 后回复 timeout
+        import server
+        saved = server.writes, server.WRITE_TIMEOUT
+        server.writes, server.WRITE_TIMEOUT = writequeue.WriteQueue(), 0.1  # 未启动写线程，写入一直排队
+        try:
+            token = server.sessions.issue({"id": 2, "username": "member2", "role": "user"})
+            response = server.execute({"action": "add_record", "token": token,
+                                       "payload": {"user_id": 2, "date": "2024-01-03"}})
+            assert response["code"] == "timeout", response
+        finally:
+            server.writes, server.WRITE_TIMEOUT = saved
+        print(f"✅ 100 条写入分 {writes.stats['groups']} 组提交，失败写入单独回滚")
+    finally:
+        database.DB_FILE = original
+
+def test_delete_user():
+    """测试删除用户：外键级联删除与分批清除"""
+    print("\n[测试] 删除用户...")
+    original = _use_temp_db()
+    try:
+        for i in range(5):
+            database.add_health_record(2, f"2024-01-0{i + 1}", 70.0, 120, 80, 5000, notes="血压偏高")
+            database.add_health_record(3, f"2024-01-0{i + 1}", 70.0, 120, 80, 5000)
+        database.add_diet_record(2, "2024-01-01", "午餐", "米饭", 600)
+        database.send_notification(2, "hello")
+        assert database.add_medication(99, "不存在的用户", "1片", "每日", "2024-01-01")[0] is False
+
+        assert database.delete_user(3)[0] is True
+        assert database.get_user_records(3) == []
+        success, msg = database.purge_user(2, chunk=2, pause=0)
+        assert success and "7" in msg, msg
+        assert database.get_user_records(2) == [] and database.search_history(2, "血压偏高") == []
+        assert database.get_user_profile(2) is None
+        print("✅ 用户数据级联删除，分批清除完成")
+    finally:
+        database.DB_FILE = original
+
+def test_migrations():
+    """测试版本化结构迁移：新增列、索引、分批重建表与试运行估算"""
+    import migrations
+    print("\n[测试] 结构迁移...")
+    original = _use_temp_db()
+    try:
+        for i in range(30):
+            database.add_diet_record(2, "2024-01-01", "午餐", f"第{i}餐 少盐", 500 + i)
+        plan = [
+            migrations.Migration(101, "饮食记录来源", [migrations.AddColumn('diet_records', 'source', "TEXT DEFAULT 'app'")]),
+            migrations.Migration(102, "饮食记录重建", [migrations.RebuildTable('diet_records', """
+                CREATE TABLE {name} (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER REFERENCES users (id) ON DELETE CASCADE,
+                    record_date TEXT NOT NULL,
+                    meal_type TEXT,
+                    food_description TEXT,
+                    calories INTEGER CHECK (calories >= 0),
+                    source TEXT DEFAULT 'app'
+                )""", batch=7, pause=0)]),
+            migrations.Migration(103, "按热量索引", [migrations.CreateIndex('idx_diet_calories', 'diet_records', 'calories')],
+                                 background=True),
+        ]
+        estimate = migrations.dry_run(migrations=plan)
+        assert [m["version"] for m in estimate] == [101, 102, 103] and estimate[1]["steps"][0]["rows"] == 30
+        assert migrations.migrate(migrations=plan, foreground_only=True) == [101, 102]
+        assert migrations.migrate(migrations=plan) == [103] and migrations.migrate(migrations=plan) == []
+
+        records = database.get_user_diet_records(2)
+        assert len(records) == 30 and records[0]["calories"] >= 500
+        assert len(database.search_history(2, "少盐", limit=50)) == 30  # 重建后历史检索触发器仍然生效
+        database.add_diet_record(2, "2024-01-02", "晚餐", "新记录 少盐", 300)
+        assert len(database.search_history(2, "少盐", limit=50)) == 31
+        assert database.add_diet_record(2, "2024-01-02", "晚餐", "负热量", -1)[0] is False
+        print("✅ 迁移按版本应用，重建表保留数据、索引与触发器")
+    finally:
+        database.DB_FILE = original
+
+def test_schema_upgrade():
+    """测试旧库升级：试运行只读不改库，迁移补齐新增列、级联外键、索引与检索数据"""
+    import hashlib
+    import migrations
+    print("\n[测试] 旧库结构升级...")
+    original = database.DB_FILE
+    database.DB_FILE = os.path.join(tempfile.mkdtemp(), 'old.db')
+    try:
+        # 升级前的表结构：子表外键不带级联，reminders 没有 next_fire_at，health_goals 没有 progress_date
+        conn = sqlite3.connect(database.DB_FILE)
+        conn.executescript("""
+            CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL,
+                password TEXT NOT NULL, role TEXT NOT NULL, age INTEGER, gender TEXT, height REAL,
+                blood_type TEXT, emergency_contact TEXT, allergies TEXT, chronic_diseases TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP);
+            CREATE TABLE health_data (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, record_date TEXT,
+                weight REAL, systolic_bp INTEGER, diastolic_bp INTEGER, steps INTEGER, heart_rate INTEGER,
+                blood_sugar REAL, temperature REAL, sleep_hours REAL, water_intake INTEGER, notes TEXT,
+                FOREIGN KEY (user_id) REFERENCES users (id));
+            CREATE TABLE reminders (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, reminder_type TEXT,
+                title TEXT, reminder_time TEXT, repeat_type TEXT, is_active INTEGER DEFAULT 1,
+                FOREIGN KEY (user_id) REFERENCES users (id));
+            CREATE TABLE health_goals (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, goal_type TEXT,
+                target_value REAL, current_value REAL, start_date TEXT, end_date TEXT, status TEXT DEFAULT 'active',
+                FOREIGN KEY (user_id) REFERENCES users (id));
+            INSERT INTO users (id, username, password, role, allergies) VALUES (5, 'olduser', 'x', 'user', '青霉素过敏');
+            INSERT INTO health_data (user_id, record_date, notes) VALUES (5, '2024-01-01', '旧记录 头晕乏力');
+            INSERT INTO reminders (user_id, title, reminder_time, repeat_type) VALUES (5, '吃药', '08:00', 'daily');
+            INSERT INTO health_goals (user_id, goal_type, target_value, current_value) VALUES (5, 'steps', 1, 0);
+        """)
+        conn.close()
+        database.init_db()
+        with open(database.DB_FILE, 'rb') as f:
+            digest = hashlib.md5(f.read()).hexdigest()
+
+        plan = migrations.dry_run()
+        assert [m["version"] for m in plan] == [v.version for v in migrations.MIGRATIONS]
+        with open(database.DB_FILE, 'rb') as f:
+            assert hashlib.md5(f.read()).hexdigest() == digest  # 试运行不修改库文件
+
+        assert migrations.migrate(foreground_only=True) == [2, 3, 4, 5, 6]
+        assert migrations.migrate() == [1, 7] and migrations.dry_run() == []
+        conn = database.get_connection()
+        assert conn.execute("SELECT next_fire_at FROM reminders").fetchone()[0] is not None
+        assert 'progress_date' in [row[1] for row in conn.execute("PRAGMA table_info(health_goals)")]
+        indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+        assert {'idx_reminders_due', 'idx_health_data_user', 'idx_notifications_user', 'idx_users_created'} <= indexes
+        conn.close()
+        assert len(database.search_history(5, "头晕乏力")) == 1
+        assert [u["username"] for u in database.search_users("青霉素")] == ["olduser"]
+        assert database.delete_user(5)[0] is True  # 外键已改为级联删除
+        conn = database.get_connection()
+        assert conn.execute("SELECT count(*) FROM health_data").fetchone()[0] == 0
+        conn.close()
+        print("✅ 旧库经迁移升级，试运行不修改库文件")
+    finally:
+        database.DB_FILE = original
+
+def test_archive():
+    """测试冷热分层：旧记录按年份归档，查询按日期范围路由，统计与删除覆盖归档数据"""
+    print("\n[测试] 健康记录归档...")
+    original = _use_temp_db()
+    try:
+        for day in ("2022-03-01", "2022-11-20", "2023-06-15", "2024-12-30", "2025-01-02"):
+            database.add_health_record(2, day, 70.0, 120, 80, 5000, notes=f"{day} 头晕")
+        database.add_health_record(3, "2022-05-05", 60.0, 110, 70, 3000)
+        before = database.get_all_stats()
+
+        assert database.archive_health_data(before="2024-01-01", batch=2, pause=0) == 4
+        assert [y for y, _ in database.archive_segments()] == [2022, 2023]
+        conn = database.get_connection()
+        assert conn.execute("SELECT count(*) FROM health_data").fetchone()[0] == 2
+        conn.close()
+
+        assert [r["record_date"] for r in database.get_user_records(2)] == [
+            "2022-03-01", "2022-11-20", "2023-06-15", "2024-12-30", "2025-01-02"]
+        assert len(database.get_user_records(2, start_date="2024-06-01")) == 2
+        assert [r["record_date"] for r in database.get_user_records(2, ["record_date"], start_date="2022-06-01",
+                                                                    end_date="2023-12-31")] == ["2022-11-20", "2023-06-15"]
+        assert database.get_all_stats() == before
+        assert len(database.search_history(2, "头晕")) == 5  # 归档记录仍可检索
+
+        # 两次提交之间中断：归档库已有副本、热库仍有原行；统计不重复计入，再次归档覆盖副本后删除原行
+        database.add_health_record(3, "2022-08-08", 61.0, 110, 70, 3000)
+        conn = database.get_connection()
+        conn.execute("ATTACH DATABASE ? AS arc", (database.archive_path(2022, 0),))
+        conn.execute("INSERT INTO arc.health_data SELECT * FROM main.health_data WHERE record_date = '2022-08-08'")
+        conn.commit()
+        conn.execute("DETACH DATABASE arc")
+        conn.close()
+        assert database.get_all_stats()["total_records"] == before["total_records"] + 1
+        assert database.archive_health_data(before="2024-01-01", pause=0) == 1
+        assert [r["record_date"] for r in database.get_user_records(3)] == ["2022-05-05", "2022-08-08"]
+        assert database.get_all_stats()["total_records"] == before["total_records"] + 1
+
+        assert database.delete_user(2)[0] is True
+        assert database.get_user_records(2) == [] and database.search_history(2, "头晕") == []
+        assert database.get_all_stats()["total_records"] == 2
+
+        # 一批的 id 超过 999 个：把每条语句的参数个数限制为 999，归档与分块清理仍能完成
+        connect = database.connect
+        def limited(path):
+            conn = connect(path)
+            conn.setlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+            return conn
+        database.connect = limited
+        try:
+            conn = database.get_connection()
+            conn.executemany("INSERT INTO health_data (user_id, record_date, weight) VALUES (3, ?, 60.0)",
+                             [(f"2021-{m:02d}-{d:02d}",) for m in range(1, 13) for d in range(1, 29)] * 5)
+            conn.commit()
+            conn.close()
+            assert database.archive_health_data(before="2022-01-01", pause=0) == 1680
+            assert len(database.get_user_records(3)) == 1682
+            assert database.get_all_stats()["total_records"] == 1682
+            assert database.purge_user(3, chunk=1200, pause=0)[0] is True
+            assert database.get_all_stats()["total_records"] == 0
+        finally:
+            database.connect = connect
+        print("✅ 旧记录已归档，范围查询、统计与删除均覆盖归档库")
+    finally:
+        database.DB_FILE = original
+
+def test_shards():
+    """测试分片：按 user_id 路由到分片库，跨分片统计汇总，删除用户同时清理目录库"""
+    import writequeue
+    print("\n[测试] 分片...")
+    original, shards = database.DB_FILE, database.SHARDS
+    database.DB_FILE = os.path.join(tempfile.mkdtemp(), 'test.db')
+    database.SHARDS = 3
+    try:
+        database.init_db()
+        for i in range(4):
+            assert database.register_user(f"tenant{i}", "123456", 30, "女")[0]
+        ids = sorted(u["id"] for u in database.get_all_users())
+        writes = writequeue.WriteQueue()
+        writes.start()
+        futures = [writes.submit(database.insert_health_record, uid, "2024-01-01", 60.0, 120, 80, 5000)
+                   for uid in ids]
+        writes.stop()
+        assert all(f.result() == "记录添加成功" for f in futures)
+        for uid in ids:
+            database.add_health_record(uid, "2024-01-02", 62.0, 120, 80, 5000, notes="晨练后头晕")
+            assert len(database.get_user_records(uid)) == 2
+            assert len(database.search_history(uid, "头晕")) == 1
+            conn = database.get_connection(uid)
+            assert conn.execute("SELECT count(DISTINCT user_id) FROM health_data").fetchone()[0] == \
+                sum(1 for other in ids if database.shard_of(other) == database.shard_of(uid))
+            conn.close()
+        assert database.get_all_stats() == {"user_count": 4, "avg_weight": 61.0, "total_records": 8}
+        assert database.delete_user(ids[0])[0] and database.purge_user(ids[1], pause=0)[0]
+        assert sorted(u["id"] for u in database.get_all_users()) == ids[2:]
+        assert database.get_all_stats()["total_records"] == 4
+        database.SHARDS = 2
+        try:
+            database.init_db()
+            assert False, "分片数变化应拒绝启动"
+        except RuntimeError:
+            pass
+        print("✅ 各用户数据落在各自分片，统计与删除跨分片一致")
+    finally:
+        database.DB_FILE, database.SHARDS = original, shards
+
+def test_backup():
+    """测试在线备份：快照、校验、保留个数与恢复"""
+    import backup
+    print("\n[测试] 在线备份...")
+    original = _use_temp_db()
+    try:
+        for i in range(3):
+            database.add_health_record(2, f"2024-01-0{i + 1}", 70.0, 120, 80, 5000)
+        first = backup.snapshot(pause=0)
+        assert backup.verify(first) == (True, [])
+        database.add_health_record(2, "2024-02-01", 71.0, 120, 80, 5000)
+        backup.snapshot(pause=0, keep=2)
+        backup.snapshot(pause=0, keep=2)
+        assert len(backup.list_snapshots()) == 2 and first not in backup.list_snapshots()
+
+        name = backup.list_snapshots()[0]
+        with open(os.path.join(backup.backup_root(), name, os.path.basename(database.DB_FILE)), 'r+b') as f:
+            f.seek(4096 * 3)
+            f.write(b'\xff' * 64)  # 损坏快照中的一页
+        assert not backup.verify(name)[0]
+
+        latest = backup.list_snapshots()[-1]
+        database.add_health_record(2, "2024-03-01", 72.0, 120, 80, 5000)
+        before = backup.restore(latest)
+        assert len(database.get_user_records(2)) == 4 and before in backup.list_snapshots()
+        print(f"✅ 快照可校验、按保留个数清理，恢复后回到 {latest} 的数据")
+    finally:
+        database.DB_FILE = original
+
+def test_result_cache():
+    """测试结果缓存：命中、写入后精确失效、LRU 淘汰"""
+    print("\n[测试] 结果缓存...")
+    original = _use_temp_db()
+    size, ttl = database.RESULT_CACHE_SIZE, database.RESULT_CACHE_TTL
+    try:
+        database.add_medication(2, "阿司匹林", "100mg", "每日一次", "2024-01-01")
+        database.get_user_medications(2)
+        database.get_user_goals(3)
+        hits = database.results.stats["hits"]
+        assert len(database.get_user_medications(2)) == 1 and database.results.stats["hits"] == hits + 1
+
+        med_id = database.get_user_medications(2)[0]["id"]
+        database.delete_medication(med_id)  # 未传 user_id 也能按记录找到所属用户
+        assert database.get_user_medications(2) == []
+        database.update_user_profile(2, height=175)
+        assert database.get_user_profile(2)["height"] == 175
+        misses = database.results.stats["misses"]
+        database.get_user_goals(3)  # 用户 2 的写入不影响用户 3 的缓存
+        assert database.results.stats["misses"] == misses
+
+        # 字符串与整数形式的 user_id 共用同一组缓存，失效时一并清除
+        hits = database.results.stats["hits"]
+        assert database.get_user_profile("2")["height"] == 175 and database.results.stats["hits"] == hits + 1
+        database.update_user_profile("2", height=180)
+        assert database.get_user_profile(2)["height"] == 180
+
+        # 服务进程之外的写入不触发失效，条目过期后读到新数据
+        database.RESULT_CACHE_TTL = 0.2
+        database.get_user_profile(3)
+        conn = sqlite3.connect(database.DB_FILE)
+        conn.execute("UPDATE users SET height = 160 WHERE id = 3")
+        conn.commit()
+        conn.close()
+        assert database.get_user_profile(3)["height"] is None
+        time.sleep(0.3)
+        assert database.get_user_profile(3)["height"] == 160
+
+        database.RESULT_CACHE_SIZE = 2
+        for kind in ("medications", "goals", "reminders"):
+            getattr(database, f"get_user_{kind}")(2)
+        assert database.results.snapshot()["entries"] == 2 and database.results.stats["evictions"] == 1
+        # 版本表不随写入过的用户数无限增长
+        database.results.invalidate([(user_id, None) for user_id in range(100, 110)])
+        assert len(database.results._versions) <= database.RESULT_CACHE_SIZE
+        print(f"✅ 命中与失效正确，统计: {database.results.snapshot()}")
+    finally:
+        database.RESULT_CACHE_SIZE = size
+        database.RESULT_CACHE_TTL = ttl
+        database.DB_FILE = original
+
+def test_replica():
+    """测试分析查询只读连接池：不能写入，超时中断后连接可继续使用"""
+    print("\n[测试] 只读分析连接...")
+    original = _use_temp_db()
+    timeout = database.ANALYTICS_TIMEOUT
+    try:
+        database.add_health_record(2, "2024-01-01", 70.0, 120, 80, 5000)
+        assert database.get_all_stats()["total_records"] == 1
+        with database.replica() as conn:
+            try:
+                conn.execute("DELETE FROM users")
+                assert False, "只读连接不应允许写入"
+            except sqlite3.OperationalError:
+                pass
+
+        database.ANALYTICS_TIMEOUT = 0.05
+        started = time.perf_counter()
+        try:
+            with database.replica() as conn:
+                conn.execute("WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c) "
+                             "SELECT count(*) FROM c").fetchone()
+            assert False, "失控查询应被中断"
+        except database.QueryTimeout:
+            pass
+        assert time.perf_counter() - started < 1
+        assert len(database.get_all_users()) == 2
+        print("✅ 只读连接拒绝写入，失控查询按时中断")
+    finally:
+        database.ANALYTICS_TIMEOUT = timeout
+        database.DB_FILE = original
+
+def test_slow_query():
+    """测试慢查询日志：超过阈值的语句连同参数形态与执行计划落盘，summarize 按语句汇总"""
+    import slowlog
+    print("\n[测试] 慢查询日志...")
+    original = _use_temp_db()
+    saved = database.SLOW_QUERY_MS, slowlog.LOG_FILE
+    database.SLOW_QUERY_MS = 50
+    slowlog.LOG_FILE = os.path.join(tempfile.mkdtemp(), 'slow.log')
+    slowlog._logger = None
+    try:
+        conn = database.get_connection()
+        conn.create_function("pause", 1, lambda seconds: time.sleep(seconds) or seconds)
+        scan = "SELECT * FROM users WHERE pause(?) >= 0"
+        for _ in range(2):
+            rows = conn.execute(scan, (0.03,)).fetchall()  # 逐行执行，取数完成后才超过阈值
+        assert len(rows) >= 2
+        conn.execute("SELECT pause(?), username FROM users WHERE id = ?", (0.06, 2)).fetchone()
+        conn.execute("SELECT username FROM users WHERE id = ?", (2,)).fetchall()  # 未超过阈值
+        conn.close()
+
+        entries = slowlog.load(slowlog.LOG_FILE)
+        assert len(entries) == 3, entries
+        assert entries[0]["sql"] == scan and entries[0]["params"] == ["float"] and entries[0]["ms"] >= 50
+        assert entries[2]["params"] == ["float", "int"]
+        assert any(line.strip().startswith("SCAN users") for line in entries[0]["plan"])
+
+        top = slowlog.summarize(entries)
+        assert [g["count"] for g in top] == [2, 1] and top[0]["sql"] == scan
+        assert top[0]["total_ms"] == round(entries[0]["ms"] + entries[1]["ms"], 2)
+        assert top[0]["max_ms"] == max(entries[0]["ms"], entries[1]["ms"])
+        assert abs(top[0]["avg_ms"] - top[0]["total_ms"] / 2) <= 0.01  # 两者各自取整
+        assert top[0]["full_scan"] and not top[1]["full_scan"]
+        assert slowlog.summarize(entries, top=1, sort='count') == top[:1]
+
+        # 直接迭代游标取数同样计时，取完后判断是否记录
+        conn = database.get_connection()
+        conn.create_function("pause", 1, lambda seconds: time.sleep(seconds) or seconds)
+        streamed = "SELECT id FROM users WHERE pause(?) >= 0"
+        assert len([row for row in conn.execute(streamed, (0.03,))]) >= 2
+        conn.close()
+        entries = slowlog.load(slowlog.LOG_FILE)
+        assert len(entries) == 4 and entries[3]["sql"] == streamed and entries[3]["ms"] >= 50
+        print(f"✅ 慢查询记录 {len(entries)} 条，汇总 {len(top)} 条语句")
+    finally:
+        if slowlog._logger is not None:
+            for handler in list(slowlog._logger.handlers):
+                slowlog._logger.removeHandler(handler)
+                handler.close()
+            slowlog._logger = None
+        database.SLOW_QUERY_MS, slowlog.LOG_FILE = saved
+        database.DB_FILE = original
+
+def test_session():
+    """测试会话令牌签发、校验与过期"""
+    import session
+    print("\n[测试] 会话令牌...")
+    manager = session.SessionManager(ttl=60)
+    token = manager.issue({"id": 7, "username": "testuser", "role": "user"})
+    assert manager.validate(token)["id"] == 7
+    assert manager.validate("bogus") is None
+    manager.ttl = -1
+    manager.validate(token)  # 顺延后立即过期
+    assert manager.validate(token) is None
+    assert manager.count() == 0
+    print("✅ 会话令牌校验正常")
+
+def test_password_upgrade():
+    """测试旧版 SHA-256 密码在登录时透明升级"""
+    import hashlib
+    import passwords
+    print("\n[测试] 密码哈希升级...")
+    original = _use_temp_db()
+    try:
+        conn = database.get_connection()
+        conn.execute("INSERT INTO users (username, password, role) VALUES (?, ?, 'user')",
+                     ("legacy", hashlib.sha256("123456".encode()).hexdigest()))
+        conn.commit()
+        conn.close()
+
+        assert database.login_user("legacy", "123456")[0]
+        conn = database.get_connection()
+        stored = conn.execute("SELECT password FROM users WHERE username = 'legacy'").fetchone()[0]
+        conn.close()
+        assert stored.startswith(passwords.HASH_SCHEME + '$')
+        passwords.credential_cache.forget("legacy")
+        assert database.login_user("legacy", "123456")[0]
+        assert not database.login_user("legacy", "wrong")[0]
+        print("✅ 旧密码已升级为加盐哈希")
+    finally:
+        database.DB_FILE = original
+
+def test_kdf_limit():
+    """测试 KDF 并发上限，以及主模块导入时没有副作用（KDF 子进程会重新导入主模块）"""
+    import subprocess
+    import sys
+    import passwords
+    import server
+    print("\n[测试] 密码运算并发上限...")
+    original = _use_temp_db()
+    pending = passwords.KDF_MAX_PENDING
+    try:
+        passwords.KDF_MAX_PENDING = 1
+        passwords.hash_password("warmup")
+        passwords._slots[1].acquire()  # 占满唯一的名额
+        try:
+            response = server.execute({"action": "login", "id": 7,
+                                       "payload": {"username": "admin", "password": "123456"}})
+            assert response["code"] == "busy" and response["id"] == 7, response
+        finally:
+            passwords._slots[1].release()
+        assert server.execute({"action": "login", "payload": {"username": "admin", "password": "123456"}})[
+            "status"] == "success"
+
+        # KDF 子进程会以 __mp_main__ 导入 server.py / supervisor.py，导入时不能启动线程
+        code = (f"import sys, threading; sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r})\n"
+                "import server, supervisor\n"
+                "print(threading.active_count())\n")
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, timeout=60).stdout
+        assert output.strip() == '1', output
+        print("✅ 超出上限的登录被快速拒绝，主模块导入时不启动线程")
+    finally:
+        passwords.KDF_MAX_PENDING = pending
+        database.DB_FILE = original
+
+def test_columnar_codec():
+    """测试二进制列式编码的往返一致性"""
+    import protocol
+    print("\n[测试] 列式线路编码...")
+    rows = [{"id": i, "record_date": f"2024-01-{i % 28 + 1:02d}", "weight": 70.5 + i / 10,
+             "steps": None if i % 5 == 0 else i * 100, "meal_type": "早餐" if i % 2 else "午餐",
+             "temperature": 36.55, "notes": None} for i in range(200)]
+    conn = protocol.Connection(None, protocol.get_serializer())
+    conn.upgrade('columnar')
+    flags, body = conn.encode({"status": "success", "data": rows})
+    assert flags & protocol.FLAG_COLUMNAR
+    assert conn.decode(flags, body) == {"status": "success", "data": rows}
+    json_size = len(protocol.get_serializer().dumps(rows))
+    print(f"✅ 列式编码往返一致，体积 {len(body)} 字节（JSON {json_size} 字节）")
+
+    conn.upgrade('columnar', 'zlib')
+    flags, packed = conn.encode({"status": "success", "data": rows})
+    assert flags & protocol.FLAG_COMPRESSED and len(packed) < len(body)
+    assert conn.decode(flags, packed)["data"] == rows
+    print(f"✅ 压缩后 {len(packed)} 字节，压缩比 {conn.compression_ratio()}")
+
+def test_request_pool():
+    """测试请求执行器的优先级调度与过载拒绝"""
+    import threading
+    import workpool
+    print("\n[测试] 请求执行器...")
+    pool = workpool.RequestPool(1, 4)
+    gate = threading.Event()
+    order = []
+    pool.submit(workpool.PRIORITY_NORMAL, gate.wait)  # 占住唯一的工作线程
+    time.sleep(0.05)
+    low = pool.submit(workpool.priority_of("get_all_users"), order.append, "search")
+    pool.submit(workpool.priority_of("get_all_users"), order.append, "search")
+    # 低优先级只能占用一半队列，此时已被拒绝；登录仍可排队且先于检索执行
+    assert pool.submit(workpool.priority_of("get_all_users"), order.append, "search") is None
+    login = pool.submit(workpool.priority_of("login"), order.append, "login")
+    gate.set()
+    login.result(1)
+    low.result(1)
+    assert order[0] == "login"
+    stats = pool.snapshot()
+    assert stats["rejected"] == 1 and stats["max_depth"] == 3
+    print(f"✅ 高优先级先执行，过载时拒绝 {stats['rejected']} 个低优先级请求")
+
+def test_metrics():
+    """测试按接口的延迟直方图与文本导出"""
+    import metrics
+    print("\n[测试] 接口指标...")
+    m = metrics.Metrics()
+    for seconds in (0.0005, 0.003, 0.003, 0.2):
+        m.observe("get_records", seconds, bytes_in=50, bytes_out=500, db_seconds=seconds / 2)
+    m.observe("get_records", 0.001, error=True)
+    snap = m.snapshot()["get_records"]
+    assert snap["count"] == 5 and snap["errors"] == 1 and snap["bytes_out"] == 2000
+    assert snap["p50_ms"] == 5.0 and snap["p99_ms"] == 250.0
+    text = m.render({"queue_depth": 0})
+    assert 'healthguard_request_seconds_bucket{action="get_records",le="+Inf"} 5' in text
+    assert "# TYPE healthguard_queue_depth gauge" in text
+
+    # 服务端导出：*_total 为计数器；执行器未启动时不导出队列指标；写线程的数据库耗时单独汇总
+    import server
+    import writequeue
+    saved = server.pool, server.writes
+    server.pool, server.writes = None, writequeue.WriteQueue()
+    try:
+        server.writes.stats["db_seconds"] = 0.25
+        text = server.render_metrics()
+        assert "# TYPE healthguard_result_cache_hits_total counter" in text and "healthguard_queue_depth" not in text
+        assert "healthguard_write_queue_db_seconds_total 0.250000" in text
+    finally:
+        server.pool, server.writes = saved
+    print(f"✅ 指标统计正常: p50 {snap['p50_ms']} ms, p99 {snap['p99_ms']} ms")
+
+def _login(username, password):
+    import server
+    response = server.dispatch({"action": "login", "payload": {"username": username, "password": password}})
+    assert response["status"] == "success", response
+    return response["data"]["token"]
+
+def test_record_ownership():
+    """测试按 id 删改记录时只能操作自己的记录"""
+    import server
+    print("\n[测试] 记录归属校验...")
+    original = _use_temp_db()
+    try:
+        database.register_user("alice", "alice123", 30, "女")
+        database.register_user("bob", "bob12345", 30, "男")
+        alice, bob = _login("alice", "alice123"), _login("bob", "bob12345")
+        alice_id = database.login_user("alice", "alice123")[1]["id"]
+        database.add_medication(alice_id, "阿司匹林", "100mg", "每日一次", "2024-01-01")
+        database.add_health_goal(alice_id, "每日步数", 10000, 0, "2024-01-01", "2024-12-31")
+        database.send_notification(alice_id, "复诊提醒")
+        med_id = database.get_user_medications(alice_id)[0]["id"]
+        goal_id = database.get_user_goals(alice_id)[0]["id"]
+        notif_id = database.get_user_notifications(alice_id)[0]["id"]
+
+        def call(token, action, **payload):
+            return server.dispatch({"action": action, "token": token, "payload": payload})
+
+        # 伪造他人的 user_id 也会被换成会话用户
+        for token in (bob, alice):
+            expected = "success" if token == alice else "error"
+            assert call(token, "update_goal_progress", goal_id=goal_id, current_value=500,
+                        user_id=alice_id)["status"] == expected
+            assert call(token, "mark_read", notif_id=notif_id, user_id=alice_id)["status"] == expected
+            assert call(token, "delete_medication", med_id=med_id, user_id=alice_id)["status"] == expected
+            if token == bob:
+                assert len(database.get_user_medications(alice_id)) == 1
+                assert database.get_user_goals(alice_id)[0]["current_value"] == 0
+                assert len(database.get_user_notifications(alice_id)) == 1
+        assert database.get_user_medications(alice_id) == [] and database.get_user_notifications(alice_id) == []
+        assert call(alice, "delete_medication", med_id=med_id)["status"] == "error"  # 已删除的记录
+        print("✅ 他人的记录无法删改，本人操作正常")
+    finally:
+        database.DB_FILE = original
+
+def _serve_connection():
+    """在回环 TCP 连接上运行 server.handle_client，返回已协商分帧协议的客户端 protocol.Connection"""
+    import socket
+    import threading
+    import protocol
+    import server
+    if server.pool is None:
+        server.start_pool()
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    client_sock = socket.create_connection(listener.getsockname())
+    server_sock, addr = listener.accept()
+    listener.close()
+    client = server.registry.register(server_sock, addr)
+    threading.Thread(target=server.handle_client, args=(server_sock, addr, client), daemon=True).start()
+    client_sock.settimeout(5)
+    conn = protocol.Connection(client_sock, protocol.get_serializer())
+    conn.send({"action": "hello", "payload": {"codecs": ["json"]}})
+    response = conn.recv()
+    conn.upgrade(response["data"]["codec"], response["data"]["compression"])
+    return conn
+
+def test_dispatch():
+    """测试请求分发：流水线 id 回带、乱序返回、batch，以及会话对 user_id 的校验"""
+    import threading
+    print("\n[测试] 请求分发...")
+    original = _use_temp_db()
+    conn = None
+    get_profile = database.get_user_profile
+    try:
+        database.register_user("alice", "alice123", 30, "女")
+        database.register_user("bob", "bob12345", 30, "男")
+        alice_id = database.login_user("alice", "alice123")[1]["id"]
+        conn = _serve_connection()
+        conn.send({"action": "login", "payload": {"username": "bob", "password": "bob12345"}})
+        bob = conn.recv()["data"]
+        token = bob["token"]
+
+        # 普通用户传入他人的 user_id 时以会话为准；未登录与越权接口被拒绝
+        conn.send({"action": "get_profile", "token": token, "payload": {"user_id": alice_id}})
+        assert conn.recv()["data"]["username"] == "bob"
+        conn.send({"action": "get_profile", "payload": {"user_id": alice_id}})
+        assert conn.recv()["code"] == "auth_required"
+        conn.send({"action": "get_all_users", "token": token, "payload": {}})
+        assert conn.recv()["code"] == "forbidden"
+        for columns in ("username", ["username", ["age"]], {"username": 1}):
+            for action in ("get_profile", "get_records"):
+                conn.send({"action": action, "token": token, "payload": {"columns": columns}})
+                assert conn.recv() == {"status": "error", "message": "columns 须为列名列表"}
+        conn.send({"action": "get_profile", "token": token, "payload": {"columns": ["username"]}})
+        assert conn.recv()["data"] == {"username": "bob"}
+
+        # 流水线：先发的请求被阻塞，后发的先返回，响应带回各自的 id
+        gate = threading.Event()
+        database.get_user_profile = lambda *args: gate.wait(5) and get_profile(*args)
+        conn.send({"action": "get_profile", "id": 1, "token": token, "payload": {}})
+        conn.send({"action": "get_goals", "id": 2, "token": token, "payload": {}})
+        first = conn.recv()
+        gate.set()
+        second = conn.recv()
+        assert (first["id"], second["id"]) == (2, 1) and second["data"]["username"] == "bob"
+        database.get_user_profile = get_profile
+        responses = conn.pipeline([{"action": "get_goals", "token": token, "payload": {}},
+                                   {"action": "get_profile", "token": token, "payload": {}}])
+        assert responses[1]["data"]["id"] == bob["id"]
+
+        # batch：按顺序执行，禁止嵌套，子请求同样经过会话校验
+        conn.send({"action": "batch", "id": 9, "token": token, "payload": {"requests": [
+            {"action": "get_profile", "payload": {"user_id": alice_id}},
+            {"action": "batch", "payload": {}},
+            {"action": "get_all_users", "payload": {}},
+        ]}})
+        response = conn.recv()
+        assert response["id"] == 9
+        results = response["data"]
+        assert results[0]["data"]["username"] == "bob"
+        assert results[1]["status"] == "error" and results[2]["code"] == "forbidden"
+        print("✅ 流水线乱序返回、batch 与会话校验正常")
+    finally:
+        database.get_user_profile = get_profile
+        if conn is not None:
+            conn.sock.close()
+        database.DB_FILE = original
+
+def _wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "等待超时"
+        time.sleep(0.01)
+
+def test_connections():
+    """测试连接数上限、按用户强制断开与空闲超时回收"""
+    import connections
+    import protocol
+    import server
+    import socket
+    import threading
+    print("\n[测试] 连接管理...")
+    original = _use_temp_db()
+    saved = server.registry, server.MAX_CONNECTIONS, server.IDLE_TIMEOUT
+    get_profile = database.get_user_profile
+    server.registry = connections.ConnectionRegistry()
+    server.MAX_CONNECTIONS = 2
+    if server.pool is None:
+        server.start_pool()
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(8)
+    threading.Thread(target=server.serve, args=(listener,), daemon=True).start()
+    opened = []
+
+    def connect():
+        sock = socket.create_connection(listener.getsockname(), timeout=5)
+        opened.append(sock)
+        return protocol.Connection(sock, protocol.get_serializer(server.SERIALIZER))
+
+    try:
+        database.register_user("bob", "bob12345", 30, "男")
+        bob_id = database.login_user("bob", "bob12345")[1]["id"]
+        admin, bob = connect(), connect()
+        _wait_until(lambda: server.registry.count() == 2)
+
+        # 达到上限后新连接收到 busy 并被关闭，不占用登记表
+        extra = connect()
+        assert extra.recv()["code"] == "busy" and extra.recv() is None
+        assert server.registry.count() == 2
+
+        bob.send({"action": "login", "payload": {"username": "bob", "password": "bob12345"}})
+        assert bob.recv()["status"] == "success"
+        admin.send({"action": "login", "payload": {"username": "admin", "password": "123456"}})
+        token = admin.recv()["data"]["token"]
+        admin.send({"action": "list_connections", "token": token, "payload": {}})
+        assert {c["username"] for c in admin.recv()["data"]} == {"admin", "bob"}
+
+        # 按用户断开：bob 的连接被关闭，管理员连接不受影响
+        admin.send({"action": "evict_connection", "token": token, "payload": {"user_id": bob_id}})
+        assert admin.recv()["message"] == "已断开 1 个连接"
+        assert bob.recv() is None
+        _wait_until(lambda: server.registry.count() == 1)
+        admin.send({"action": "ping"})
+        assert admin.recv()["status"] == "success"
+
+        # 空闲超时：连接在 IDLE_TIMEOUT 后被服务端关闭并注销
+        server.IDLE_TIMEOUT = 0.3
+        idle = connect()
+        _wait_until(lambda: server.registry.count() == 2)
+        assert idle.recv() is None
+        _wait_until(lambda: server.registry.count() == 1)
+
+        # 流水线请求执行超过 IDLE_TIMEOUT 时不算空闲，回复后再空闲 IDLE_TIMEOUT 才断开
+        slow = connect()
+        slow.send({"action": "hello", "payload": {"codecs": ["json"]}})
+        hello = slow.recv()["data"]
+        slow.upgrade(hello["codec"], hello["compression"])
+        token = server.sessions.issue({"id": bob_id, "username": "bob", "role": "user"})
+        database.get_user_profile = lambda *args: time.sleep(1) or get_profile(*args)
+        slow.send({"action": "get_profile", "id": 1, "token": token, "payload": {}})
+        assert slow.recv()["data"]["username"] == "bob"
+        replied = time.monotonic()
+        assert slow.recv() is None and time.monotonic() - replied >= 0.25
+        _wait_until(lambda: server.registry.count() == 1)
+
+        # 按空闲秒数断开
+        assert server.registry.evict(idle=60) == 0
+        assert server.registry.evict(idle=0) == 1 and admin.recv() is None
+        print("✅ 连接上限、按用户断开与空闲回收正常")
+    finally:
+        listener.shutdown(socket.SHUT_RDWR)
+        listener.close()
+        for sock in opened:
+            sock.close()
+        server.registry, server.MAX_CONNECTIONS, server.IDLE_TIMEOUT = saved
+        database.get_user_profile = get_profile
+        database.DB_FILE = original
+
+def _start_supervisor(workers=1):
+    """在子进程中以多进程模式启动服务（临时数据库、随机端口），返回 (进程, 端口, 数据库路径)"""
+    import socket
+    import subprocess
+    import sys
+    probe = socket.socket()
+    probe.bind(('127.0.0.1', 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    db_file = os.path.join(tempfile.mkdtemp(), 'test.db')
+    code = (f"import sys; sys.path.insert(0, {os.path.dirname(os.path.abspath(__file__))!r})\n"
+            f"import database, server, supervisor\n"
+            f"database.DB_FILE = {db_file!r}\n"
+            f"server.HOST, server.PORT = '127.0.0.1', {port}\n"
+            f"server.GOAL_RECONCILE_AT = server.ARCHIVE_AT = server.BACKUP_AT = None\n"
+            f"supervisor.Supervisor({workers}).run()\n")
+    proc = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return proc, port, db_file
+
+def _request(port, request, timeout=5):
+    """建立新连接发送一个未分帧的 JSON 请求并返回响应"""
+    import json
+    import socket
+    deadline = time.monotonic() + 15
+    while True:
+        try:
+            sock = socket.create_connection(('127.0.0.1', port), timeout=timeout)
+            break
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+    try:
+        sock.sendall(json.dumps(request).encode())
+        return json.loads(sock.recv(1 << 20))
+    finally:
+        sock.close()
+
+def _stop_supervisor(proc):
+    import signal
+    proc.send_signal(signal.SIGTERM)
+    try:
+        proc.wait(20)
+    except Exception:
+        proc.kill()
+        proc.wait()
+
+def _worker_pids(pid):
+    """主进程的工作进程 pid（spawn 启动的子进程，不含 resource_tracker 等辅助进程）"""
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        children = [int(p) for p in f.read().split()]
+    pids = set()
+    for child in children:
+        try:
+            with open(f"/proc/{child}/cmdline", 'rb') as f:
+                if b'spawn_main' in f.read():
+                    pids.add(child)
+        except OSError:
+            pass
+    return pids
+
+def test_ipc_hub():
+    """测试事件中转：多个线程同时广播时，各工作进程通道上的消息完整、不交错"""
+    import threading
+    from multiprocessing import Pipe
+    import ipc
+    import session
+    print("\n[测试] 进程间事件广播...")
+    hub = ipc.Hub(session.SessionManager())
+    worker_conn, hub_conn = Pipe()
+    hub.add(1, hub_conn)
+    assert worker_conn.recv()["type"] == "session_snapshot"
+    received = []
+    reader = threading.Thread(target=lambda: received.extend(worker_conn.recv() for _ in range(200)), daemon=True)
+    reader.start()
+    # 超过管道缓冲区的消息需要多次写入，未加锁时并发发送会交错
+    senders = [threading.Thread(target=lambda n=n: [hub.broadcast({"type": "cache_invalidate", "sender": n, "seq": i,
+                                                                   "payload": "x" * 200000}) for i in range(25)],
+                                daemon=True) for n in range(8)]
+    for t in senders:
+        t.start()
+    reader.join(10)
+    assert not reader.is_alive(), "消息交错，接收端无法解析"
+    assert len(received) == 200 and all(len(e["payload"]) == 200000 for e in received)
+    for n in range(8):
+        assert [e["seq"] for e in received if e["sender"] == n] == list(range(25))
+    hub.remove(1)
+    worker_conn.close()
+    print("✅ 并发广播的消息完整有序")
+
+def test_supervisor():
+    """测试多进程模式：请求经工作进程的请求执行器处理，工作进程被杀后自动重启并继续服务"""
+    import signal
+    print("\n[测试] 多进程服务...")
+    proc, port, db_file = _start_supervisor()
+    login = {"action": "login", "payload": {"username": "admin", "password": "123456"}}
+    try:
+        assert _request(port, login)["status"] == "success"
+        # 主进程中设置的配置（数据库路径）传给了 spawn 启动的工作进程
+        register = {"action": "register", "payload": {"username": "spawned", "password": "abc123", "age": 30,
+                                                      "gender": "男"}}
+        assert _request(port, register)["status"] == "success"
+        conn = sqlite3.connect(db_file)
+        assert conn.execute("SELECT COUNT(*) FROM users WHERE username = 'spawned'").fetchone()[0] == 1
+        conn.close()
+        (old,) = _worker_pids(proc.pid)
+        os.kill(old, signal.SIGKILL)
+        deadline = time.monotonic() + 15
+        while _worker_pids(proc.pid) in (set(), {old}) and time.monotonic() < deadline:
+            time.sleep(0.1)
+        assert _request(port, login)["status"] == "success"
+        (new,) = _worker_pids(proc.pid)
+        assert new != old and proc.poll() is None
+        print(f"✅ 工作进程正常处理登录请求，被杀后已重启 ({old} -> {new})")
+    finally:
+        _stop_supervisor(proc)
 
 def test_server_connection():
     """测试服务器连接"""
@@ -149,6 +1265,32 @@ if __name__ == "__main__":
     
     # 测试数据库
     test_database()
+    test_importer()
+    test_user_search()
+    test_history_search()
+    test_reminder_scheduler()
+    test_goal_progress()
+    test_write_queue()
+    test_delete_user()
+    test_migrations()
+    test_schema_upgrade()
+    test_archive()
+    test_shards()
+    test_backup()
+    test_result_cache()
+    test_replica()
+    test_slow_query()
+    test_record_ownership()
+    test_dispatch()
+    test_connections()
+    test_session()
+    test_password_upgrade()
+    test_kdf_limit()
+    test_columnar_codec()
+    test_request_pool()
+    test_metrics()
+    test_ipc_hub()
+    test_supervisor()
     
     # 测试服务器连接
     test_server_connection()
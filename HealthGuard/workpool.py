@@ -0,0 +1,98 @@
+import heapq
+import itertools
+import math
+import threading
+import time
+from concurrent.futures import Future
+
+# 优先级：数值越小越先执行
+PRIORITY_HIGH = 0      # 登录、会话恢复
+PRIORITY_WRITE = 1     # 用户数据写入
+PRIORITY_NORMAL = 2    # 普通查询
+PRIORITY_LOW = 3       # 管理员检索、统计、批量导入等重操作
+
+ACTION_PRIORITY = {
+    "login": PRIORITY_HIGH, "resume_session": PRIORITY_HIGH, "logout": PRIORITY_HIGH,
+    "register": PRIORITY_HIGH,
+    "get_server_load": PRIORITY_HIGH, "list_connections": PRIORITY_HIGH, "evict_connection": PRIORITY_HIGH,
+    "get_server_metrics": PRIORITY_HIGH,
+    "add_record": PRIORITY_WRITE, "add_diet": PRIORITY_WRITE, "add_medication": PRIORITY_WRITE,
+    "add_goal": PRIORITY_WRITE, "add_reminder": PRIORITY_WRITE, "update_profile": PRIORITY_WRITE,
+    "update_goal_progress": PRIORITY_WRITE, "mark_read": PRIORITY_WRITE,
+    "get_all_users": PRIORITY_LOW, "get_sys_stats": PRIORITY_LOW, "import_records": PRIORITY_LOW,
+    "delete_user": PRIORITY_LOW, "batch": PRIORITY_LOW,
+}
+
+# 各优先级可占用的队列比例：过载时低优先级请求先被拒绝，为登录和写入留出余量
+ADMISSION_SHARE = {PRIORITY_HIGH: 1.0, PRIORITY_WRITE: 0.9, PRIORITY_NORMAL: 0.75, PRIORITY_LOW: 0.5}
+
+
+def priority_of(action):
+    return ACTION_PRIORITY.get(action, PRIORITY_NORMAL)
+
+
+class RequestPool:
+    """固定线程数 + 有界优先级队列的请求执行器
+
+    队列超过该优先级的准入上限时立即拒绝（返回 None），由调用方回复"服务器繁忙"，
+    避免突发流量下所有请求一起变慢。
+    """
+
+    def __init__(self, workers, max_queue):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._avg_service = 0.01  # 单个请求平均耗时（秒），指数滑动平均
+        self.stats = {"submitted": 0, "completed": 0, "rejected": 0, "max_depth": 0,
+                      "rejected_by_priority": {p: 0 for p in ADMISSION_SHARE}}
+        for i in range(workers):
+            threading.Thread(target=self._work, daemon=True, name=f"request-{i}").start()
+
+    def submit(self, priority, fn, *args):
+        """提交任务，返回 Future；队列已满时返回 None"""
+        limit = math.ceil(self.max_queue * ADMISSION_SHARE.get(priority, 1.0))
+        with self._cond:
+            if len(self._heap) >= limit:
+                self.stats["rejected"] += 1
+                self.stats["rejected_by_priority"][priority] = self.stats["rejected_by_priority"].get(priority, 0) + 1
+                return None
+            future = Future()
+            heapq.heappush(self._heap, (priority, next(self._seq), future, fn, args))
+            self.stats["submitted"] += 1
+            self.stats["max_depth"] = max(self.stats["max_depth"], len(self._heap))
+            self._cond.notify()
+        return future
+
+    def retry_after(self):
+        """按当前队列深度和平均耗时估算建议的重试等待秒数"""
+        return max(1, math.ceil(len(self._heap) * self._avg_service / self.workers))
+
+    def depth(self):
+        return len(self._heap)
+
+    def snapshot(self):
+        with self._cond:
+            stats = dict(self.stats, rejected_by_priority=dict(self.stats["rejected_by_priority"]))
+        stats.update(depth=len(self._heap), workers=self.workers, max_queue=self.max_queue,
+                     avg_service_ms=round(self._avg_service * 1000, 2))
+        return stats
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, future, fn, args = heapq.heappop(self._heap)
+            if not future.set_running_or_notify_cancel():
+                continue
+            start = time.perf_counter()
+            try:
+                future.set_result(fn(*args))
+            except BaseException as e:
+                future.set_exception(e)
+            elapsed = time.perf_counter() - start
+            with self._cond:
+                self.stats["completed"] += 1
+                self._avg_service += (elapsed - self._avg_service) * 0.05
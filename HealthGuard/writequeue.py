@@ -0,0 +1,129 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import database
+
+# 每组最多写入的条数，以及组内第一条入队后最多等待的毫秒数：满足任一条件即提交
+GROUP_ROWS = 256
+GROUP_MS = 5
+# 每个分片的队列上限，超出时拒绝写入，由调用方回复繁忙
+MAX_PENDING = 10000
+
+# 写入确认时机：入队即确认（最快，进程崩溃时可能丢失尚未提交的一组），或提交落盘后确认
+ACK_ENQUEUE = 'enqueue'
+ACK_COMMIT = 'commit'
+
+
+class Timeout(Exception):
+    """写入在等待时限内未提交（仍在队列中，之后可能提交）"""
+
+
+class WriteQueue:
+    """写后台队列（write-behind）
+
+    请求线程只把校验后的写入放进队列，写线程攒够 GROUP_ROWS 条或等满 GROUP_MS 毫秒后
+    在一个事务中写入并提交，多条写入共享一次 fsync。每条写入包在 SAVEPOINT 中，
+    单条失败只回滚它自己，不影响同组其他写入。每个分片一个队列与写线程，按 user_id 路由，各分片并行提交。
+    """
+
+    def __init__(self, group_rows=GROUP_ROWS, group_ms=GROUP_MS, max_pending=MAX_PENDING):
+        self.group_rows = group_rows
+        self.group_wait = group_ms / 1000
+        self._queues = [queue.Queue(max_pending) for _ in range(database.SHARDS)]
+        self._threads = []
+        self._lock = threading.Lock()
+        # db_seconds：写线程上的数据库耗时，不计入各接口的 db 耗时（请求线程只负责入队）
+        self.stats = {"enqueued": 0, "committed": 0, "failed": 0, "groups": 0, "max_group": 0, "rejected": 0,
+                      "db_seconds": 0.0}
+
+    def start(self):
+        for shard in range(len(self._queues)):
+            thread = threading.Thread(target=self._run, args=(shard,), daemon=True, name=f'write-behind-{shard}')
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        """写完队列中已有的写入后退出写线程"""
+        if self._threads:
+            for q in self._queues:
+                q.put(None)
+            for thread in self._threads:
+                thread.join(timeout)
+
+    def submit(self, insert, user_id, *args):
+        """入队一条写入：insert(conn, user_id, *args) 在该用户所在分片的写线程中执行并返回消息；队列已满时返回 None"""
+        future = Future()
+        try:
+            self._queues[database.shard_of(user_id)].put_nowait((insert, (user_id,) + args, future))
+        except queue.Full:
+            self.stats["rejected"] += 1
+            return None
+        self.stats["enqueued"] += 1
+        return future
+
+    def depth(self):
+        return sum(q.qsize() for q in self._queues)
+
+    def _run(self, shard):
+        q = self._queues[shard]
+        conn = database.shard_connection(shard)
+        try:
+            stopping = False
+            while not stopping:
+                item = q.get()
+                if item is None:
+                    break
+                group = [item]
+                deadline = time.monotonic() + self.group_wait
+                while len(group) < self.group_rows:
+                    try:
+                        item = q.get(timeout=max(0, deadline - time.monotonic()))
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        stopping = True
+                        break
+                    group.append(item)
+                self._commit(conn, group)
+        finally:
+            conn.close()
+
+    def _commit(self, conn, group):
+        """在一个事务中写入一组；BEGIN、保存点或提交出错（如数据库被锁）时整组失败，写线程继续处理后续写入"""
+        results = []
+        db_start = database.db_seconds()
+        try:
+            conn.execute("BEGIN")
+            for insert, args, future in group:
+                conn.execute("SAVEPOINT write_item")
+                try:
+                    message = insert(conn, *args)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write_item")
+                    conn.execute("RELEASE write_item")
+                    results.append((future, None, e))
+                    continue
+                conn.execute("RELEASE write_item")
+                results.append((future, message, None))
+            conn.commit()
+        except Exception as e:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            print(f"[WRITER] 提交失败，本组 {len(group)} 条写入丢弃: {e}")
+            results = [(future, None, e) for _, _, future in group]
+        with self._lock:
+            self.stats["groups"] += 1
+            self.stats["max_group"] = max(self.stats["max_group"], len(group))
+            failed = sum(1 for _, _, error in results if error is not None)
+            self.stats["committed"] += len(results) - failed
+            self.stats["failed"] += failed
+            self.stats["db_seconds"] += database.db_seconds() - db_start
+        for future, message, error in results:
+            if error is None:
+                future.set_result(message)
+            else:
+                print(f"[WRITER] 写入失败: {error}")
+                future.set_exception(error)